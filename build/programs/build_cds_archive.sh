@@ -0,0 +1,86 @@
+#!/bin/bash
+set -euo pipefail
+
+source /usr/local/lib/ib_utils
+
+# Image build step: launch IB through IBC up to its login dialog on a private
+# display, then stop it so the JVM dumps the classes it loaded into an AppCDS
+# archive. Blank credentials keep the training run from contacting IB.
+
+# Start the training display through start_xvfb, which holds the readiness
+# FIFO open once Xvfb is up; start_ibc's wait_for_x_server blocks on it.
+start_training_display() {
+	VNC_SCREEN_DIMENSION=1024x768x24 start_xvfb &
+	xvfb_pid="$!"
+}
+
+build_cds_archive() {
+	local training_dir
+	local training_seconds="${CDS_TRAINING_SECONDS:-60}"
+	local dump_pattern="-XX:ArchiveClassesAtExit="
+	local vmoptions_backup
+	local vmoptions_file
+	local xvfb_pid
+	local ibc_pid
+	local waited=0
+
+	if ! [[ "$training_seconds" =~ ^[1-9][0-9]*$ ]]; then
+		log "ERROR: CDS_TRAINING_SECONDS must be a positive whole number: ${training_seconds}"
+		exit 1
+	fi
+	ensure_env PROGRAM
+	IB_RELEASE_DIR="$(resolve_ib_release_dir)"
+	vmoptions_file="${IB_RELEASE_DIR}/${PROGRAM}.vmoptions"
+	ensure_file "$vmoptions_file" "IB vmoptions"
+
+	training_dir="$(mktemp -d)"
+	vmoptions_backup="${training_dir}/${PROGRAM}.vmoptions"
+	cp -p "$vmoptions_file" "$vmoptions_backup"
+	# The runtime state written under /tmp must not ship in the image.
+	# shellcheck disable=SC2064
+	trap "cp -p '$vmoptions_backup' '$vmoptions_file'; rm -rf '$training_dir' /tmp/ib-ibc; rm -f '$(x_ready_fifo :99)'" EXIT
+
+	mkdir -p "${training_dir}/home/tws_settings"
+	cp "${HOME}/vmoptions.j2" "${training_dir}/home/vmoptions.j2"
+	printf '%s\n' "IbLoginId=" "IbPassword=" "TradingMode=paper" \
+		"LoginDialogDisplayTimeout=600" >"${training_dir}/ibc.ini"
+
+	export HOME="${training_dir}/home"
+	export TWS_SETTINGS_PATH="${HOME}/tws_settings"
+	export IBC_INI="${training_dir}/ibc.ini"
+	export DISPLAY=":99"
+	export TRADING_MODE=paper
+	export STARTUP_PHASES_FILE="${training_dir}/phases.jsonl"
+	unset X_SCRIPTS IBC_SCRIPTS
+
+	init_container_settings --cds-training
+
+	start_training_display
+	start_ibc &
+	ibc_pid="$!"
+
+	log "Training AppCDS archive for ${training_seconds} seconds"
+	sleep "$training_seconds"
+	if ! pkill -TERM -f -- "$dump_pattern"; then
+		log "ERROR: IB exited before the AppCDS training window ended"
+		kill "$ibc_pid" "$xvfb_pid" 2>/dev/null || true
+		exit 1
+	fi
+	# The JVM writes the archive during shutdown; give it time before giving up.
+	while pgrep -f -- "$dump_pattern" >/dev/null 2>&1; do
+		if [ "$waited" -ge 120 ]; then
+			log "ERROR: IB did not exit after the AppCDS training run"
+			pkill -KILL -f -- "$dump_pattern" || true
+			break
+		fi
+		sleep 1
+		waited=$((waited + 1))
+	done
+	wait "$ibc_pid" 2>/dev/null || true
+	kill "$xvfb_pid" 2>/dev/null || true
+	wait "$xvfb_pid" 2>/dev/null || true
+
+	init_container_settings --cds-record
+}
+
+build_cds_archive
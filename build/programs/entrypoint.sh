@@ -44,17 +44,38 @@ cleanup_x_server() {
 DISPLAY="$(x_server_display "${DISPLAY:-:1}")"
 export DISPLAY
 
+# Each container start gets a fresh startup timeline.
+mkdir -p "${STARTUP_PHASES_FILE%/*}" 2>/dev/null || true
+: >"$STARTUP_PHASES_FILE" 2>/dev/null || true
+phase_begin entrypoint
+# /tmp survives container restarts; never report the previous run as ready.
+rm -f /tmp/ib-health/ready
+# Nor treat its X hooks or IBC exit as this run's; see start_ibc.
+rm -f /tmp/ib-ibc/warm /tmp/ib-ibc/exited
+# Nor replay its IBC output and events into this run's login state and metrics.
+rm -f /tmp/ib-ibc/ibc.log /tmp/ib-ibc/ibc.log.1 \
+	/tmp/ib-ibc/events.jsonl /tmp/ib-ibc/events.jsonl.1
+# Restart backoff and window caps count from this container start.
+rm -rf /tmp/ib-restarts
+
 # Perform initial cleanup
+phase_begin cleanup_x_server
 cleanup_x_server
+phase_end cleanup_x_server
 
 file_env IB_USER
 file_env IB_PASSWORD
 
+phase_begin start_scripts
 run_script_dir START_SCRIPTS "startup"
+phase_end start_scripts
 
 log "Initializing runtime configuration"
+phase_begin init_container_settings
 init_container_settings
+phase_end init_container_settings
 unset IB_PASSWORD
+phase_end entrypoint
 
 log "Starting supervisord with DISPLAY=$DISPLAY"
 
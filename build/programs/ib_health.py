@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import json
+import os
+import re
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import xmlrpc.client
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import TextIO
+
+# Written by ibc_events; keep in sync with its IBC_EVENTS_PATH.
+IBC_EVENTS_PATH = Path("/tmp/ib-ibc/events.jsonl")
+SUPERVISOR_SOCKET_PATH = Path("/tmp/supervisor.sock")
+X11_SOCKET_DIR = Path("/tmp/.X11-unix")
+# The HEALTHCHECK reads STATUS_DIR/ready, which only exists while ready, and
+# rejects it once the expiry it starts with has passed.
+STATUS_DIR = Path("/tmp/ib-health")
+STATUS_INTERVAL_SECONDS = 15.0
+# Two rounds, so one slow round of probe timeouts does not expire a ready file.
+STATUS_TTL_SECONDS = 2 * STATUS_INTERVAL_SECONDS
+DEFAULT_HEALTH_PORT = 9405
+PROBE_TIMEOUT_SECONDS = 3.0
+# X11 connection setup (little-endian, protocol 11.0, no auth as Xvfb runs with
+# -ac) and a GetInputFocus round trip, the cheapest request with a reply.
+X_SETUP_REQUEST = struct.pack("<BxHHHHxx", ord("l"), 11, 0, 0, 0)
+X_GET_INPUT_FOCUS = struct.pack("<BxH", 43, 1)
+SUPERVISED_PROGRAMS = ("xvfb", "ibc")
+API_PORTS = {
+    ("ibgateway", "live"): 4001,
+    ("ibgateway", "paper"): 4002,
+    ("tws", "live"): 7496,
+    ("tws", "paper"): 7497,
+}
+# TWS API handshake: "API\0" then a length-prefixed supported version range.
+API_CLIENT_VERSIONS = b"v100..176"
+# ibc_events event types that move the login state.
+LOGIN_STATE_BY_EVENT = {
+    "ibc_started": "logging_in",
+    "login_started": "logging_in",
+    "twofa_pending": "twofa_pending",
+    "twofa_timeout": "logged_out",
+    "existing_session": "logged_out",
+    "logged_in": "logged_in",
+    "api_ready": "logged_in",
+    "auto_restart": "logged_out",
+    "exit": "logged_out",
+}
+# States that veto readiness even when the API port still answers.
+NOT_READY_LOGIN_STATES = frozenset({"logging_in", "twofa_pending", "logged_out"})
+
+
+@dataclass
+class LoginTracker:
+    state: str = "unknown"
+    changed_at: float | None = None
+
+    def record_line(self, line: str) -> bool:
+        """Update the login state from one ibc_events line; return whether it changed."""
+        try:
+            state = LOGIN_STATE_BY_EVENT.get(json.loads(line).get("event"))
+        except (ValueError, AttributeError):
+            return False
+        if state is None or state == self.state:
+            return False
+        self.state = state
+        self.changed_at = time.time()
+        return True
+
+
+class LogFollower:
+    """Read new log lines, starting over when the file is replaced or truncated."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.handle: TextIO | None = None
+        self.inode: int | None = None
+        self.partial = ""
+
+    def read_lines(self) -> list[str]:
+        lines = self.drain()
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return lines
+        if (
+            self.handle is None
+            or stat.st_ino != self.inode
+            or stat.st_size < self.handle.tell()
+        ):
+            if self.handle is not None:
+                self.handle.close()
+            self.handle = self.path.open(encoding="utf-8", errors="replace")
+            self.inode = stat.st_ino
+            self.partial = ""
+            lines += self.drain()
+        return lines
+
+    def drain(self) -> list[str]:
+        if self.handle is None:
+            return []
+        *lines, self.partial = (self.partial + self.handle.read()).split("\n")
+        return lines
+
+
+class UnixSocketHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: Path, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(str(self.socket_path))
+
+
+class UnixSocketTransport(xmlrpc.client.Transport):
+    """XML-RPC transport for supervisord's unix_http_server socket."""
+
+    def __init__(self, socket_path: Path, timeout: float) -> None:
+        super().__init__()
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def make_connection(self, host: object) -> http.client.HTTPConnection:
+        # Reuse one keep-alive connection across polls; Transport.close() drops
+        # it after an error so the next poll reconnects.
+        if self._connection[1] is None:
+            self._connection = (
+                host,
+                UnixSocketHTTPConnection(self.socket_path, self.timeout),
+            )
+        return self._connection[1]
+
+
+class SupervisorClient:
+    """Query supervisord over one persistent XML-RPC connection."""
+
+    def __init__(
+        self,
+        socket_path: Path = SUPERVISOR_SOCKET_PATH,
+        timeout: float = PROBE_TIMEOUT_SECONDS,
+    ) -> None:
+        self.proxy = xmlrpc.client.ServerProxy(
+            "http://localhost", transport=UnixSocketTransport(socket_path, timeout)
+        )
+
+    def states(self) -> dict[str, str]:
+        """Return the supervisord state name of each program."""
+        return {
+            info["name"]: info["statename"]
+            for info in self.proxy.supervisor.getAllProcessInfo()
+        }
+
+
+def read_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed before the reply was complete")
+        data += chunk
+    return data
+
+
+class XConnection:
+    """Keep one X11 client connection open and ping it instead of forking xset."""
+
+    def __init__(self, display: str, socket_dir: Path = X11_SOCKET_DIR) -> None:
+        self.display = display
+        self.socket_dir = socket_dir
+        self.sock: socket.socket | None = None
+
+    def connect(self) -> socket.socket:
+        match = re.fullmatch(r":(\d+)(?:\.\d+)?", self.display)
+        if match is None:
+            raise ValueError(f"Invalid DISPLAY value: {self.display}")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(PROBE_TIMEOUT_SECONDS)
+            sock.connect(str(self.socket_dir / f"X{match.group(1)}"))
+            sock.sendall(X_SETUP_REQUEST)
+            status, _, _, _, length = struct.unpack("<BBHHH", read_exact(sock, 8))
+            read_exact(sock, length * 4)
+            if status != 1:
+                raise ConnectionError("X server refused the connection setup")
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def ping(self) -> bool:
+        """Return whether the X server answers a request, reconnecting if needed."""
+        try:
+            if self.sock is None:
+                self.sock = self.connect()
+            self.sock.sendall(X_GET_INPUT_FOCUS)
+            if read_exact(self.sock, 32)[0] != 1:
+                raise ConnectionError("X server answered GetInputFocus with an error")
+        except (OSError, ValueError):
+            self.close()
+            return False
+        return True
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def api_handshake(
+    port: int, host: str = "127.0.0.1", timeout: float = PROBE_TIMEOUT_SECONDS
+) -> int:
+    """Complete the TWS API version handshake and return the server version."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(
+            b"API\0" + struct.pack(">I", len(API_CLIENT_VERSIONS)) + API_CLIENT_VERSIONS
+        )
+        (size,) = struct.unpack(">I", read_exact(sock, 4))
+        if not 0 < size <= 1024:
+            raise ValueError(f"Unexpected API handshake length: {size}")
+        server_version = read_exact(sock, size).split(b"\0", 1)[0]
+    if not server_version.isdigit():
+        raise ValueError(f"Unexpected API server version: {server_version!r}")
+    return int(server_version)
+
+
+def api_port() -> int:
+    """Return the API port IB listens on for this program and trading mode."""
+    override = os.getenv("OVERRIDE_TWS_API_PORT") or ""
+    if override:
+        if not override.isdigit() or not 1 <= int(override) <= 65535:
+            raise ValueError(f"OVERRIDE_TWS_API_PORT must be a TCP port: {override}")
+        return int(override)
+    program = os.getenv("PROGRAM", "")
+    trading_mode = os.getenv("TRADING_MODE") or "paper"
+    try:
+        return API_PORTS[(program, trading_mode)]
+    except KeyError:
+        raise ValueError(
+            f"No API port for PROGRAM={program} TRADING_MODE={trading_mode}"
+        ) from None
+
+
+def health_port() -> int:
+    """Return the localhost port for the health endpoint."""
+    value = os.getenv("HEALTH_PORT") or str(DEFAULT_HEALTH_PORT)
+    if not value.isdigit() or not 1 <= int(value) <= 65535:
+        raise ValueError(f"HEALTH_PORT must be a TCP port: {value}")
+    return int(value)
+
+
+@dataclass
+class HealthStatus:
+    live: bool
+    ready: bool
+    checks: dict[str, str] = field(default_factory=dict)
+    checked_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "live": self.live,
+                "ready": self.ready,
+                "checks": self.checks,
+                "checked_at": round(self.checked_at, 3),
+            }
+        )
+
+    def expires_at(self) -> int:
+        return int(self.checked_at + STATUS_TTL_SECONDS)
+
+
+def write_status(status: HealthStatus, status_dir: Path = STATUS_DIR) -> None:
+    """Publish status.json, and the ready file only while ready, atomically.
+
+    The ready file leads with its expiry in epoch seconds, so the HEALTHCHECK
+    fails once the agent stops refreshing it.
+    """
+    status_dir.mkdir(parents=True, exist_ok=True)
+    content = status.to_json() + "\n"
+    ready_path = status_dir / "ready"
+    targets = {status_dir / "status.json": content}
+    if status.ready:
+        targets[ready_path] = f"{status.expires_at()} {content}"
+    for target, text in targets.items():
+        temp_path = target.with_name(f".{target.name}.tmp")
+        temp_path.write_text(text)
+        os.replace(temp_path, target)
+    if not status.ready:
+        ready_path.unlink(missing_ok=True)
+
+
+class HealthProbe:
+    """Check liveness (processes and X) and readiness (login state and API port)."""
+
+    def __init__(
+        self,
+        port: int,
+        display: str,
+        events_path: Path = IBC_EVENTS_PATH,
+        states: Callable[[], dict[str, str]] | None = None,
+        x_socket_dir: Path = X11_SOCKET_DIR,
+    ) -> None:
+        self.port = port
+        self.states = states or SupervisorClient().states
+        self.x_connection = XConnection(display, x_socket_dir)
+        self.login = LoginTracker()
+        self.follower = LogFollower(events_path)
+        self.status: HealthStatus | None = None
+
+    def check(self) -> HealthStatus:
+        checks: dict[str, str] = {}
+        try:
+            states = self.states()
+        except (OSError, xmlrpc.client.Error) as exc:
+            states = {}
+            checks["supervisord"] = f"unreachable: {exc}"
+        for program in SUPERVISED_PROGRAMS:
+            checks[program] = states.get(program, "UNKNOWN")
+        checks["x_server"] = "ok" if self.x_connection.ping() else "unreachable"
+        live = checks["x_server"] == "ok" and all(
+            checks[program] == "RUNNING" for program in SUPERVISED_PROGRAMS
+        )
+
+        for line in self.follower.read_lines():
+            self.login.record_line(line)
+        checks["login"] = self.login.state
+        try:
+            checks["api"] = f"ok: server version {api_handshake(self.port)}"
+        except (OSError, ValueError) as exc:
+            checks["api"] = f"unavailable: {exc}"
+        ready = (
+            live
+            and checks["api"].startswith("ok")
+            and self.login.state not in NOT_READY_LOGIN_STATES
+        )
+        return HealthStatus(live, ready, checks)
+
+    def refresh(self) -> HealthStatus:
+        """Run the checks and keep the result for the HTTP endpoint."""
+        self.status = self.check()
+        return self.status
+
+
+def make_server(probe: HealthProbe, port: int) -> HTTPServer:
+    """Return a localhost server for /livez, /readyz and /health."""
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path not in ("/livez", "/readyz", "/health"):
+                self.send_error(404)
+                return
+            status = probe.status or probe.refresh()
+            healthy = status.ready if self.path == "/readyz" else status.live
+            # A stalled check loop must not keep serving its last good answer.
+            healthy = healthy and time.time() < status.expires_at()
+            body = (status.to_json() + "\n").encode()
+            self.send_response(200 if healthy else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            return
+
+    return HTTPServer(("127.0.0.1", port), HealthHandler)
+
+
+def probe_endpoint(kind: str, port: int) -> bool:
+    """Ask the running health agent for liveness or readiness, as the HEALTHCHECK does."""
+    url = f"http://127.0.0.1:{port}/{'readyz' if kind == 'ready' else 'livez'}"
+    try:
+        with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT_SECONDS * 3) as response:
+            body = response.read().decode()
+    except urllib.error.HTTPError as exc:
+        body = exc.read().decode()
+        print(body, end="")
+        return False
+    print(body, end="")
+    return True
+
+
+def stop(signum: int, frame: object) -> None:
+    """Turn supervisord's SIGTERM into SystemExit so the ready file is removed."""
+    raise SystemExit(0)
+
+
+def run(argv: list[str] | None = None) -> int:
+    """Run the health agent or a one-shot probe from the command line."""
+    parser = argparse.ArgumentParser(prog="ib_health")
+    parser.add_argument("--ibc-events", type=Path, default=IBC_EVENTS_PATH)
+    parser.add_argument("--status-dir", type=Path, default=STATUS_DIR)
+    parser.add_argument(
+        "--probe",
+        choices=("live", "ready"),
+        help="Query the running agent and exit 0 only when healthy",
+    )
+    args = parser.parse_args(argv or [])
+    try:
+        port = health_port()
+        if args.probe:
+            return 0 if probe_endpoint(args.probe, port) else 1
+        probe = HealthProbe(api_port(), os.getenv("DISPLAY") or ":1", args.ibc_events)
+        server = make_server(probe, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving IB health on http://127.0.0.1:{port}/livez and /readyz")
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while True:
+                write_status(probe.refresh(), args.status_dir)
+                time.sleep(STATUS_INTERVAL_SECONDS)
+        finally:
+            # Stopped or crashed: the container is no longer known to be ready.
+            (args.status_dir / "ready").unlink(missing_ok=True)
+    except (ValueError, OSError) as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run(sys.argv[1:]))
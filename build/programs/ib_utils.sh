@@ -5,6 +5,57 @@ log() {
 	echo "$timestamp  $1"
 }
 
+STARTUP_PHASES_FILE="${STARTUP_PHASES_FILE:-/tmp/ib-startup/phases.jsonl}"
+X_READY_DIR="${X_READY_DIR:-/tmp/ib-x-ready}"
+
+# Append a startup phase event. Timestamps are seconds on the boot clock from
+# /proc/uptime, which init_container_settings also uses, so every stage of a
+# start lines up on one timeline without forking date.
+phase_mark() {
+	local event="$1"
+	local phase="$2"
+	local uptime
+	local _
+
+	read -r uptime _ </proc/uptime || return 0
+	if [ ! -d "${STARTUP_PHASES_FILE%/*}" ]; then
+		mkdir -p "${STARTUP_PHASES_FILE%/*}" 2>/dev/null || return 0
+	fi
+	printf '{"t": %s, "event": "%s", "phase": "%s", "pid": %s}\n' \
+		"$uptime" "$event" "$phase" "$$" >>"$STARTUP_PHASES_FILE" 2>/dev/null || true
+}
+
+phase_begin() {
+	phase_mark begin "$1"
+}
+
+phase_end() {
+	phase_mark end "$1"
+}
+
+# Copy stdin to stdout and to a log file. Once the file reaches max_bytes it is
+# moved to <file>.1 and a new one started, so followers see a rotation.
+tee_bounded() {
+	local file="$1"
+	local max_bytes="$2"
+	local size=0
+	local line
+	local fd
+
+	exec {fd}>"$file"
+	while IFS= read -r line || [ -n "$line" ]; do
+		printf '%s\n' "$line"
+		printf '%s\n' "$line" >&"$fd"
+		size=$((size + ${#line} + 1))
+		if [ "$size" -ge "$max_bytes" ]; then
+			exec {fd}>&-
+			mv -f "$file" "$file.1" || true
+			exec {fd}>"$file"
+			size=0
+		fi
+	done
+}
+
 ensure_env() {
 	local name="$1"
 
@@ -47,12 +98,91 @@ unset_file_env() {
 	fi
 }
 
+# Store the seconds elapsed since a /proc/uptime reading in the named variable.
+# The locals are prefixed so they never shadow the caller's variable.
+elapsed_since() {
+	local __result_name="$1"
+	local __since="$2"
+	local __now
+	local __centiseconds
+	local __rest
+
+	read -r __now __rest </proc/uptime || __now="$__since"
+	# /proc/uptime has two decimals, so drop the dot to work in centiseconds.
+	__centiseconds=$((10#${__now/./} - 10#${__since/./}))
+	printf -v "$__result_name" '%d.%02d' $((__centiseconds / 100)) $((__centiseconds % 100))
+}
+
+# Stop hooks started by run_hook and wait for them. timeout makes each timed
+# hook the leader of its own process group, which supervisord's stopasgroup
+# and the caller's signal never reach, so signal the group when there is one.
+stop_hooks() {
+	local pid
+
+	for pid in "$@"; do
+		if [ -n "$pid" ]; then
+			kill -TERM -- "-${pid}" 2>/dev/null || kill -TERM "$pid" 2>/dev/null || true
+		fi
+	done
+	for pid in "$@"; do
+		if [ -n "$pid" ]; then
+			wait "$pid" 2>/dev/null || true
+		fi
+	done
+}
+
+# Run one hook under its timeout, logging how long it took.
+run_hook() {
+	local phase="$1"
+	local script_path="$2"
+	local timeout_seconds="$3"
+	local hook_name="${script_path##*/}"
+	local started
+	local elapsed
+	local status=0
+	local hook_pid
+	local _
+
+	read -r started _ </proc/uptime
+	log "Running ${phase} hook: ${script_path}"
+	phase_begin "hook:${hook_name}"
+	# Wait on a background hook so bash runs a TERM trap without waiting for
+	# the hook to finish; the trap reads hook_pid to stop it.
+	if [ "$timeout_seconds" -gt 0 ]; then
+		# timeout runs the hook in its own process group and kills all of it.
+		timeout --kill-after=5 "$timeout_seconds" "$script_path" &
+	else
+		"$script_path" &
+	fi
+	hook_pid="$!"
+	wait "$hook_pid" || status=$?
+	phase_end "hook:${hook_name}"
+	elapsed_since elapsed "$started"
+	if [ "$status" -eq 124 ] || [ "$status" -eq 137 ]; then
+		log "ERROR: ${phase} hook timed out after ${timeout_seconds}s: ${script_path}"
+	elif [ "$status" -ne 0 ]; then
+		log "ERROR: ${phase} hook failed with status ${status} after ${elapsed}s: ${script_path}"
+	else
+		log "${phase} hook finished in ${elapsed}s: ${script_path}"
+	fi
+	return "$status"
+}
+
 run_script_dir() {
 	local name="$1"
 	local phase="$2"
 	local scripts_dir="${!name:-}"
+	local default_timeout="${HOOK_TIMEOUT_SECONDS:-0}"
 	local script_path
 	local scripts=()
+	local options=()
+	local option
+	local parallel
+	local timeout_seconds
+	local running=()
+	local pid
+	local failed=0
+	local saved_traps
 
 	if [ -z "$scripts_dir" ]; then
 		log "${phase} hooks disabled (${name} is not set)"
@@ -80,14 +210,67 @@ run_script_dir() {
 		return 0
 	fi
 
+	if [[ ! $default_timeout =~ ^[0-9]+$ ]]; then
+		log "ERROR: HOOK_TIMEOUT_SECONDS must be a whole number of seconds: ${default_timeout}"
+		return 1
+	fi
 	for script_path in "${scripts[@]}"; do
 		if [ ! -x "$script_path" ]; then
 			log "ERROR: ${phase} hook is not executable: ${script_path}"
 			return 1
 		fi
-		log "Running ${phase} hook: ${script_path}"
-		"$script_path"
 	done
+
+	# On TERM or INT, stop the running hooks, then hand the signal to whatever
+	# the caller trapped before, e.g. start_ibc stopping IBC.
+	saved_traps="$(trap -p TERM INT)"
+	trap 'stop_hooks "${hook_pid:-}" "${running[@]}"; trap - TERM INT; eval "$saved_traps"; kill -s TERM "$BASHPID"' TERM
+	trap 'stop_hooks "${hook_pid:-}" "${running[@]}"; trap - TERM INT; eval "$saved_traps"; kill -s INT "$BASHPID"' INT
+
+	# NAME.parallel.sh runs alongside the other parallel hooks around it;
+	# NAME.timeout-SECONDS.sh overrides HOOK_TIMEOUT_SECONDS. Other hooks run
+	# alone, in sorted order, after every earlier hook has finished.
+	for script_path in "${scripts[@]}"; do
+		parallel=no
+		timeout_seconds="$default_timeout"
+		IFS=. read -r -a options <<<"${script_path##*/}"
+		for option in "${options[@]:1}"; do
+			case "$option" in
+			parallel) parallel=yes ;;
+			timeout-*)
+				timeout_seconds="${option#timeout-}"
+				if [[ ! $timeout_seconds =~ ^[0-9]+$ ]]; then
+					log "ERROR: ${phase} hook has an invalid timeout: ${script_path}"
+					failed=1
+					break 2
+				fi
+				;;
+			esac
+		done
+		if [ "$parallel" = "yes" ]; then
+			# Subshells drop the caller's traps, so each one stops its own hook.
+			(
+				trap 'stop_hooks "${hook_pid:-}"; exit 143' TERM INT
+				run_hook "$phase" "$script_path" "$timeout_seconds"
+			) &
+			running+=("$!")
+			continue
+		fi
+		for pid in "${running[@]}"; do
+			wait "$pid" || failed=1
+		done
+		running=()
+		if [ "$failed" -ne 0 ] || ! run_hook "$phase" "$script_path" "$timeout_seconds"; then
+			failed=1
+			break
+		fi
+	done
+	for pid in "${running[@]}"; do
+		wait "$pid" || failed=1
+	done
+	trap - TERM INT
+	eval "$saved_traps"
+	return "$failed"
 }
 
 ensure_absolute_path() {
@@ -376,7 +559,28 @@ x_display_process_pattern() {
 	printf '%s.*:%s([[:space:].]|$)\n' "$process_name" "$display_no"
 }
 
+x_ready_fifo() {
+	local display_no
+
+	display_no="$(x_display_number "${1:-${DISPLAY:-:1}}")"
+	printf '%s\n' "${X_READY_DIR}/X${display_no}"
+}
+
+ensure_x_ready_fifo() {
+	local ready_fifo="$1"
+
+	mkdir -p "${ready_fifo%/*}"
+	# Never replace an existing FIFO: a consumer may already be blocked on it.
+	if [ ! -p "$ready_fifo" ] && ! mkfifo -m 600 "$ready_fifo" 2>/dev/null && [ ! -p "$ready_fifo" ]; then
+		log "ERROR: Could not create X readiness FIFO: ${ready_fifo}"
+		exit 1
+	fi
+}
+
 wait_for_x_server() {
+	local timeout_seconds="${1:-60}"
+	local ready_fifo
+
 	DISPLAY="${DISPLAY:-:1}"
 	export DISPLAY
 
@@ -389,26 +593,65 @@ wait_for_x_server() {
 	XAUTHORITY="$HOME/.Xauthority"
 	export XAUTHORITY
 
-	# Wait for X server to be ready (xvfb should be started by supervisord)
-	timeout=60
-	while [ $timeout -gt 0 ]; do
-		if xset q >/dev/null 2>&1; then
-			log "X server is ready on ${DISPLAY}"
-			break
-		fi
+	# start_xvfb holds the FIFO open for writing once Xvfb reports readiness
+	# through -displayfd, so opening it for reading blocks until X is ready.
+	ready_fifo="$(x_ready_fifo "$DISPLAY")"
+	ensure_x_ready_fifo "$ready_fifo"
+	# shellcheck disable=SC2016
+	if ! timeout "$timeout_seconds" bash -c 'exec 3<"$1"' _ "$ready_fifo"; then
+		log "ERROR: X server failed to start within ${timeout_seconds} seconds on ${DISPLAY}"
+		log "Check if xvfb service is running properly"
+		exit 1
+	fi
+	log "X server is ready on ${DISPLAY}"
+}
 
-		# Every 10 seconds, log progress to show we're still waiting
-		if [ $((timeout % 10)) -eq 0 ]; then
-			log "Waiting for X server to start... ($timeout seconds remaining)"
-		fi
+# Print the pid of the X server on a display, from the lock file Xvfb writes.
+x_server_pid() {
+	local display_no
+	local pid=""
 
-		sleep 1
-		timeout=$((timeout - 1))
-	done
+	display_no="$(x_display_number "${1:-${DISPLAY:-:1}}")"
+	read -r pid 2>/dev/null <"/tmp/.X${display_no}-lock" || true
+	printf '%s\n' "$pid"
+}
 
-	if [ $timeout -eq 0 ]; then
-		log "ERROR: X server failed to start within 60 seconds on ${DISPLAY}"
-		log "Check if xvfb service is running properly"
-		exit 1
+# Succeed when the X hooks already ran against this X server, so a supervisord
+# restart of IBC alone can skip them.
+x_hooks_current() {
+	local warm_file="$1"
+	local x_server="$2"
+	local recorded=""
+
+	if [ "${IBC_WARM_RESTART:-yes}" != "yes" ] || [ -z "$x_server" ]; then
+		return 1
+	fi
+	read -r recorded 2>/dev/null <"$warm_file" || return 1
+	[ "$recorded" = "x_server=${x_server}" ]
+}
+
+# Record that IBC exited; the next start reports how long it was down.
+mark_ibc_exit() {
+	local exit_file="$1"
+	local uptime
+	local _
+
+	phase_begin ibc_restart
+	read -r uptime _ </proc/uptime || return 0
+	printf '%s\n' "$uptime" >"$exit_file" 2>/dev/null || true
+}
+
+report_ibc_restart_latency() {
+	local exit_file="$1"
+	local exited=""
+	local latency
+
+	read -r exited 2>/dev/null <"$exit_file" || return 0
+	rm -f "$exit_file"
+	if [[ ! $exited =~ ^[0-9]+\.[0-9]{2}$ ]]; then
+		return 0
 	fi
+	phase_end ibc_restart
+	elapsed_since latency "$exited"
+	log "IBC restarted ${latency}s after it exited"
 }
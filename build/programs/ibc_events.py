@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TextIO
+
+# start_ibc tees the IBC and IB output here; keep in sync with IBC_LOG_FILE.
+IBC_LOG_PATH = Path("/tmp/ib-ibc/ibc.log")
+# Read by ib_health and the metrics sidecar.
+IBC_EVENTS_PATH = Path("/tmp/ib-ibc/events.jsonl")
+POLL_INTERVAL_SECONDS = 0.5
+READ_CHUNK_SIZE = 64 * 1024
+# Longer lines (stack traces, dumped settings) are cut so memory stays bounded.
+MAX_LINE_LENGTH = 4096
+MAX_MESSAGE_LENGTH = 200
+MAX_EVENTS_FILE_BYTES = 1024 * 1024
+IBC_TIMESTAMP_REG = re.compile(
+    r"^(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}:\d{3}) (?P<message>.*)$"
+)
+# Checked in order; the first match classifies the line. Named groups become
+# event fields.
+EVENT_PATTERNS = (
+    ("ibc_started", re.compile(r"Starting IBC version (?P<version>\S+)")),
+    (
+        "twofa_timeout",
+        re.compile(r"Second Factor Authentication.*(?:timed out|timeout)", re.I),
+    ),
+    (
+        "twofa_pending",
+        re.compile(
+            r"Second Factor Authentication (?:initiated|dialog)"
+            r"|entitled: Second Factor Authentication; event=Opened"
+        ),
+    ),
+    ("existing_session", re.compile(r"Existing session detected", re.I)),
+    ("login_started", re.compile(r"Login dialog WINDOW_OPENED|Click button: Log In")),
+    ("logged_in", re.compile(r"Login has completed")),
+    (
+        "api_ready",
+        re.compile(
+            r"Configuration tasks completed"
+            r"|API server listening on port (?P<port>\d+)"
+        ),
+    ),
+    (
+        "auto_restart",
+        re.compile(r"IBC will restart shortly|Auto-?restart (?:time|initiated)", re.I),
+    ),
+    ("exit", re.compile(r"IBC returned exit status (?P<status>\d+)")),
+    (
+        "exit",
+        re.compile(r"IBC: (?P<reason>(?:Shutdown initiated|Exiting|Closing IBC)\b.*)"),
+    ),
+)
+# Repeats of these while nothing else happened are the same step reported twice.
+COLLAPSED_EVENTS = frozenset(
+    {"login_started", "twofa_pending", "api_ready", "auto_restart"}
+)
+
+
+@dataclass
+class IbcEventClassifier:
+    last_event: str | None = None
+    counts: dict[str, int] = field(default_factory=dict)
+
+    def classify(self, line: str) -> dict[str, object] | None:
+        """Return the event for one IBC output line, or None for other output."""
+        match = IBC_TIMESTAMP_REG.match(line)
+        log_time, message = (
+            (match.group("time"), match.group("message")) if match else (None, line)
+        )
+        for event, pattern in EVENT_PATTERNS:
+            event_match = pattern.search(message)
+            if event_match is None:
+                continue
+            if event == self.last_event and event in COLLAPSED_EVENTS:
+                return None
+            self.last_event = event
+            self.counts[event] = self.counts.get(event, 0) + 1
+            record: dict[str, object] = {
+                "time": round(time.time(), 3),
+                "event": event,
+            }
+            if log_time is not None:
+                record["log_time"] = log_time
+            for name, value in event_match.groupdict().items():
+                if value is not None:
+                    record[name] = int(value) if value.isdigit() else value.strip()
+            record["message"] = message.strip()[:MAX_MESSAGE_LENGTH]
+            return record
+        return None
+
+
+class BoundedLineReader:
+    """Split a stream into lines in fixed chunks, truncating overlong lines."""
+
+    def __init__(self, max_line_length: int = MAX_LINE_LENGTH) -> None:
+        self.max_line_length = max_line_length
+        self.partial = ""
+        self.discarding = False
+
+    def feed(self, chunk: str) -> Iterator[str]:
+        *lines, rest = chunk.split("\n")
+        for line in lines:
+            if self.discarding:
+                # The head of this line was already emitted when it overflowed.
+                self.discarding = False
+                self.partial = ""
+                continue
+            yield (self.partial + line)[: self.max_line_length]
+            self.partial = ""
+        if self.discarding:
+            return
+        self.partial += rest
+        if len(self.partial) > self.max_line_length:
+            yield self.partial[: self.max_line_length]
+            self.partial = ""
+            self.discarding = True
+
+    def reset(self) -> None:
+        self.partial = ""
+        self.discarding = False
+
+
+class LogFollower:
+    """Follow a log file across truncation and replacement in bounded reads.
+
+    With from_end, a log that already exists on the first read is followed from
+    its end, so a restarted follower does not replay events it already emitted.
+    A log created or replaced later is always read from the start.
+    """
+
+    def __init__(
+        self, path: Path, chunk_size: int = READ_CHUNK_SIZE, from_end: bool = False
+    ) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.handle: TextIO | None = None
+        self.inode: int | None = None
+        self.reader = BoundedLineReader()
+        self.skip_existing = from_end
+
+    def read_lines(self) -> Iterator[str]:
+        skip_existing, self.skip_existing = self.skip_existing, False
+        yield from self.drain()
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return
+        if (
+            self.handle is None
+            or stat.st_ino != self.inode
+            or stat.st_size < self.handle.tell()
+        ):
+            if self.handle is not None:
+                self.handle.close()
+            self.handle = self.path.open(encoding="utf-8", errors="replace")
+            if skip_existing:
+                self.handle.seek(0, os.SEEK_END)
+            self.inode = stat.st_ino
+            self.reader.reset()
+            yield from self.drain()
+
+    def drain(self) -> Iterator[str]:
+        if self.handle is None:
+            return
+        while chunk := self.handle.read(self.chunk_size):
+            yield from self.reader.feed(chunk)
+
+
+class EventWriter:
+    """Append events as JSON lines, keeping one rotated file as history."""
+
+    def __init__(self, path: Path, max_bytes: int = MAX_EVENTS_FILE_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def write(self, record: dict[str, object]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if self.path.stat().st_size >= self.max_bytes:
+                self.path.replace(self.path.with_name(self.path.name + ".1"))
+        except FileNotFoundError:
+            pass
+        with self.path.open("a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+
+def classify_stream(
+    stream: TextIO, classifier: IbcEventClassifier
+) -> Iterator[dict[str, object]]:
+    """Classify an already open stream, such as a saved log on stdin."""
+    reader = BoundedLineReader()
+    while chunk := stream.read(READ_CHUNK_SIZE):
+        for line in reader.feed(chunk):
+            if (record := classifier.classify(line)) is not None:
+                yield record
+    if reader.partial and (record := classifier.classify(reader.partial)):
+        yield record
+
+
+def run(argv: list[str] | None = None) -> int:
+    """Turn IBC output into login and session events on the command line."""
+    parser = argparse.ArgumentParser(prog="ibc_events")
+    parser.add_argument(
+        "--input",
+        default=str(IBC_LOG_PATH),
+        help="IBC log to follow, or - to classify stdin once",
+    )
+    parser.add_argument(
+        "--output",
+        default=str(IBC_EVENTS_PATH),
+        help="JSON-lines events file, or - for stdout",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Classify the current log content and exit instead of following it",
+    )
+    args = parser.parse_args(argv or [])
+    classifier = IbcEventClassifier()
+    writer = None if args.output == "-" else EventWriter(Path(args.output))
+
+    def emit(record: dict[str, object]) -> None:
+        if writer is None:
+            print(json.dumps(record), flush=True)
+        else:
+            writer.write(record)
+
+    try:
+        if args.input == "-":
+            for record in classify_stream(sys.stdin, classifier):
+                emit(record)
+            return 0
+        follower = LogFollower(Path(args.input), from_end=not args.once)
+        while True:
+            for line in follower.read_lines():
+                if (record := classifier.classify(line)) is not None:
+                    emit(record)
+            if args.once:
+                return 0
+            time.sleep(POLL_INTERVAL_SECONDS)
+    except OSError as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(run(sys.argv[1:]))
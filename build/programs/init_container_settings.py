@@ -1,20 +1,111 @@
 #!/usr/bin/env python3
 
+import argparse
+import configparser
+import hashlib
+import json
+import math
 import os
 import re
 import shlex
+import stat
 import sys
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
 from pathlib import Path
 
 VARS_REG = re.compile(r"\$\{([a-zA-Z_][\w]*)(?::-(.*?))?\}")
 IBC_VERSION_REG = re.compile(r"^[0-9]+[.][0-9]+[.][0-9]+$")
-CUSTOM_OPTS_BLOCK = """{% if custom_opts %}
-# Custom options
-{% for opt in custom_opts %}
-{{ opt }}
-{% endfor %}
-{% endif %}"""
+# Jinja-style subset used by vmoptions.j2: {{ name }}, {% if name %} and
+# {% for item in name %}. As with trim_blocks, a newline after a block tag is dropped.
+TEMPLATE_TAG_REG = re.compile(r"{{\s*(\w+)\s*}}|{%\s*(.*?)\s*%}\n?")
+VMOPTIONS_TEMPLATE_NAMES = frozenset(
+    {
+        "max_heap",
+        "initial_heap",
+        "tws_settings_path",
+        "gc_opts",
+        "cpu_opts",
+        "telemetry_opts",
+        "cds_opts",
+        "custom_opts",
+    }
+)
 MIN_AUTO_HEAP_MB = 256
+UNLIMITED_CGROUP_V1_BYTES = 1 << 42
+# tiered keeps the long-standing fractions of the memory limit. adaptive is
+# opt-in: its per-product and per-workload figures below are estimates that
+# have not been measured against real sessions yet.
+DEFAULT_HEAP_POLICY = "tiered"
+# Adaptive heap policy inputs, in MB. Base heaps cover the app at login with an
+# idle API session; TWS also keeps charts and GUI state on the heap.
+PRODUCT_BASE_HEAP_MB = {"ibgateway": 512, "tws": 1024}
+# Native JVM memory (metaspace, code cache, thread stacks, GC structures) plus
+# Xvfb, x11vnc, supervisord and the shell helpers sharing the container limit.
+PRODUCT_NON_HEAP_MB = {"ibgateway": 448, "tws": 704}
+NON_HEAP_MB_PER_CPU = 16
+HEAP_MB_PER_MARKET_DATA_LINE = 1
+HEAP_MB_PER_API_CLIENT = 32
+WORKLOAD_HEADROOM = 1.5
+GC_PROFILES = ("throughput", "low-latency-g1", "low-latency-zgc", "footprint")
+GC_SELECTION_OPT_REG = re.compile(r"-XX:[+-]Use[A-Za-z0-9]*GC")
+ZGC_MIN_HEAP_MB = 1024
+SERIAL_MAX_HEAP_MB = 2048
+# vmoptions precedence: for a repeated option the highest source wins, so the
+# heap policy and GC profile beat the template and CUSTOM_JVM_OPTS beats both.
+VMOPTIONS_SOURCE_PRECEDENCE = {
+    "template": 0,
+    "cpu": 1,
+    "gc": 2,
+    "telemetry": 3,
+    "cds": 4,
+    "custom": 5,
+}
+# Heap size is owned by the heap policy (JAVA_HEAP_SIZE / JAVA_HEAP_POLICY).
+HEAP_SIZE_OPT_KEYS = frozenset({"Xmx", "Xms", "Xmn"})
+# RAM-fraction sizing that -Xmx/-Xms silently override in the JVM.
+RAM_FRACTION_OPT_KEYS = frozenset(
+    {
+        "XX:MaxRAMPercentage",
+        "XX:MinRAMPercentage",
+        "XX:InitialRAMPercentage",
+        "XX:MaxRAMFraction",
+        "XX:MinRAMFraction",
+        "XX:InitialRAMFraction",
+        "XX:MaxRAM",
+    }
+)
+JVM_OPTION_KEY_ALIASES = {
+    "XX:MaxHeapSize": "Xmx",
+    "XX:InitialHeapSize": "Xms",
+    "XX:NewSize": "Xmn",
+}
+JVM_SIZE_UNITS_MB = {
+    "": 1 / (1024 * 1024),
+    "k": 1 / 1024,
+    "m": 1,
+    "g": 1024,
+    "t": 1024**2,
+}
+EFFECTIVE_OPT_KEY_PREFIXES = ("Xm", "XX:ActiveProcessorCount", "XX:UseContainerSupport")
+CDS_ARCHIVE_DIR_NAME = "cds"
+RENDER_MANIFEST_NAME = ".init-render-manifest.json"
+LAUNCH_PLAN_NAME = ".ib-launch-plan.sh"
+# Shared with the shell phase_mark helper in ib_utils.
+STARTUP_PHASES_PATH = Path("/tmp/ib-startup/phases.jsonl")
+WATERFALL_BAR_WIDTH = 40
+# Read by the jvm_telemetry sidecar; keep in sync with its GC_LOG_PATH.
+JVM_TELEMETRY_LOG_PATH = Path("/tmp/ib-jvm-telemetry/gc.log")
+# Read by restart_policy; keep in sync with its POLICY_ENV.
+RESTART_POLICY_ENV_NAMES = (
+    "RESTART_BACKOFF_BASE_SECONDS",
+    "RESTART_BACKOFF_MAX_SECONDS",
+    "RESTART_WINDOW_SECONDS",
+    "RESTART_WINDOW_MAX",
+)
+# The heap policy result, exported by the telemetry sidecar.
+JVM_TELEMETRY_HEAP_PATH = Path("/tmp/ib-jvm-telemetry/heap.json")
 
 
 def require_env(name: str) -> str:
@@ -89,16 +180,218 @@ def tws_settings_path() -> Path:
     return settings_path
 
 
-def sub_env_vars(txt: str) -> str:
-    def replace_match(match: re.Match[str]) -> str:
-        var_name = match.group(1)
-        default = match.group(2) or ""
-        env_value = os.getenv(var_name)
-        if env_value:
-            return env_value
-        return default
+def content_sha256(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def atomic_write_text(path: Path, content: str) -> None:
+    """Replace a file through a fsynced temp file and rename, keeping its mode."""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with temp_path.open("w") as handle:
+            handle.write(content)
+            handle.flush()
+            os.fsync(handle.fileno())
+        if path.exists():
+            os.chmod(temp_path, stat.S_IMODE(path.stat().st_mode))
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    directory_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Atomically write content unless the file already holds it; return if written."""
+    try:
+        if content_sha256(path.read_text()) == content_sha256(content):
+            return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    atomic_write_text(path, content)
+    return True
+
+
+@dataclass
+class RenderManifest:
+    """Source and output hashes of the files init renders, kept across starts."""
+
+    path: Path
+    entries: dict[str, dict[str, str]] = field(default_factory=dict)
+    damaged: set[Path] = field(default_factory=set)
+
+    def record(
+        self, output_path: Path, source_path: Path, source: str, output: str
+    ) -> None:
+        self.entries[str(output_path)] = {
+            "source": str(source_path),
+            "source_sha256": content_sha256(source),
+            "output_sha256": content_sha256(output),
+        }
+
+    def save(self) -> bool:
+        """Write the manifest only when a recorded hash changed."""
+        content = json.dumps(self.entries, indent=2, sort_keys=True) + "\n"
+        return write_if_changed(self.path, content)
+
+
+def load_render_manifest(path: Path) -> RenderManifest:
+    try:
+        entries = json.loads(path.read_text())
+    except (OSError, ValueError):
+        entries = {}
+    return RenderManifest(path, entries if isinstance(entries, dict) else {})
 
-    return VARS_REG.sub(replace_match, txt)
+
+def remove_interrupted_writes(path: Path) -> list[Path]:
+    """Delete temp files left beside a path by an atomic write that never renamed."""
+    if not path.parent.is_dir():
+        return []
+    stale = sorted(path.parent.glob(f".{path.name}.*.tmp"))
+    for temp_path in stale:
+        temp_path.unlink(missing_ok=True)
+    return stale
+
+
+def output_parses(path: Path) -> bool:
+    """Return whether a rendered config is readable text that still parses."""
+    try:
+        content = path.read_text()
+    except FileNotFoundError:
+        return True
+    except (OSError, UnicodeDecodeError):
+        return False
+    if not content.strip() or "\0" in content:
+        return False
+    if path.suffix == ".ini":
+        # IBC's config.ini has no section header; jts.ini does.
+        if not content.lstrip().startswith("["):
+            content = "[ibc]\n" + content
+        try:
+            configparser.ConfigParser(interpolation=None, strict=False).read_string(
+                content
+            )
+        except configparser.Error:
+            return False
+    return True
+
+
+def recover_partial_writes(manifest: RenderManifest) -> set[Path]:
+    """Clean up interrupted writes and mark the outputs they may have damaged.
+
+    IB rewrites jts.ini while it runs, so an output that merely differs from
+    its last render is not damaged; only a leftover temp file or an output
+    that no longer parses is.
+    """
+    for temp_path in remove_interrupted_writes(manifest.path):
+        print(f"Removed interrupted write {temp_path}")
+    for output in manifest.entries:
+        output_path = Path(output)
+        interrupted = remove_interrupted_writes(output_path)
+        for temp_path in interrupted:
+            print(f"Removed interrupted write {temp_path}")
+        if interrupted or not output_parses(output_path):
+            manifest.damaged.add(output_path)
+            print(f"{output_path} may be partially written; re-rendering it")
+    return manifest.damaged
+
+
+@dataclass
+class EnvRenderResult:
+    content: str
+    sources: dict[str, str]
+    defaults: dict[str, str]
+
+    def report(self, label: str) -> str:
+        """Summarize where each variable came from; env values are not shown."""
+        by_source = {
+            source: [name for name, value in self.sources.items() if value == source]
+            for source in ("env", "default", "unset")
+        }
+        defaults = ", ".join(
+            f"{name}={self.defaults[name]}" for name in by_source["default"]
+        )
+        return (
+            f"{label} settings: {len(self.sources)} variables; "
+            f"from env: {', '.join(by_source['env']) or '-'}; "
+            f"defaults: {defaults or '-'}; "
+            f"unset: {', '.join(by_source['unset']) or '-'}"
+        )
+
+
+@dataclass
+class EnvTemplate:
+    """A ${VAR:-default} template compiled to alternating literals and variables."""
+
+    literals: list[str]
+    variables: list[tuple[str, str]]
+
+    def render(self, env: Mapping[str, str]) -> EnvRenderResult:
+        parts = [self.literals[0]]
+        sources: dict[str, str] = {}
+        defaults: dict[str, str] = {}
+        for (name, default), literal in zip(self.variables, self.literals[1:]):
+            value = env.get(name)
+            if value:
+                sources[name] = "env"
+            elif default:
+                value = defaults[name] = default
+                sources[name] = "default"
+            else:
+                value = ""
+                sources[name] = "unset"
+            parts += [value, literal]
+        return EnvRenderResult("".join(parts), sources, defaults)
+
+
+def compile_env_template(content: str) -> EnvTemplate:
+    parts = VARS_REG.split(content)
+    return EnvTemplate(
+        parts[0::3],
+        [(name, default or "") for name, default in zip(parts[1::3], parts[2::3])],
+    )
+
+
+def env_template_cache_path(template_path: Path) -> Path:
+    return template_path.with_name(f".{template_path.name}.compiled.json")
+
+
+def load_env_template(template_path: Path, content: str) -> EnvTemplate:
+    """Return the compiled template, reusing the cache next to it when it matches."""
+    digest = content_sha256(content)
+    cache_path = env_template_cache_path(template_path)
+    try:
+        cached = json.loads(cache_path.read_text())
+        if cached["sha256"] == digest:
+            return EnvTemplate(
+                cached["literals"], [tuple(var) for var in cached["variables"]]
+            )
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    template = compile_env_template(content)
+    try:
+        atomic_write_text(
+            cache_path,
+            json.dumps(
+                {
+                    "sha256": digest,
+                    "literals": template.literals,
+                    "variables": template.variables,
+                }
+            ),
+        )
+    except OSError:
+        # Read-only template directories still render, just without the cache.
+        pass
+    return template
+
+
+def sub_env_vars(txt: str) -> str:
+    return compile_env_template(txt).render(os.environ).content
 
 
 def render_config_template(
@@ -106,6 +399,7 @@ def render_config_template(
     output_path: Path,
     label: str,
     fallback_template_path: Path | None = None,
+    manifest: RenderManifest | None = None,
 ) -> None:
     """Render an environment-expanded config from a persistent template."""
     require_absolute_path(output_path, f"{label} output")
@@ -117,63 +411,506 @@ def render_config_template(
         require_file_path(fallback_template_path, f"{label} fallback template")
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    source_path = template_path
+    has_fallback = (
+        fallback_template_path is not None and fallback_template_path.exists()
+    )
     try:
         template_content = template_path.read_text()
     except FileNotFoundError:
-        try:
-            current_content = output_path.read_text()
-        except FileNotFoundError:
-            if fallback_template_path is None or not fallback_template_path.exists():
+        template_content = None
+        if has_fallback and manifest and output_path in manifest.damaged:
+            # A damaged output cannot seed the template; start over from the image default.
+            print(
+                f"{label} output is damaged; repairing it from {fallback_template_path}"
+            )
+        else:
+            try:
+                template_content = output_path.read_text()
+            except FileNotFoundError:
+                pass
+            else:
+                if "${" not in template_content:
+                    print(
+                        f"{label} template not found and existing config is already expanded"
+                    )
+                    return
+        if template_content is None:
+            if fallback_template_path is None or not has_fallback:
                 raise RuntimeError(
                     f"{label} template not found at {template_path} and "
                     f"output does not exist: {output_path}"
                 )
-
+            source_path = fallback_template_path
             template_content = fallback_template_path.read_text()
-            template_path.parent.mkdir(parents=True, exist_ok=True)
-            template_path.write_text(template_content)
-            output_path.write_text(sub_env_vars(template_content))
-            print(f"Rendered {label} from {fallback_template_path} -> {output_path}")
-            return
+        template_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(template_path, template_content)
 
-        if "${" not in current_content:
-            print(f"{label} template not found and existing config is already expanded")
-            return
+    result = load_env_template(template_path, template_content).render(dict(os.environ))
+    if manifest is not None:
+        manifest.record(output_path, template_path, template_content, result.content)
+    if write_if_changed(output_path, result.content):
+        print(f"Rendered {label} from {source_path} -> {output_path}")
+    else:
+        print(f"{label} is unchanged: {output_path}")
+    print(result.report(label))
+
+
+def read_cgroup_limit_mb(path: Path) -> int | None:
+    """Read a cgroup byte limit in MB; missing, "max" and huge v1 values are unlimited."""
+    if not path.is_file():
+        return None
+    value = path.read_text().strip()
+    if value in ("max", "-1"):
+        return None
+    try:
+        raw = int(value)
+    except ValueError:
+        return None
+    if raw >= UNLIMITED_CGROUP_V1_BYTES:
+        return None
+    return raw // (1024 * 1024)
+
+
+@dataclass
+class CgroupMount:
+    mount_point: Path
+    root: str
+    version: str
+    controllers: frozenset[str]
+
+
+@dataclass
+class ContainerResources:
+    cgroup_version: str
+    memory_limit_mb: int | None
+    memory_high_mb: int | None
+    swap_limit_mb: int | None
+    cpu_quota: float | None
+    cpu_count: int
+    memory_cgroup: Path | None = None
+    cpu_cgroup: Path | None = None
+
+    def report(self) -> str:
+        """Return a one-line summary of the detected resource budget."""
+
+        def mb(value: int | None) -> str:
+            return "unlimited" if value is None else f"{value}MB"
+
+        quota = "unlimited" if self.cpu_quota is None else f"{self.cpu_quota:g}"
+        return (
+            f"Detected cgroup {self.cgroup_version} resources: "
+            f"memory.max={mb(self.memory_limit_mb)} "
+            f"memory.high={mb(self.memory_high_mb)} swap={mb(self.swap_limit_mb)} "
+            f"cpu quota={quota} cpus={self.cpu_count}"
+        )
+
+
+def parse_proc_cgroup(content: str) -> dict[str, str]:
+    """Map each v1 controller, and "" for the v2 hierarchy, to this process's path."""
+    paths = {}
+    for line in content.splitlines():
+        hierarchy_id, _, rest = line.partition(":")
+        controllers, _, cgroup_path = rest.partition(":")
+        if not hierarchy_id:
+            continue
+        if hierarchy_id == "0" and not controllers:
+            paths[""] = cgroup_path
+            continue
+        for controller in controllers.split(","):
+            paths[controller.removeprefix("name=")] = cgroup_path
+    return paths
+
+
+def parse_cgroup_mounts(content: str, root: Path) -> list[CgroupMount]:
+    """Return cgroup v1 and v2 mounts from /proc/self/mountinfo."""
+    mounts = []
+    for line in content.splitlines():
+        fields, _, tail = line.partition(" - ")
+        fields_list = fields.split()
+        tail_fields = tail.split()
+        if len(fields_list) < 5 or len(tail_fields) < 3:
+            continue
+        fs_type = tail_fields[0]
+        mount_point = root / fields_list[4].lstrip("/")
+        if fs_type == "cgroup2":
+            controllers_path = mount_point / "cgroup.controllers"
+            controllers = (
+                controllers_path.read_text().split()
+                if controllers_path.is_file()
+                else []
+            )
+            mounts.append(
+                CgroupMount(mount_point, fields_list[3], "v2", frozenset(controllers))
+            )
+        elif fs_type == "cgroup":
+            options = tail_fields[2].split(",")
+            mounts.append(
+                CgroupMount(mount_point, fields_list[3], "v1", frozenset(options))
+            )
+    return mounts
+
+
+def resolve_cgroup_dir(mount: CgroupMount, cgroup_path: str | None) -> Path:
+    """Return this process's cgroup directory under a mount.
+
+    Without a cgroup namespace, /proc/self/cgroup shows the host path; strip the
+    mount root so nested containers resolve inside the mount. Fall back to the
+    mount point when the path is not visible.
+    """
+    if cgroup_path is None:
+        return mount.mount_point
+    relative = cgroup_path
+    mount_root = mount.root.rstrip("/")
+    if mount_root and (relative == mount_root or relative.startswith(f"{mount_root}/")):
+        relative = relative[len(mount_root) :]
+    candidate = mount.mount_point / relative.lstrip("/")
+    return candidate if candidate.is_dir() else mount.mount_point
+
+
+def cgroup_ancestry(mount: CgroupMount, cgroup_dir: Path) -> list[Path]:
+    """Return cgroup_dir and its parents up to the mount point."""
+    directories = [cgroup_dir]
+    while directories[-1] != mount.mount_point and (
+        mount.mount_point in directories[-1].parents
+    ):
+        directories.append(directories[-1].parent)
+    return directories
 
-        template_content = current_content
-        template_path.parent.mkdir(parents=True, exist_ok=True)
-        template_path.write_text(template_content)
 
-    output_path.write_text(sub_env_vars(template_content))
-    print(f"Rendered {label} from {template_path} -> {output_path}")
+def min_limit(values: list[int | None]) -> int | None:
+    """Return the tightest of several optional limits."""
+    limits = [value for value in values if value is not None]
+    return min(limits) if limits else None
 
 
-def detect_memory_mb() -> int | None:
-    """Detect the container memory limit in megabytes."""
-    cg2 = Path("/sys/fs/cgroup/memory.max")
-    if cg2.exists():
-        val = cg2.read_text().strip()
-        if val == "max":
+def read_cpu_quota(directory: Path, version: str) -> float | None:
+    """Read a CFS CPU quota as a number of CPUs."""
+    if version == "v2":
+        cpu_max = directory / "cpu.max"
+        if not cpu_max.is_file():
             return None
-        try:
-            return int(val) // (1024 * 1024)
-        except ValueError:
+        quota, _, period = cpu_max.read_text().strip().partition(" ")
+        if quota == "max":
             return None
-
-    cg1 = Path("/sys/fs/cgroup/memory/memory.limit_in_bytes")
-    if cg1.exists():
-        try:
-            raw = int(cg1.read_text().strip())
-        except ValueError:
+    else:
+        quota_path = directory / "cpu.cfs_quota_us"
+        period_path = directory / "cpu.cfs_period_us"
+        if not quota_path.is_file() or not period_path.is_file():
             return None
-
-        if raw > (1 << 42):
+        quota = quota_path.read_text().strip()
+        period = period_path.read_text().strip()
+        if quota == "-1":
             return None
-        return raw // (1024 * 1024)
-
+    try:
+        return int(quota) / int(period or "100000")
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def controller_cgroup(
+    mounts: list[CgroupMount], proc_paths: dict[str, str], controller: str
+) -> tuple[CgroupMount, Path] | None:
+    """Find the mount and directory holding a controller, preferring v1 on hybrid hosts."""
+    for mount in mounts:
+        if mount.version == "v1" and controller in mount.controllers:
+            return mount, resolve_cgroup_dir(mount, proc_paths.get(controller))
+    for mount in mounts:
+        if mount.version == "v2" and controller in mount.controllers:
+            return mount, resolve_cgroup_dir(mount, proc_paths.get(""))
     return None
 
 
+def detect_container_resources(
+    root: Path = Path("/"), affinity_cpus: int | None = None
+) -> ContainerResources:
+    """Resolve this container's cgroups and report its memory and CPU budgets."""
+    if affinity_cpus is None:
+        affinity_cpus = detect_cpu_count()
+    proc_cgroup = root / "proc" / "self" / "cgroup"
+    mountinfo = root / "proc" / "self" / "mountinfo"
+    proc_paths = (
+        parse_proc_cgroup(proc_cgroup.read_text()) if proc_cgroup.is_file() else {}
+    )
+    mounts = (
+        parse_cgroup_mounts(mountinfo.read_text(), root) if mountinfo.is_file() else []
+    )
+    versions = {mount.version for mount in mounts}
+    if versions == {"v1", "v2"}:
+        cgroup_version = "hybrid"
+    elif versions:
+        cgroup_version = versions.pop()
+    else:
+        cgroup_version = "none"
+
+    memory_limit = memory_high = swap_limit = None
+    memory_dir = cpu_dir = None
+    if memory := controller_cgroup(mounts, proc_paths, "memory"):
+        mount, memory_dir = memory
+        directories = cgroup_ancestry(mount, memory_dir)
+        if mount.version == "v2":
+            memory_limit = min_limit(
+                [read_cgroup_limit_mb(path / "memory.max") for path in directories]
+            )
+            memory_high = min_limit(
+                [read_cgroup_limit_mb(path / "memory.high") for path in directories]
+            )
+            swap_limit = min_limit(
+                [read_cgroup_limit_mb(path / "memory.swap.max") for path in directories]
+            )
+        else:
+            memory_limit = min_limit(
+                [
+                    read_cgroup_limit_mb(path / "memory.limit_in_bytes")
+                    for path in directories
+                ]
+            )
+            memsw_limit = min_limit(
+                [
+                    read_cgroup_limit_mb(path / "memory.memsw.limit_in_bytes")
+                    for path in directories
+                ]
+            )
+            if memsw_limit is not None and memory_limit is not None:
+                swap_limit = max(0, memsw_limit - memory_limit)
+
+    cpu_quota = None
+    if cpu := controller_cgroup(mounts, proc_paths, "cpu"):
+        mount, cpu_dir = cpu
+        quotas = [
+            read_cpu_quota(path, mount.version)
+            for path in cgroup_ancestry(mount, cpu_dir)
+        ]
+        limited = [quota for quota in quotas if quota is not None]
+        cpu_quota = min(limited) if limited else None
+
+    cpu_count = affinity_cpus
+    if cpu_quota is not None:
+        cpu_count = min(cpu_count, max(1, math.ceil(cpu_quota)))
+    return ContainerResources(
+        cgroup_version=cgroup_version,
+        memory_limit_mb=memory_limit,
+        memory_high_mb=memory_high,
+        swap_limit_mb=swap_limit,
+        cpu_quota=cpu_quota,
+        cpu_count=cpu_count,
+        memory_cgroup=memory_dir,
+        cpu_cgroup=cpu_dir,
+    )
+
+
+def detect_cpu_count() -> int:
+    """Return the CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parallel_gc_threads(cpu_count: int) -> int:
+    """Return HotSpot's default ParallelGCThreads for a CPU budget."""
+    if cpu_count <= 8:
+        return cpu_count
+    return 8 + (cpu_count - 8) * 5 // 8
+
+
+def cpu_budget_opts(resources: ContainerResources) -> list[str]:
+    """Pin the JVM's CPU view to the detected budget, including nested quotas."""
+    return [f"-XX:ActiveProcessorCount={resources.cpu_count}"]
+
+
+def g1_region_size_mb(max_heap_mb: int) -> int:
+    """Return a power-of-two G1 region size giving about 2048 regions."""
+    region_size = 1
+    while region_size < 32 and region_size * 2048 < max_heap_mb:
+        region_size *= 2
+    return region_size
+
+
+def validate_gc_profile(profile: str, max_heap_mb: int, cpu_count: int) -> None:
+    """Reject GC profiles that cannot meet their goal with the given budget."""
+    if profile in ("low-latency-g1", "low-latency-zgc") and cpu_count < 2:
+        raise ValueError(
+            f"JAVA_GC_PROFILE={profile} needs at least 2 CPUs for concurrent GC "
+            f"threads; detected {cpu_count}"
+        )
+    if profile == "low-latency-zgc" and max_heap_mb < ZGC_MIN_HEAP_MB:
+        raise ValueError(
+            f"JAVA_GC_PROFILE={profile} needs a heap of at least {ZGC_MIN_HEAP_MB}MB; "
+            f"max heap is {max_heap_mb}MB"
+        )
+    if profile == "footprint" and max_heap_mb > SERIAL_MAX_HEAP_MB:
+        raise ValueError(
+            f"JAVA_GC_PROFILE={profile} stops the world for the whole heap; use at most "
+            f"{SERIAL_MAX_HEAP_MB}MB, not {max_heap_mb}MB"
+        )
+
+
+def gc_profile_opts(profile: str, max_heap_mb: int, cpu_count: int) -> list[str]:
+    """Return collector options for a GC profile, sized to the CPU and heap budget."""
+    validate_gc_profile(profile, max_heap_mb, cpu_count)
+    gc_threads = parallel_gc_threads(cpu_count)
+    if profile == "throughput":
+        return [
+            "-XX:+UseParallelGC",
+            f"-XX:ParallelGCThreads={gc_threads}",
+            "-XX:MaxGCPauseMillis=200",
+            "-XX:GCTimeRatio=4",
+            "-XX:AdaptiveSizePolicyWeight=90",
+        ]
+    if profile == "low-latency-g1":
+        return [
+            "-XX:+UseG1GC",
+            f"-XX:ParallelGCThreads={gc_threads}",
+            f"-XX:ConcGCThreads={max(1, (gc_threads + 2) // 4)}",
+            f"-XX:G1HeapRegionSize={g1_region_size_mb(max_heap_mb)}m",
+            "-XX:MaxGCPauseMillis=50",
+            "-XX:+ParallelRefProcEnabled",
+        ]
+    if profile == "low-latency-zgc":
+        return [
+            "-XX:+UseZGC",
+            f"-XX:ParallelGCThreads={gc_threads}",
+            f"-XX:ConcGCThreads={max(1, cpu_count // 4)}",
+            f"-XX:SoftMaxHeapSize={max_heap_mb * 9 // 10}m",
+        ]
+    if profile == "footprint":
+        return [
+            "-XX:+UseSerialGC",
+            "-XX:MinHeapFreeRatio=10",
+            "-XX:MaxHeapFreeRatio=20",
+        ]
+    raise ValueError(f"Unsupported JAVA_GC_PROFILE: {profile}")
+
+
+def validate_custom_gc_opts(profile: str, custom_opts: list[str]) -> None:
+    """Reject CUSTOM_JVM_OPTS collector flags that conflict with the GC profile."""
+    for opt in custom_opts:
+        if GC_SELECTION_OPT_REG.fullmatch(opt):
+            raise ValueError(
+                f"CUSTOM_JVM_OPTS selects a collector ({opt}) but JAVA_GC_PROFILE="
+                f"{profile} already does; choose the collector with JAVA_GC_PROFILE"
+            )
+
+
+def validate_custom_heap_opts(custom_opts: list[str]) -> None:
+    """Reject CUSTOM_JVM_OPTS heap sizing that would fight the heap policy."""
+    for opt in custom_opts:
+        if jvm_option_key(opt) in HEAP_SIZE_OPT_KEYS | RAM_FRACTION_OPT_KEYS:
+            raise ValueError(
+                f"CUSTOM_JVM_OPTS cannot size the heap ({opt}); "
+                "set JAVA_HEAP_SIZE or JAVA_HEAP_POLICY instead"
+            )
+
+
+def jvm_option_key(opt: str) -> str:
+    """Return the setting an option controls, so repeated settings can be compared."""
+    if opt.startswith("-XX:"):
+        body = opt[4:]
+        name = body[1:] if body[:1] in ("+", "-") else body.partition("=")[0]
+        key = f"XX:{name}"
+    elif opt.startswith("-D"):
+        key = f"D:{opt[2:].partition('=')[0]}"
+    elif opt[:4] in ("-Xmx", "-Xms", "-Xmn", "-Xss"):
+        key = opt[1:4]
+    elif opt.startswith("-Xshare:"):
+        key = "Xshare"
+    else:
+        key = opt
+    return JVM_OPTION_KEY_ALIASES.get(key, key)
+
+
+def jvm_size_mb(opt: str) -> float:
+    """Return the size in MB from an option such as -Xmx2g or -XX:MaxHeapSize=512m."""
+    value = opt.partition("=")[2] if "=" in opt else opt[4:]
+    match = re.fullmatch(r"([0-9]+)([kmgt]?)", value.lower())
+    if match is None:
+        raise ValueError(f"JVM option has an invalid size: {opt}")
+    return int(match.group(1)) * JVM_SIZE_UNITS_MB[match.group(2)]
+
+
+@dataclass
+class JvmOption:
+    text: str
+    source: str
+
+    @property
+    def key(self) -> str:
+        return jvm_option_key(self.text)
+
+
+class VmOptionsModel:
+    """Ordered vmoptions lines with the source of each option."""
+
+    def __init__(self) -> None:
+        self.lines: list[str | JvmOption] = []
+        self.decisions: list[str] = []
+
+    def options(self) -> list[JvmOption]:
+        return [line for line in self.lines if isinstance(line, JvmOption)]
+
+    def drop(self, option: JvmOption, reason: str) -> None:
+        self.lines.remove(option)
+        self.decisions.append(f"dropped {option.text} ({option.source}): {reason}")
+
+    def resolve(self) -> None:
+        """Apply the precedence rules so each setting appears once."""
+        validate_custom_heap_opts(
+            [option.text for option in self.options() if option.source == "custom"]
+        )
+        for option in self.options():
+            if option.key in RAM_FRACTION_OPT_KEYS:
+                self.drop(option, "-Xmx/-Xms from the heap policy take precedence")
+        gc_selected = any(
+            GC_SELECTION_OPT_REG.fullmatch(option.text) and option.source == "gc"
+            for option in self.options()
+        )
+        winners: dict[str, JvmOption] = {}
+        for option in self.options():
+            if (
+                gc_selected
+                and option.source == "template"
+                and GC_SELECTION_OPT_REG.fullmatch(option.text)
+            ):
+                self.drop(option, "JAVA_GC_PROFILE selects the collector")
+                continue
+            current = winners.get(option.key)
+            if current is None:
+                winners[option.key] = option
+                continue
+            if (
+                VMOPTIONS_SOURCE_PRECEDENCE[option.source]
+                >= VMOPTIONS_SOURCE_PRECEDENCE[current.source]
+            ):
+                self.drop(current, f"overridden by {option.text} ({option.source})")
+                winners[option.key] = option
+            else:
+                self.drop(option, f"overridden by {current.text} ({current.source})")
+
+        if "Xmx" in winners and "Xms" in winners:
+            max_heap = jvm_size_mb(winners["Xmx"].text)
+            if jvm_size_mb(winners["Xms"].text) > max_heap:
+                raise ValueError(
+                    f"Initial heap {winners['Xms'].text} exceeds max heap "
+                    f"{winners['Xmx'].text}"
+                )
+
+    def effective_settings(self) -> list[str]:
+        """Return the resolved heap, GC and CPU options that decide memory behavior."""
+        return [
+            option.text
+            for option in self.options()
+            if option.key.startswith(EFFECTIVE_OPT_KEY_PREFIXES)
+            or GC_SELECTION_OPT_REG.fullmatch(option.text)
+            or option.source == "gc"
+        ]
+
+    def render(self) -> str:
+        return "\n".join(
+            line.text if isinstance(line, JvmOption) else line for line in self.lines
+        )
+
+
 def parse_memory_mb(value: str) -> int:
     """Parse a memory value as megabytes, supporting m and g suffixes."""
     normalized = value.strip().lower()
@@ -200,31 +937,6 @@ def parse_memory_mb(value: str) -> int:
     return memory_mb
 
 
-def calculate_java_heap_size() -> str:
-    """Return the configured or memory-derived maximum Java heap size."""
-    java_heap_size = os.getenv("JAVA_HEAP_SIZE")
-    if java_heap_size:
-        return str(parse_memory_mb(java_heap_size))
-
-    mem_mb = detect_memory_mb()
-    if mem_mb is None:
-        print("Memory limit unlimited/undetectable; using default heap 2048MB")
-        return "2048"
-
-    if mem_mb <= 2048:
-        java_heap_size = int(mem_mb * 0.75)
-    elif mem_mb <= 4096:
-        java_heap_size = int(mem_mb * 0.6)
-    elif mem_mb <= 8192:
-        java_heap_size = int(mem_mb * 0.5)
-    else:
-        java_heap_size = min(4096, int(mem_mb * 0.4))
-
-    java_heap_size = max(MIN_AUTO_HEAP_MB, java_heap_size)
-    print(f"Detected cgroup memory: {mem_mb}MB; heap={java_heap_size}MB")
-    return str(java_heap_size)
-
-
 def calculate_initial_heap_size(java_heap_size: str) -> int:
     """Return the initial Java heap size for a maximum heap size."""
     heap_size_int = parse_memory_mb(java_heap_size)
@@ -235,6 +947,211 @@ def calculate_initial_heap_size(java_heap_size: str) -> int:
     return 768
 
 
+@dataclass
+class WorkloadProfile:
+    market_data_lines: int = 100
+    api_clients: int = 1
+    extra_heap_mb: int = 0
+
+
+@dataclass
+class HeapInputs:
+    program: str
+    memory_limit_mb: int | None
+    memory_high_mb: int | None
+    swap_limit_mb: int | None
+    cpu_count: int
+    workload: WorkloadProfile = field(default_factory=WorkloadProfile)
+    configured_heap_mb: int | None = None
+
+
+@dataclass
+class HeapDecision:
+    policy: str
+    max_heap_mb: int
+    initial_heap_mb: int
+    reasons: list[str]
+
+    def report(self) -> str:
+        """Return a human-readable explanation of the chosen heap sizes."""
+        lines = [
+            f"Heap policy {self.policy}: max={self.max_heap_mb}MB "
+            f"initial={self.initial_heap_mb}MB"
+        ]
+        lines.extend(f"  - {reason}" for reason in self.reasons)
+        return "\n".join(lines)
+
+
+def load_workload_profile(path: Path | None) -> WorkloadProfile:
+    """Parse a key=value workload profile describing expected API load."""
+    if path is None:
+        return WorkloadProfile()
+    require_absolute_path(path, "JAVA_WORKLOAD_PROFILE")
+    if not path.is_file():
+        raise RuntimeError(f"JAVA_WORKLOAD_PROFILE is not a file: {path}")
+    profile = WorkloadProfile()
+    for line_number, raw_line in enumerate(path.read_text().splitlines(), 1):
+        line = raw_line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, separator, value = line.partition("=")
+        key = key.strip()
+        if not separator or not hasattr(profile, key):
+            raise ValueError(
+                f"JAVA_WORKLOAD_PROFILE line {line_number} is invalid: {raw_line}"
+            )
+        try:
+            number = int(value.strip())
+        except ValueError as exc:
+            raise ValueError(
+                f"JAVA_WORKLOAD_PROFILE {key} must be a whole number: {value.strip()}"
+            ) from exc
+        if number < 0:
+            raise ValueError(f"JAVA_WORKLOAD_PROFILE {key} must not be negative")
+        setattr(profile, key, number)
+    return profile
+
+
+def tiered_heap_policy(inputs: HeapInputs) -> HeapDecision:
+    """Size the heap from fixed fractions of the memory limit."""
+    reasons = []
+    mem_mb = inputs.memory_limit_mb
+    if inputs.configured_heap_mb is not None:
+        max_heap = inputs.configured_heap_mb
+        reasons.append(f"max from JAVA_HEAP_SIZE ({max_heap}MB)")
+    elif mem_mb is None:
+        max_heap = 2048
+        reasons.append("max defaults to 2048MB: memory limit unlimited/undetectable")
+    else:
+        if mem_mb <= 2048:
+            fraction = 0.75
+        elif mem_mb <= 4096:
+            fraction = 0.6
+        elif mem_mb <= 8192:
+            fraction = 0.5
+        else:
+            fraction = 0.4
+        max_heap = int(mem_mb * fraction)
+        if mem_mb > 8192:
+            max_heap = min(4096, max_heap)
+        reasons.append(f"max is {fraction:.0%} of the {mem_mb}MB memory limit")
+        if max_heap < MIN_AUTO_HEAP_MB:
+            max_heap = MIN_AUTO_HEAP_MB
+            reasons.append(f"max raised to the {MIN_AUTO_HEAP_MB}MB floor")
+    initial_heap = calculate_initial_heap_size(str(max_heap))
+    reasons.append(f"initial from the tiered table for a {max_heap}MB max")
+    return HeapDecision("tiered", max_heap, initial_heap, reasons)
+
+
+def adaptive_heap_policy(inputs: HeapInputs) -> HeapDecision:
+    """Size the heap for the product and workload, within the memory budget."""
+    reasons = []
+    workload = inputs.workload
+    base_heap = PRODUCT_BASE_HEAP_MB[inputs.program]
+    demand = int(
+        (
+            base_heap
+            + workload.market_data_lines * HEAP_MB_PER_MARKET_DATA_LINE
+            + workload.api_clients * HEAP_MB_PER_API_CLIENT
+            + workload.extra_heap_mb
+        )
+        * WORKLOAD_HEADROOM
+    )
+    reasons.append(
+        f"workload demand {demand}MB: {inputs.program} base {base_heap}MB + "
+        f"{workload.market_data_lines} market data lines + "
+        f"{workload.api_clients} API clients + {workload.extra_heap_mb}MB extra, "
+        f"x{WORKLOAD_HEADROOM} headroom"
+    )
+
+    limits = [
+        limit
+        for limit in (inputs.memory_limit_mb, inputs.memory_high_mb)
+        if limit is not None
+    ]
+    budget = min(limits) if limits else None
+    if budget is not None and budget == inputs.memory_high_mb:
+        reasons.append(f"memory budget {budget}MB from memory.high (reclaim throttle)")
+    elif budget is not None:
+        reasons.append(f"memory budget {budget}MB from the memory limit")
+    if inputs.swap_limit_mb:
+        reasons.append(
+            f"{inputs.swap_limit_mb}MB swap ignored: a swapped-out heap stalls GC"
+        )
+
+    non_heap = PRODUCT_NON_HEAP_MB[inputs.program] + (
+        inputs.cpu_count * NON_HEAP_MB_PER_CPU
+    )
+    if inputs.configured_heap_mb is not None:
+        max_heap = inputs.configured_heap_mb
+        reasons.append(f"max from JAVA_HEAP_SIZE ({max_heap}MB)")
+    elif budget is None:
+        max_heap = demand
+        reasons.append("max equals workload demand: no memory limit detected")
+    else:
+        ceiling = budget - non_heap
+        reasons.append(
+            f"heap ceiling {ceiling}MB after {non_heap}MB non-heap reserve "
+            f"({inputs.cpu_count} CPUs x {NON_HEAP_MB_PER_CPU}MB + processes)"
+        )
+        if demand > ceiling:
+            max_heap = ceiling
+            reasons.append(
+                f"max capped at the ceiling; workload wants {demand - ceiling}MB more"
+            )
+        else:
+            max_heap = demand
+            reasons.append("max equals workload demand, which fits the ceiling")
+        if max_heap < MIN_AUTO_HEAP_MB:
+            max_heap = MIN_AUTO_HEAP_MB
+            reasons.append(f"max raised to the {MIN_AUTO_HEAP_MB}MB floor")
+
+    if budget is not None and inputs.configured_heap_mb is None:
+        initial_heap = max_heap
+        reasons.append("initial equals max: the memory is reserved, skip resizing")
+    else:
+        initial_heap = calculate_initial_heap_size(str(max_heap))
+        reasons.append(f"initial from the tiered table for a {max_heap}MB max")
+    return HeapDecision("adaptive", max_heap, initial_heap, reasons)
+
+
+HEAP_POLICIES: dict[str, Callable[[HeapInputs], HeapDecision]] = {
+    "adaptive": adaptive_heap_policy,
+    "tiered": tiered_heap_policy,
+}
+
+
+def heap_inputs(program: str, resources: ContainerResources) -> HeapInputs:
+    """Collect heap sizing inputs from the environment and detected resources."""
+    java_heap_size = os.getenv("JAVA_HEAP_SIZE")
+    profile_path = os.getenv("JAVA_WORKLOAD_PROFILE")
+    return HeapInputs(
+        program=program,
+        memory_limit_mb=resources.memory_limit_mb,
+        memory_high_mb=resources.memory_high_mb,
+        swap_limit_mb=resources.swap_limit_mb,
+        cpu_count=resources.cpu_count,
+        workload=load_workload_profile(Path(profile_path) if profile_path else None),
+        configured_heap_mb=parse_memory_mb(java_heap_size) if java_heap_size else None,
+    )
+
+
+def decide_heap_size(program: str, resources: ContainerResources) -> HeapDecision:
+    """Run the configured heap policy and print its decision report."""
+    policy = validate_env_choice(
+        "JAVA_HEAP_POLICY", tuple(HEAP_POLICIES), DEFAULT_HEAP_POLICY
+    )
+    decision = HEAP_POLICIES[policy](heap_inputs(program, resources))
+    print(decision.report())
+    return decision
+
+
+def calculate_java_heap_size() -> str:
+    """Return the maximum Java heap size, in MB, the configured policy chooses."""
+    program = require_env("PROGRAM")
+    return str(decide_heap_size(program, detect_container_resources()).max_heap_mb)
+
+
 def vmoptions_names(program: str) -> list[str]:
     """Return vmoptions filenames for a supported IB product."""
     if program == "ibgateway":
@@ -340,16 +1257,16 @@ def validate_ib_release_layout(program: str, ib_release_dir: Path) -> None:
             )
 
 
-def validate_install4j_java_config(install4j_path: Path) -> None:
-    """Validate the Java discovery files IBC reads from .install4j."""
+def install4j_java_home(install4j_path: Path) -> Path:
+    """Return the Java home IBC reads from .install4j, validating its executable."""
     for cfg_path in [install4j_path / "pref_jre.cfg", install4j_path / "inst_jre.cfg"]:
         if not cfg_path.is_file():
             continue
         cfg_content = cfg_path.read_text()
-        java_home = cfg_content.splitlines()[0] if cfg_content else ""
-        java_path = Path(java_home) / "bin" / "java"
+        java_home = Path(cfg_content.splitlines()[0] if cfg_content else "")
+        java_path = java_home / "bin" / "java"
         if java_path.is_file() and os.access(java_path, os.X_OK):
-            return
+            return java_home
         raise RuntimeError(
             "IB release directory is invalid: "
             f"expected Java executable from {cfg_path}: {java_path}"
@@ -361,6 +1278,11 @@ def validate_install4j_java_config(install4j_path: Path) -> None:
     )
 
 
+def validate_install4j_java_config(install4j_path: Path) -> None:
+    """Validate the Java discovery files IBC reads from .install4j."""
+    install4j_java_home(install4j_path)
+
+
 def validate_ibc_layout(ibc_path: Path) -> None:
     """Validate the installed IBC layout before mutating runtime config."""
     require_absolute_path(ibc_path, "IBC_PATH")
@@ -385,60 +1307,388 @@ def validate_runtime_environment() -> None:
     require_env("IB_USER")
     require_env("IB_PASSWORD")
     validate_ibc_version(require_env("IBC_VERSION"))
+    started = time.perf_counter()
     validate_ibc_layout(Path(require_env("IBC_PATH")))
     validate_ib_release_layout(program, resolve_ib_release_dir(program))
+    print(
+        "Validated IB and IBC layout in "
+        f"{(time.perf_counter() - started) * 1000:.1f}ms"
+    )
     require_absolute_path(Path(require_env("IBC_INI")), "IBC_INI")
     home_path()
     tws_settings_path()
     custom_jvm_opts()
     validate_java_heap_size()
     validate_runtime_choices()
+    validate_env_choice("USE_CDS_ARCHIVE", ("yes", "no"), "yes")
+    validate_env_choice("IBC_WARM_RESTART", ("yes", "no"), "yes")
+    validate_restart_policy()
+    validate_env_choice("JAVA_HEAP_POLICY", tuple(HEAP_POLICIES), DEFAULT_HEAP_POLICY)
+    validate_custom_gc_opts(
+        validate_env_choice("JAVA_GC_PROFILE", GC_PROFILES, "throughput"),
+        custom_jvm_opts(),
+    )
+    validate_custom_heap_opts(custom_jvm_opts())
+    validate_env_choice("JVM_TELEMETRY", ("yes", "no"), "no")
+    validate_env_choice("METRICS", ("yes", "no"), "no")
+    validate_telemetry_port()
+    workload_profile = os.getenv("JAVA_WORKLOAD_PROFILE")
+    load_workload_profile(Path(workload_profile) if workload_profile else None)
+    vmoptions_template = home_path() / "vmoptions.j2"
+    if vmoptions_template.is_file():
+        compile_template(
+            vmoptions_template.read_text(),
+            VMOPTIONS_TEMPLATE_NAMES,
+            "vmoptions template",
+        )
 
 
-def render_vmoptions(
+def validate_image_layout() -> None:
+    """Validate the IB and IBC layout baked into the image, without credentials."""
+    program = require_env("PROGRAM")
+    vmoptions_names(program)
+    validate_ibc_version(require_env("IBC_VERSION"))
+    validate_ibc_layout(Path(require_env("IBC_PATH")))
+    validate_ib_release_layout(program, resolve_ib_release_dir(program))
+
+
+def cds_archive_path(program: str, ib_release_dir: Path) -> Path:
+    """Return the AppCDS archive path generated at image build time."""
+    return ib_release_dir / CDS_ARCHIVE_DIR_NAME / f"{program}.jsa"
+
+
+def cds_stamp_path(archive_path: Path) -> Path:
+    """Return the file recording which JVM dumped an AppCDS archive."""
+    return archive_path.with_name(f"{archive_path.name}.jvm")
+
+
+def jvm_fingerprint(java_home: Path) -> str:
+    """Identify a JVM build by its release file; the JVM itself validates the archive."""
+    release_path = java_home / "release"
+    try:
+        fields = dict(
+            (key, value.strip('"'))
+            for key, value in (
+                line.split("=", 1)
+                for line in release_path.read_text().splitlines()
+                if "=" in line
+            )
+        )
+    except OSError as exc:
+        raise RuntimeError(f"JVM release file not readable: {release_path}") from exc
+    version = fields.get("JAVA_RUNTIME_VERSION") or fields.get("JAVA_VERSION")
+    if not version:
+        raise RuntimeError(f"JVM release file has no version: {release_path}")
+    return f"{java_home} {fields.get('IMPLEMENTOR', 'unknown')} {version}"
+
+
+def cds_archive_opts(program: str, ib_release_dir: Path) -> list[str]:
+    """Return AppCDS options when the build-time archive matches the current JVM."""
+    use_cds = validate_env_choice("USE_CDS_ARCHIVE", ("yes", "no"), "yes")
+    archive_path = cds_archive_path(program, ib_release_dir)
+    if use_cds == "no" or not archive_path.is_file():
+        return []
+
+    stamp_path = cds_stamp_path(archive_path)
+    try:
+        recorded_fingerprint = stamp_path.read_text().strip()
+        current_fingerprint = jvm_fingerprint(
+            install4j_java_home(ib_release_dir / ".install4j")
+        )
+    except (OSError, RuntimeError) as exc:
+        print(f"AppCDS archive disabled; cannot verify JVM: {exc}")
+        return []
+    if recorded_fingerprint != current_fingerprint:
+        print(f"AppCDS archive disabled; it was dumped by another JVM: {archive_path}")
+        return []
+    return [f"-XX:SharedArchiveFile={archive_path}"]
+
+
+@dataclass
+class TemplateNode:
+    kind: str
+    name: str = ""
+    loop_var: str = ""
+    body: list["TemplateNode"] = field(default_factory=list)
+
+
+@dataclass
+class CompiledTemplate:
+    """A template parsed once into segments and rendered in a single pass."""
+
+    nodes: list[TemplateNode]
+    names: frozenset[str]
+
+    def render(self, context: dict[str, object]) -> str:
+        return "".join(str(segment) for segment in self.segments(context))
+
+    def segments(self, context: dict[str, object]) -> list[object]:
+        """Return the template text and the placeholder values, in output order."""
+        missing = self.names - context.keys()
+        if missing:
+            raise ValueError(f"Template values missing: {', '.join(sorted(missing))}")
+        parts: list[object] = []
+
+        def walk(nodes: list[TemplateNode], scope: dict[str, object]) -> None:
+            for node in nodes:
+                if node.kind == "text":
+                    parts.append(node.name)
+                elif node.kind == "var":
+                    parts.append(scope[node.name])
+                elif node.kind == "if":
+                    if scope[node.name]:
+                        walk(node.body, scope)
+                else:
+                    for item in scope[node.name]:
+                        walk(node.body, {**scope, node.loop_var: item})
+
+        walk(self.nodes, context)
+        return parts
+
+
+def compile_template(
+    source: str, names: frozenset[str], label: str = "template"
+) -> CompiledTemplate:
+    """Parse a template, rejecting unknown names and malformed or unclosed tags."""
+    root = TemplateNode("root")
+    stack = [root]
+    scopes = [names]
+    position = 0
+
+    def fail(offset: int, message: str) -> ValueError:
+        line = source.count("\n", 0, offset) + 1
+        return ValueError(f"{label} line {line}: {message}")
+
+    def add_text(start: int, end: int) -> None:
+        text = source[start:end]
+        for marker in ("{{", "{%", "%}", "}}"):
+            if marker in text:
+                raise fail(start + text.index(marker), f"malformed tag near {marker}")
+        if text:
+            stack[-1].body.append(TemplateNode("text", text))
+
+    for match in TEMPLATE_TAG_REG.finditer(source):
+        add_text(position, match.start())
+        position = match.end()
+        var_name, statement = match.groups()
+        words = (statement or "").split()
+        name = var_name or (words[-1] if len(words) > 1 else "")
+        if name and name not in scopes[-1]:
+            raise fail(match.start(), f"unknown placeholder {name}")
+        if var_name:
+            stack[-1].body.append(TemplateNode("var", var_name))
+        elif len(words) == 2 and words[0] == "if":
+            node = TemplateNode("if", words[1])
+            stack[-1].body.append(node)
+            stack.append(node)
+            scopes.append(scopes[-1])
+        elif len(words) == 4 and words[0] == "for" and words[2] == "in":
+            node = TemplateNode("for", words[3], loop_var=words[1])
+            stack[-1].body.append(node)
+            stack.append(node)
+            scopes.append(scopes[-1] | {words[1]})
+        elif words in (["endif"], ["endfor"]) and stack[-1].kind == words[0][3:]:
+            stack.pop()
+            scopes.pop()
+        else:
+            raise fail(match.start(), f"unsupported tag {match.group(0).strip()}")
+    add_text(position, len(source))
+    if len(stack) > 1:
+        raise ValueError(f"{label}: unclosed {{% {stack[-1].kind} %}} block")
+    return CompiledTemplate(root.body, names)
+
+
+def telemetry_opts(log_path: Path = JVM_TELEMETRY_LOG_PATH) -> list[str]:
+    """Return rotating unified GC/safepoint logging for the telemetry sidecar."""
+    if validate_env_choice("JVM_TELEMETRY", ("yes", "no"), "no") != "yes":
+        return []
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    return [
+        f"-Xlog:gc*,safepoint:file={log_path}:uptime,level,tags"
+        ":filecount=5,filesize=10m"
+    ]
+
+
+def metrics_enabled() -> bool:
+    """Return whether the metrics sidecar runs; JVM_TELEMETRY=yes implies it."""
+    return "yes" in (
+        validate_env_choice("METRICS", ("yes", "no"), "no"),
+        validate_env_choice("JVM_TELEMETRY", ("yes", "no"), "no"),
+    )
+
+
+def record_heap_decision(
+    decision: HeapDecision, path: Path = JVM_TELEMETRY_HEAP_PATH
+) -> None:
+    """Save the heap policy result for the metrics sidecar when it is enabled."""
+    if not metrics_enabled():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "policy": decision.policy,
+                "max_heap_mb": decision.max_heap_mb,
+                "initial_heap_mb": decision.initial_heap_mb,
+            }
+        )
+        + "\n"
+    )
+
+
+def validate_restart_policy() -> None:
+    """Validate the restart_policy settings before supervisord starts anything."""
+    for name in RESTART_POLICY_ENV_NAMES:
+        value = os.getenv(name)
+        if value and (not value.isdigit() or int(value) < 1):
+            raise ValueError(f"{name} must be a positive whole number: {value}")
+
+
+def validate_telemetry_port() -> None:
+    """Validate the localhost port of the telemetry endpoint."""
+    value = os.getenv("JVM_TELEMETRY_PORT")
+    if value and (not value.isdigit() or not 1 <= int(value) <= 65535):
+        raise ValueError(f"JVM_TELEMETRY_PORT must be a TCP port: {value}")
+
+
+def build_vmoptions_model(
     template_content: str,
     java_heap_size: str,
     initial_heap: int,
     tws_settings_path: Path,
     custom_opts: list[str],
-) -> str:
-    """Render the lightweight vmoptions template."""
-    vmoptions_content = template_content.replace("{{ max_heap }}", java_heap_size)
-    vmoptions_content = vmoptions_content.replace(
-        "{{ initial_heap }}", str(initial_heap)
+    cds_opts: list[str] | None = None,
+    cpu_opts: list[str] | None = None,
+    gc_opts: list[str] | None = None,
+    jvm_telemetry_opts: list[str] | None = None,
+) -> VmOptionsModel:
+    """Render the lightweight vmoptions template into a resolved options model."""
+
+    def sourced(opts: list[str] | None, source: str) -> list[JvmOption]:
+        return [JvmOption(opt, source) for opt in opts or []]
+
+    template = compile_template(
+        template_content, VMOPTIONS_TEMPLATE_NAMES, "vmoptions template"
     )
-    vmoptions_content = vmoptions_content.replace(
-        "{{ tws_settings_path }}", str(tws_settings_path)
+    segments = template.segments(
+        {
+            "max_heap": java_heap_size,
+            "initial_heap": initial_heap,
+            "tws_settings_path": tws_settings_path,
+            "gc_opts": sourced(gc_opts, "gc"),
+            "cpu_opts": sourced(cpu_opts, "cpu"),
+            "telemetry_opts": sourced(jvm_telemetry_opts, "telemetry"),
+            "cds_opts": sourced(cds_opts, "cds"),
+            "custom_opts": sourced(custom_opts, "custom"),
+        }
     )
-    custom_section = (
-        ("# Custom options\n" + "\n".join(custom_opts)) if custom_opts else ""
-    )
-    return vmoptions_content.replace(CUSTOM_OPTS_BLOCK, custom_section)
+
+    # Options from the lists keep their source; every other line is template text.
+    lines: list[list[object]] = [[]]
+    for segment in segments:
+        if isinstance(segment, JvmOption):
+            lines[-1].append(segment)
+            continue
+        first, *rest = str(segment).split("\n")
+        lines[-1].append(first)
+        lines.extend([part] for part in rest)
+
+    model = VmOptionsModel()
+    for parts in lines:
+        options = [part for part in parts if isinstance(part, JvmOption)]
+        text = "".join(
+            part.text if isinstance(part, JvmOption) else str(part) for part in parts
+        )
+        stripped = text.strip()
+        if len(options) == 1 and stripped == options[0].text:
+            model.lines.append(options[0])
+        elif not stripped or stripped.startswith("#"):
+            model.lines.append(text)
+        else:
+            model.lines.append(JvmOption(stripped, "template"))
+    model.resolve()
+    return model
 
 
-def set_java_vmoptions() -> None:
+def render_vmoptions(
+    template_content: str,
+    java_heap_size: str,
+    initial_heap: int,
+    tws_settings_path: Path,
+    custom_opts: list[str],
+    cds_opts: list[str] | None = None,
+    cpu_opts: list[str] | None = None,
+    gc_opts: list[str] | None = None,
+    jvm_telemetry_opts: list[str] | None = None,
+) -> str:
+    """Render the lightweight vmoptions template."""
+    return build_vmoptions_model(
+        template_content,
+        java_heap_size,
+        initial_heap,
+        tws_settings_path,
+        custom_opts,
+        cds_opts,
+        cpu_opts,
+        gc_opts,
+        jvm_telemetry_opts,
+    ).render()
+
+
+def set_java_vmoptions(
+    cds_dump_path: Path | None = None, manifest: RenderManifest | None = None
+) -> None:
     """Configure JVM options for IB Gateway/TWS with robust cgroup memory detection."""
     program = require_env("PROGRAM")
     vmoptions_names(program)
     ib_release_dir = resolve_ib_release_dir(program)
     settings_path = tws_settings_path()
     validate_ib_release_layout(program, ib_release_dir)
-    java_heap_size = calculate_java_heap_size()
-    initial_heap = calculate_initial_heap_size(java_heap_size)
+    resources = detect_container_resources()
+    print(resources.report())
+    heap_decision = decide_heap_size(program, resources)
+    record_heap_decision(heap_decision)
+    java_heap_size = str(heap_decision.max_heap_mb)
+    initial_heap = heap_decision.initial_heap_mb
+    gc_profile = validate_env_choice("JAVA_GC_PROFILE", GC_PROFILES, "throughput")
+    gc_opts = gc_profile_opts(
+        gc_profile, heap_decision.max_heap_mb, resources.cpu_count
+    )
+    print(f"GC profile {gc_profile}: {' '.join(gc_opts)}")
+    if cds_dump_path is None:
+        cds_opts = cds_archive_opts(program, ib_release_dir)
+    else:
+        cds_opts = [f"-XX:ArchiveClassesAtExit={cds_dump_path}"]
 
     template_path = home_path() / "vmoptions.j2"
     if template_path.exists():
         require_file_path(template_path, "VM options template")
         template_content = template_path.read_text()
-        vmoptions_content = render_vmoptions(
+        vmoptions_model = build_vmoptions_model(
             template_content,
             java_heap_size,
             initial_heap,
             settings_path,
             custom_jvm_opts(),
+            cds_opts,
+            cpu_budget_opts(resources),
+            gc_opts,
+            telemetry_opts(),
+        )
+        for decision in vmoptions_model.decisions:
+            print(f"vmoptions: {decision}")
+        print(
+            "Effective JVM settings: " + " ".join(vmoptions_model.effective_settings())
         )
+        vmoptions_content = vmoptions_model.render()
         for vmoptions_file in vmoptions_paths(program, ib_release_dir):
-            vmoptions_file.write_text(vmoptions_content)
+            if manifest is not None:
+                manifest.record(
+                    vmoptions_file, template_path, template_content, vmoptions_content
+                )
+            if not write_if_changed(vmoptions_file, vmoptions_content):
+                print(f"vmoptions file is unchanged: {vmoptions_file}")
+                continue
             print(
                 "Updated vmoptions file "
                 f"(heap={java_heap_size}MB, initial={initial_heap}MB) -> {vmoptions_file}"
@@ -447,8 +1697,197 @@ def set_java_vmoptions() -> None:
         print("VM options template not found; skipping vmoptions generation")
 
 
+def prepare_cds_training() -> Path:
+    """Render vmoptions that make the next IB launch dump an AppCDS archive at exit."""
+    validate_image_layout()
+    program = require_env("PROGRAM")
+    ib_release_dir = resolve_ib_release_dir(program)
+    archive_path = cds_archive_path(program, ib_release_dir)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    archive_path.unlink(missing_ok=True)
+    cds_stamp_path(archive_path).unlink(missing_ok=True)
+    set_java_vmoptions(cds_dump_path=archive_path)
+    return archive_path
+
+
+def record_cds_archive() -> Path:
+    """Stamp the trained AppCDS archive with the JVM that dumped it."""
+    program = require_env("PROGRAM")
+    ib_release_dir = resolve_ib_release_dir(program)
+    archive_path = cds_archive_path(program, ib_release_dir)
+    if not archive_path.is_file() or archive_path.stat().st_size == 0:
+        raise RuntimeError(f"AppCDS training run did not dump {archive_path}")
+    java_home = install4j_java_home(ib_release_dir / ".install4j")
+    atomic_write_text(cds_stamp_path(archive_path), jvm_fingerprint(java_home) + "\n")
+    return archive_path
+
+
+def ibc_tws_path(program: str, ib_release_dir: Path) -> Path:
+    """Return IBC's --tws-path; it appends /ibgateway/<release> for Gateway."""
+    if program == "ibgateway":
+        return ib_release_dir.parent.parent
+    return ib_release_dir.parent
+
+
+def launch_plan_content(program: str, ib_release_dir: Path) -> str:
+    """Return shell assignments start_ibc sources instead of re-resolving the layout."""
+    values = {
+        "IB_PROGRAM": program,
+        "IB_RELEASE_DIR": str(ib_release_dir),
+        "IB_RELEASE": ib_release_dir.name,
+        "IB_BASE_DIR": str(ibc_tws_path(program, ib_release_dir)),
+        "IBC_PATH": require_env("IBC_PATH"),
+        "IBC_INI": require_env("IBC_INI"),
+        "IBC_VERSION": require_env("IBC_VERSION"),
+        "TWS_SETTINGS_PATH": str(tws_settings_path()),
+        "TRADING_MODE": validate_env_choice("TRADING_MODE", ("paper", "live"), "paper"),
+        "TWOFA_TIMEOUT_ACTION": validate_env_choice(
+            "TWOFA_TIMEOUT_ACTION", ("exit", "restart"), "exit"
+        ),
+    }
+    lines = ["# Generated by init_container_settings; sourced by start_ibc."]
+    lines += [f"{name}={shlex.quote(value)}" for name, value in values.items()]
+    lines.append(f"IBC_ARGS=({'-g' if program == 'ibgateway' else ''})")
+    return "\n".join(lines) + "\n"
+
+
+def write_launch_plan() -> Path:
+    """Write the validated launch plan for start_ibc, only when it changed."""
+    program = require_env("PROGRAM")
+    plan_path = home_path() / LAUNCH_PLAN_NAME
+    if write_if_changed(
+        plan_path, launch_plan_content(program, resolve_ib_release_dir(program))
+    ):
+        print(f"Updated IBC launch plan {plan_path}")
+    return plan_path
+
+
+def render_manifest_path() -> Path:
+    return home_path() / RENDER_MANIFEST_NAME
+
+
+@dataclass
+class StartupPhase:
+    name: str
+    start: float
+    end: float | None = None
+    pid: int | None = None
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.end is None else self.end - self.start
+
+
+def startup_phases_path() -> Path:
+    return Path(os.environ.get("STARTUP_PHASES_FILE") or STARTUP_PHASES_PATH)
+
+
+def boot_clock_seconds() -> float:
+    """Return /proc/uptime, the same monotonic clock and resolution the shell stages use."""
+    return float(Path("/proc/uptime").read_text().split()[0])
+
+
+def record_phase(event: str, phase: str) -> None:
+    """Append a startup phase event; timing must never fail the start itself."""
+    path = startup_phases_path()
+    try:
+        record = {"t": boot_clock_seconds(), "event": event, "phase": phase}
+        line = json.dumps({**record, "pid": os.getpid()})
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as handle:
+            handle.write(line + "\n")
+    except OSError:
+        pass
+
+
+def load_startup_phases(path: Path) -> list[StartupPhase]:
+    """Pair begin and end events into phases, in the order they began."""
+    phases: list[StartupPhase] = []
+    open_phases: dict[str, StartupPhase] = {}
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return phases
+    for line in lines:
+        try:
+            record = json.loads(line)
+            event, name, timestamp = (
+                record["event"],
+                record["phase"],
+                float(record["t"]),
+            )
+        except (ValueError, KeyError, TypeError):
+            continue
+        if event == "begin":
+            # A supervisord restart begins the phase again; keep both runs.
+            open_phases[name] = StartupPhase(name, timestamp, pid=record.get("pid"))
+            phases.append(open_phases[name])
+        elif event == "end" and name in open_phases:
+            open_phases.pop(name).end = timestamp
+    return phases
+
+
+def render_startup_waterfall(phases: list[StartupPhase]) -> str:
+    """Return the phases as a text waterfall relative to the first phase."""
+    if not phases:
+        return "No startup phases recorded\n"
+    origin = min(phase.start for phase in phases)
+    horizon = max(
+        (phase.end if phase.end is not None else phase.start) for phase in phases
+    )
+    scale = WATERFALL_BAR_WIDTH / max(horizon - origin, 0.001)
+    name_width = max(len(phase.name) for phase in phases)
+    lines = [f"{'phase':<{name_width}}   start  duration"]
+    for phase in phases:
+        offset = phase.start - origin
+        duration = phase.duration
+        lead = " " * round(offset * scale)
+        if duration is None:
+            lines.append(
+                f"{phase.name:<{name_width}} {offset:7.2f}s {'running':>9} {lead}>"
+            )
+            continue
+        bar = "#" * max(1, round(duration * scale))
+        lines.append(
+            f"{phase.name:<{name_width}} {offset:7.2f}s {duration:8.2f}s {lead}{bar}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def render_startup_metrics(phases: list[StartupPhase]) -> str:
+    """Return the latest run of each finished phase in Prometheus text format."""
+    latest: dict[str, StartupPhase] = {}
+    for phase in phases:
+        if phase.end is not None:
+            latest[phase.name] = phase
+    origin = min((phase.start for phase in phases), default=0.0)
+    lines = [
+        "# HELP ib_startup_phase_seconds Duration of the latest run of each startup phase.",
+        "# TYPE ib_startup_phase_seconds gauge",
+    ]
+    lines += [
+        f'ib_startup_phase_seconds{{phase="{name}"}} {phase.duration:.3f}'
+        for name, phase in latest.items()
+    ]
+    lines += [
+        "# HELP ib_startup_phase_offset_seconds When each startup phase began, relative to container start.",
+        "# TYPE ib_startup_phase_offset_seconds gauge",
+    ]
+    lines += [
+        f'ib_startup_phase_offset_seconds{{phase="{name}"}} {phase.start - origin:.3f}'
+        for name, phase in latest.items()
+    ]
+    return "\n".join(lines) + "\n"
+
+
 def main() -> None:
+    started = time.perf_counter()
+    record_phase("begin", "init.validate")
     validate_runtime_environment()
+    record_phase("end", "init.validate")
+    record_phase("begin", "init.render_configs")
+    manifest = load_render_manifest(render_manifest_path())
+    recover_partial_writes(manifest)
 
     ibc_ini_path = Path(require_env("IBC_INI"))
     default_ibc_dir = Path(os.environ.get("IBC_PATH", str(ibc_ini_path.parent)))
@@ -458,6 +1897,7 @@ def main() -> None:
         ibc_ini_path,
         "ibc.ini",
         default_ibc_template_path,
+        manifest,
     )
 
     settings_path = tws_settings_path()
@@ -468,15 +1908,68 @@ def main() -> None:
         jts_ini_path,
         "jts.ini",
         default_jts_template_path,
+        manifest,
     )
+    record_phase("end", "init.render_configs")
 
-    set_java_vmoptions()
+    record_phase("begin", "init.vmoptions")
+    set_java_vmoptions(manifest=manifest)
+    record_phase("end", "init.vmoptions")
+    write_launch_plan()
+    if manifest.save():
+        print(f"Updated render manifest {manifest.path}")
+    print(f"Container init completed in {(time.perf_counter() - started) * 1000:.0f}ms")
 
 
-def run() -> int:
+def run(argv: list[str] | None = None) -> int:
     """Run runtime config initialization from the command line."""
+    parser = argparse.ArgumentParser(prog="init_container_settings")
+    parser.add_argument(
+        "--check-layout",
+        action="store_true",
+        help="Only validate the installed IB and IBC layout, as done at image build",
+    )
+    parser.add_argument(
+        "--cds-training",
+        action="store_true",
+        help="Render vmoptions that dump an AppCDS archive when IB exits",
+    )
+    parser.add_argument(
+        "--cds-record",
+        action="store_true",
+        help="Verify the trained AppCDS archive and record its JVM",
+    )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="Print the recorded startup phases as a waterfall",
+    )
+    parser.add_argument(
+        "--startup-metrics",
+        action="store_true",
+        help="Print the recorded startup phase durations as Prometheus metrics",
+    )
+    args = parser.parse_args(argv or [])
     try:
-        main()
+        if args.startup_report:
+            print(
+                render_startup_waterfall(load_startup_phases(startup_phases_path())),
+                end="",
+            )
+        elif args.startup_metrics:
+            print(
+                render_startup_metrics(load_startup_phases(startup_phases_path())),
+                end="",
+            )
+        elif args.check_layout:
+            validate_image_layout()
+            print("IB and IBC layout is valid")
+        elif args.cds_training:
+            print(f"AppCDS training will dump {prepare_cds_training()}")
+        elif args.cds_record:
+            print(f"Recorded AppCDS archive {record_cds_archive()}")
+        else:
+            main()
     except (RuntimeError, ValueError, OSError) as exc:
         print(f"ERROR: {exc}", file=sys.stderr)
         return 1
@@ -484,4 +1977,4 @@ def run() -> int:
 
 
 if __name__ == "__main__":
-    raise SystemExit(run())
+    raise SystemExit(run(sys.argv[1:]))
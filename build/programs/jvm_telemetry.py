@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import sys
+import time
+import xmlrpc.client
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import TextIO
+
+GC_LOG_PATH = Path("/tmp/ib-jvm-telemetry/gc.log")
+# Written by init_container_settings; keep in sync with JVM_TELEMETRY_HEAP_PATH.
+HEAP_DECISION_PATH = Path("/tmp/ib-jvm-telemetry/heap.json")
+# Written by ibc_events; keep in sync with its IBC_EVENTS_PATH.
+IBC_EVENTS_PATH = Path("/tmp/ib-ibc/events.jsonl")
+SUPERVISOR_SOCKET_PATH = Path("/tmp/supervisor.sock")
+SUPERVISOR_TIMEOUT_SECONDS = 3
+DEFAULT_TELEMETRY_PORT = 9404
+PAUSE_BUCKETS_SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_UNIT_BYTES = {"B": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+# Unified logging lines rendered with the uptime,level,tags decorators.
+LOG_LINE_REG = re.compile(
+    r"\[(?P<uptime>[0-9.]+)s\]\[\w+\s*\]\[(?P<tags>[\w,]+)\s*\] (?P<message>.*)"
+)
+PAUSE_REG = re.compile(
+    r"GC\(\d+\) Pause (?P<kind>\w+).*?"
+    r"(?: (?P<before>\d+)(?P<before_unit>[BKMG])->(?P<after>\d+)(?P<after_unit>[BKMG])"
+    r"\((?P<capacity>\d+)(?P<capacity_unit>[BKMG])\))? (?P<ms>[0-9.]+)ms"
+)
+SAFEPOINT_REG = re.compile(
+    r'Safepoint "\w+".*Reaching safepoint: (?P<reaching>\d+) ns'
+    r".*At safepoint: (?P<at>\d+) ns"
+)
+# ibc_events event types that move the login state; matches ib_health.
+LOGIN_STATE_BY_EVENT = {
+    "ibc_started": "logging_in",
+    "login_started": "logging_in",
+    "twofa_pending": "twofa_pending",
+    "twofa_timeout": "logged_out",
+    "existing_session": "logged_out",
+    "logged_in": "logged_in",
+    "api_ready": "logged_in",
+    "auto_restart": "logged_out",
+    "exit": "logged_out",
+}
+LOGIN_STATES = ("unknown", "logging_in", "twofa_pending", "logged_in", "logged_out")
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = PAUSE_BUCKETS_SECONDS
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float) -> None:
+        if not self.counts:
+            self.counts = [0] * len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class GcTelemetry:
+    pauses: dict[str, Histogram] = field(default_factory=dict)
+    heap_used_bytes: int | None = None
+    heap_committed_bytes: int | None = None
+    allocated_bytes: int = 0
+    uptime_seconds: float = 0.0
+    safepoints: int = 0
+    safepoint_reaching_seconds: float = 0.0
+    safepoint_at_seconds: float = 0.0
+    safepoint_max_seconds: float = 0.0
+
+    def record_line(self, line: str) -> bool:
+        """Update the metrics from one GC log line; return whether it was used."""
+        match = LOG_LINE_REG.match(line)
+        if match is None:
+            return False
+        uptime = float(match.group("uptime"))
+        if uptime < self.uptime_seconds:
+            # A restarted JVM logs from zero; its heap is not the old one.
+            self.heap_used_bytes = None
+        self.uptime_seconds = uptime
+        message = match.group("message")
+        tags = match.group("tags").split(",")
+        if "safepoint" in tags:
+            return self.record_safepoint(message)
+        if "gc" in tags:
+            return self.record_pause(message)
+        return False
+
+    def record_pause(self, message: str) -> bool:
+        match = PAUSE_REG.search(message)
+        if match is None:
+            return False
+        pause = self.pauses.setdefault(match.group("kind"), Histogram())
+        pause.observe(float(match.group("ms")) / 1000)
+        if match.group("before") is not None:
+            before = size_bytes(match.group("before"), match.group("before_unit"))
+            if self.heap_used_bytes is not None and before >= self.heap_used_bytes:
+                self.allocated_bytes += before - self.heap_used_bytes
+            self.heap_used_bytes = size_bytes(
+                match.group("after"), match.group("after_unit")
+            )
+            self.heap_committed_bytes = size_bytes(
+                match.group("capacity"), match.group("capacity_unit")
+            )
+        return True
+
+    def record_safepoint(self, message: str) -> bool:
+        match = SAFEPOINT_REG.search(message)
+        if match is None:
+            return False
+        reaching = int(match.group("reaching")) / 1e9
+        at = int(match.group("at")) / 1e9
+        self.safepoints += 1
+        self.safepoint_reaching_seconds += reaching
+        self.safepoint_at_seconds += at
+        self.safepoint_max_seconds = max(self.safepoint_max_seconds, reaching + at)
+        return True
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP jvm_gc_pause_seconds Stop-the-world GC pauses by pause kind.",
+            "# TYPE jvm_gc_pause_seconds histogram",
+        ]
+        for kind, pause in sorted(self.pauses.items()):
+            for bound, count in zip(pause.buckets, pause.counts):
+                lines.append(
+                    f'jvm_gc_pause_seconds_bucket{{kind="{kind}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'jvm_gc_pause_seconds_bucket{{kind="{kind}",le="+Inf"}} {pause.count}'
+            )
+            lines.append(f'jvm_gc_pause_seconds_sum{{kind="{kind}"}} {pause.total}')
+            lines.append(f'jvm_gc_pause_seconds_count{{kind="{kind}"}} {pause.count}')
+        gauges = [
+            (
+                "jvm_gc_heap_used_bytes",
+                "Heap occupancy after the last GC.",
+                self.heap_used_bytes,
+            ),
+            (
+                "jvm_gc_heap_committed_bytes",
+                "Heap capacity at the last GC.",
+                self.heap_committed_bytes,
+            ),
+            (
+                "jvm_uptime_seconds",
+                "JVM uptime at the last GC log line.",
+                self.uptime_seconds,
+            ),
+            (
+                "jvm_safepoint_max_seconds",
+                "Longest safepoint, including time to reach it.",
+                self.safepoint_max_seconds,
+            ),
+        ]
+        counters = [
+            (
+                "jvm_gc_allocated_bytes_total",
+                "Bytes allocated between GCs.",
+                self.allocated_bytes,
+            ),
+            ("jvm_safepoints_total", "Safepoints reached.", self.safepoints),
+            (
+                "jvm_safepoint_reaching_seconds_total",
+                "Time spent reaching safepoints.",
+                self.safepoint_reaching_seconds,
+            ),
+            (
+                "jvm_safepoint_seconds_total",
+                "Time spent at safepoints.",
+                self.safepoint_at_seconds,
+            ),
+        ]
+        for name, help_text, value in gauges:
+            if value is not None:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                lines.append(f"{name} {value}")
+        for name, help_text, value in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class SessionTelemetry:
+    events: dict[str, int] = field(default_factory=dict)
+    login_state: str = "unknown"
+    login_transitions: dict[str, int] = field(default_factory=dict)
+    started_at: float | None = None
+    api_ready_seconds: float | None = None
+
+    def record_line(self, line: str) -> bool:
+        """Update the metrics from one ibc_events line; return whether it was used."""
+        try:
+            record = json.loads(line)
+            event = str(record["event"])
+            event_time = float(record.get("time", time.time()))
+        except (ValueError, TypeError, KeyError):
+            return False
+        self.events[event] = self.events.get(event, 0) + 1
+        if event == "ibc_started":
+            self.started_at = event_time
+        elif event == "api_ready" and self.started_at is not None:
+            self.api_ready_seconds = round(event_time - self.started_at, 3)
+            self.started_at = None
+        state = LOGIN_STATE_BY_EVENT.get(event)
+        if state is not None and state != self.login_state:
+            self.login_state = state
+            self.login_transitions[state] = self.login_transitions.get(state, 0) + 1
+        return True
+
+    def render(self) -> list[str]:
+        lines = [
+            "# HELP ib_ibc_events_total IBC login and session events by type.",
+            "# TYPE ib_ibc_events_total counter",
+        ]
+        for event, count in sorted(self.events.items()):
+            lines.append(f'ib_ibc_events_total{{event="{event}"}} {count}')
+        lines += [
+            "# HELP ib_login_state Current login state, 1 for the active state.",
+            "# TYPE ib_login_state gauge",
+        ]
+        for state in LOGIN_STATES:
+            value = int(state == self.login_state)
+            lines.append(f'ib_login_state{{state="{state}"}} {value}')
+        lines += [
+            "# HELP ib_login_transitions_total Login state changes by new state.",
+            "# TYPE ib_login_transitions_total counter",
+        ]
+        for state, count in sorted(self.login_transitions.items()):
+            lines.append(f'ib_login_transitions_total{{state="{state}"}} {count}')
+        if self.api_ready_seconds is not None:
+            lines += [
+                "# HELP ib_api_ready_seconds Time from IBC start to API ready, last start.",
+                "# TYPE ib_api_ready_seconds gauge",
+                f"ib_api_ready_seconds {self.api_ready_seconds}",
+            ]
+        return lines
+
+
+@dataclass
+class ProgramTelemetry:
+    starts: dict[str, int] = field(default_factory=dict)
+    restarts: dict[str, int] = field(default_factory=dict)
+
+    def render(self, infos: list[dict[str, object]]) -> list[str]:
+        """Render supervisord process info, counting starts seen since the last scrape."""
+        up = ["# HELP ib_program_up Whether supervisord reports the program RUNNING."]
+        up.append("# TYPE ib_program_up gauge")
+        uptime = ["# HELP ib_program_uptime_seconds Seconds since the program started."]
+        uptime.append("# TYPE ib_program_uptime_seconds gauge")
+        restarts = [
+            "# HELP ib_program_restarts_total Program restarts seen by the sidecar.",
+            "# TYPE ib_program_restarts_total counter",
+        ]
+        for info in sorted(infos, key=lambda info: str(info["name"])):
+            name = str(info["name"])
+            start = int(info["start"])
+            running = info["statename"] == "RUNNING"
+            if start and self.starts.get(name, start) != start:
+                self.restarts[name] = self.restarts.get(name, 0) + 1
+            if start:
+                self.starts[name] = start
+            up.append(f'ib_program_up{{program="{name}"}} {int(running)}')
+            seconds = int(info["now"]) - start if running and start else 0
+            uptime.append(f'ib_program_uptime_seconds{{program="{name}"}} {seconds}')
+            count = self.restarts.get(name, 0)
+            restarts.append(f'ib_program_restarts_total{{program="{name}"}} {count}')
+        return up + uptime + restarts
+
+
+class GcLogFollower:
+    """Read new GC log lines, following the JVM's file rotation."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.handle: TextIO | None = None
+        self.inode: int | None = None
+        self.partial = ""
+
+    def read_lines(self) -> list[str]:
+        lines = self.drain()
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return lines
+        if (
+            self.handle is None
+            or stat.st_ino != self.inode
+            or stat.st_size < self.handle.tell()
+        ):
+            # Finish the rotated file above before switching to the new one.
+            if self.handle is not None:
+                self.handle.close()
+            self.handle = self.path.open(encoding="utf-8", errors="replace")
+            self.inode = stat.st_ino
+            self.partial = ""
+            lines += self.drain()
+        return lines
+
+    def drain(self) -> list[str]:
+        if self.handle is None:
+            return []
+        *lines, self.partial = (self.partial + self.handle.read()).split("\n")
+        return lines
+
+
+class UnixSocketHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: Path, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(str(self.socket_path))
+
+
+class UnixSocketTransport(xmlrpc.client.Transport):
+    """XML-RPC transport for supervisord's unix_http_server socket."""
+
+    def __init__(self, socket_path: Path, timeout: float) -> None:
+        super().__init__()
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def make_connection(self, host: object) -> http.client.HTTPConnection:
+        # Reuse one keep-alive connection across scrapes.
+        if self._connection[1] is None:
+            self._connection = (
+                host,
+                UnixSocketHTTPConnection(self.socket_path, self.timeout),
+            )
+        return self._connection[1]
+
+
+def supervisor_process_info(
+    socket_path: Path = SUPERVISOR_SOCKET_PATH,
+) -> Callable[[], list[dict[str, object]]]:
+    """Return a callable that reads every program's state from supervisord."""
+    proxy = xmlrpc.client.ServerProxy(
+        "http://localhost",
+        transport=UnixSocketTransport(socket_path, SUPERVISOR_TIMEOUT_SECONDS),
+    )
+    return lambda: proxy.supervisor.getAllProcessInfo()
+
+
+def render_heap_decision(path: Path) -> list[str]:
+    """Render the heap sizes chosen by init_container_settings, if recorded."""
+    try:
+        decision = json.loads(path.read_text())
+        policy = decision["policy"]
+        sizes = (decision["max_heap_mb"], decision["initial_heap_mb"])
+    except (OSError, ValueError, KeyError):
+        return []
+    lines = []
+    for name, help_text, megabytes in (
+        ("ib_heap_max_bytes", "Max heap chosen by the heap policy.", sizes[0]),
+        ("ib_heap_initial_bytes", "Initial heap chosen by the heap policy.", sizes[1]),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines.append(f'{name}{{policy="{policy}"}} {int(megabytes) * 1024**2}')
+    return lines
+
+
+def size_bytes(value: str, unit: str) -> int:
+    return int(value) * SIZE_UNIT_BYTES[unit]
+
+
+def telemetry_port() -> int:
+    """Return the localhost port for the metrics endpoint."""
+    value = os.getenv("JVM_TELEMETRY_PORT") or str(DEFAULT_TELEMETRY_PORT)
+    if not value.isdigit() or not 1 <= int(value) <= 65535:
+        raise ValueError(f"JVM_TELEMETRY_PORT must be a TCP port: {value}")
+    return int(value)
+
+
+def collect(telemetry: GcTelemetry, follower: GcLogFollower) -> str:
+    """Fold new GC log lines into the metrics and render them."""
+    for line in follower.read_lines():
+        telemetry.record_line(line)
+    return telemetry.render()
+
+
+class ContainerTelemetry:
+    """Render JVM, session, program and heap metrics; all work happens per scrape."""
+
+    def __init__(
+        self,
+        gc_log: Path = GC_LOG_PATH,
+        events_path: Path = IBC_EVENTS_PATH,
+        heap_path: Path = HEAP_DECISION_PATH,
+        process_info: Callable[[], list[dict[str, object]]] | None = None,
+    ) -> None:
+        self.gc = GcTelemetry()
+        self.gc_follower = GcLogFollower(gc_log)
+        self.session = SessionTelemetry()
+        self.events_follower = GcLogFollower(events_path)
+        self.programs = ProgramTelemetry()
+        self.heap_path = heap_path
+        self.process_info = process_info
+
+    def collect(self) -> str:
+        lines = [collect(self.gc, self.gc_follower).rstrip("\n")]
+        for line in self.events_follower.read_lines():
+            self.session.record_line(line)
+        lines += self.session.render()
+        lines += render_heap_decision(self.heap_path)
+        supervisor_up = 0
+        if self.process_info is not None:
+            try:
+                lines += self.programs.render(self.process_info())
+                supervisor_up = 1
+            except (OSError, xmlrpc.client.Error, http.client.HTTPException):
+                pass
+            lines += [
+                "# HELP ib_supervisor_up Whether supervisord answered this scrape.",
+                "# TYPE ib_supervisor_up gauge",
+                f"ib_supervisor_up {supervisor_up}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def serve(telemetry: ContainerTelemetry, port: int) -> None:
+    """Serve /metrics on localhost, reading the logs and supervisord on each scrape."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.collect().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            return
+
+    server = HTTPServer(("127.0.0.1", port), MetricsHandler)
+    print(f"Serving container telemetry on http://127.0.0.1:{port}/metrics")
+    server.serve_forever()
+
+
+def run(argv: list[str] | None = None) -> int:
+    """Run the JVM telemetry sidecar from the command line."""
+    parser = argparse.ArgumentParser(prog="jvm_telemetry")
+    parser.add_argument("--gc-log", type=Path, default=GC_LOG_PATH)
+    parser.add_argument("--ibc-events", type=Path, default=IBC_EVENTS_PATH)
+    parser.add_argument("--heap-decision", type=Path, default=HEAP_DECISION_PATH)
+    parser.add_argument(
+        "--supervisor-socket", type=Path, default=SUPERVISOR_SOCKET_PATH
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Print the metrics for the current GC log and exit",
+    )
+    args = parser.parse_args(argv or [])
+    telemetry = ContainerTelemetry(
+        args.gc_log,
+        args.ibc_events,
+        args.heap_decision,
+        supervisor_process_info(args.supervisor_socket),
+    )
+    try:
+        if args.once:
+            print(telemetry.collect(), end="")
+        elif "yes" not in (os.getenv("METRICS"), os.getenv("JVM_TELEMETRY")):
+            print("Metrics are disabled (METRICS and JVM_TELEMETRY)")
+        else:
+            serve(telemetry, telemetry_port())
+    except (ValueError, OSError) as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run(sys.argv[1:]))
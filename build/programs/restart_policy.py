@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+# One JSON-lines file per program; the entrypoint clears it on container start.
+RESTART_HISTORY_DIR = Path("/tmp/ib-restarts")
+HISTORY_LIMIT = 100
+# Environment variable and default for each policy setting, in seconds or starts.
+POLICY_ENV = {
+    "base_seconds": ("RESTART_BACKOFF_BASE_SECONDS", 2),
+    "max_seconds": ("RESTART_BACKOFF_MAX_SECONDS", 300),
+    "window_seconds": ("RESTART_WINDOW_SECONDS", 3600),
+    "window_max": ("RESTART_WINDOW_MAX", 10),
+}
+
+
+@dataclass
+class RestartPolicy:
+    base_seconds: int = 2
+    max_seconds: int = 300
+    window_seconds: int = 3600
+    window_max: int = 10
+
+    @classmethod
+    def from_env(cls) -> "RestartPolicy":
+        """Read the policy from RESTART_* environment variables."""
+        values = {}
+        for field_name, (name, default) in POLICY_ENV.items():
+            value = os.getenv(name) or str(default)
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"{name} must be a positive whole number: {value}")
+            values[field_name] = int(value)
+        if values["base_seconds"] > values["max_seconds"]:
+            raise ValueError(
+                "RESTART_BACKOFF_BASE_SECONDS must not exceed RESTART_BACKOFF_MAX_SECONDS"
+            )
+        return cls(**values)
+
+
+@dataclass
+class RestartRecord:
+    program: str
+    time: float
+    started: float
+    attempt: int
+    delay: float
+    reason: str
+
+
+def history_path(program: str, history_dir: Path = RESTART_HISTORY_DIR) -> Path:
+    return history_dir / f"{program}.jsonl"
+
+
+def load_history(path: Path) -> list[RestartRecord]:
+    """Return the recorded starts of one program, oldest first."""
+    records = []
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return records
+    for line in lines:
+        try:
+            records.append(RestartRecord(**json.loads(line)))
+        except (ValueError, TypeError):
+            continue
+    return records
+
+
+def plan_start(
+    policy: RestartPolicy,
+    history: list[RestartRecord],
+    now: float,
+    rng: random.Random,
+) -> tuple[int, float, str]:
+    """Return the attempt number, delay and reason for the next start."""
+    if not history:
+        return 0, 0.0, "first start"
+    ran_for = now - history[-1].started
+    if ran_for >= policy.max_seconds:
+        attempt, delay, reason = 0, 0.0, f"previous run lasted {ran_for:.0f}s"
+    else:
+        attempt = history[-1].attempt + 1
+        backoff = min(policy.max_seconds, policy.base_seconds * 2 ** (attempt - 1))
+        # Equal jitter: never less than half the backoff, so a storm still slows
+        # down, while programs that failed together spread their restarts.
+        delay = backoff / 2 + rng.uniform(0, backoff / 2)
+        reason = f"restart {attempt} after a {ran_for:.0f}s run"
+    recent = [
+        record for record in history if now - record.started < policy.window_seconds
+    ]
+    if len(recent) >= policy.window_max:
+        hold = recent[-policy.window_max].started + policy.window_seconds - now
+        if hold > delay:
+            delay = hold
+            reason = f"{len(recent)} starts in the last {policy.window_seconds}s"
+    return attempt, delay, reason
+
+
+def record_start(path: Path, record: RestartRecord) -> None:
+    """Append a start to the history, keeping only the newest HISTORY_LIMIT."""
+    history = load_history(path)[-(HISTORY_LIMIT - 1) :] + [record]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_text(
+        "".join(json.dumps(asdict(entry)) + "\n" for entry in history),
+        encoding="utf-8",
+    )
+    os.replace(temp_path, path)
+
+
+def render_history(history_dir: Path, program: str | None = None) -> str:
+    """Return the restart history of one or every program as a table."""
+    paths = (
+        [history_path(program, history_dir)]
+        if program
+        else sorted(history_dir.glob("*.jsonl"))
+    )
+    lines = [f"{'time':<19}  {'program':<10} {'attempt':>7} {'delay':>8}  reason"]
+    for path in paths:
+        for record in load_history(path):
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.time))
+            lines.append(
+                f"{started:<19}  {record.program:<10} {record.attempt:>7} "
+                f"{record.delay:>7.1f}s  {record.reason}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def supervise(
+    program: str,
+    command: list[str],
+    policy: RestartPolicy,
+    history_dir: Path = RESTART_HISTORY_DIR,
+    rng: random.Random | None = None,
+) -> RestartRecord:
+    """Wait out the restart policy for a program and record its start."""
+    path = history_path(program, history_dir)
+    attempt, delay, reason = plan_start(
+        policy, load_history(path), time.monotonic(), rng or random.Random()
+    )
+    if delay > 0:
+        print(f"{program}: {reason}; waiting {delay:.1f}s before starting", flush=True)
+        time.sleep(delay)
+    record = RestartRecord(
+        program,
+        round(time.time(), 3),
+        time.monotonic(),
+        attempt,
+        round(delay, 3),
+        reason,
+    )
+    record_start(path, record)
+    return record
+
+
+def run(argv: list[str] | None = None) -> int:
+    """Start a supervised program under the restart policy, or show the history."""
+    parser = argparse.ArgumentParser(
+        prog="restart_policy",
+        usage=(
+            "restart_policy PROGRAM COMMAND [ARG ...]\n"
+            "       restart_policy --history [PROGRAM]"
+        ),
+    )
+    parser.add_argument(
+        "--history", action="store_true", help="Print the restart history and exit"
+    )
+    parser.add_argument("--history-dir", type=Path, default=RESTART_HISTORY_DIR)
+    parser.add_argument("program", nargs="?")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv or [])
+    if args.history:
+        print(render_history(args.history_dir, args.program), end="")
+        return 0
+    if not args.program or not args.command:
+        parser.error("PROGRAM and COMMAND are required")
+    try:
+        supervise(
+            args.program, args.command, RestartPolicy.from_env(), args.history_dir
+        )
+        os.execvp(args.command[0], args.command)
+    except (ValueError, OSError) as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run(sys.argv[1:]))
@@ -3,12 +3,19 @@ set -euo pipefail
 
 source /usr/local/lib/ib_utils
 
-start_ibc() {
-	local app_name
+# Read by ibc_events; keep in sync with its IBC_LOG_PATH.
+IBC_LOG_FILE="/tmp/ib-ibc/ibc.log"
+# IBC can run for days across auto-restarts; keep at most this much plus one
+# rotated file.
+IBC_LOG_MAX_BYTES=$((5 * 1024 * 1024))
+# Warm restart state; the entrypoint clears both on each container start.
+IBC_WARM_FILE="/tmp/ib-ibc/warm"
+IBC_EXIT_FILE="/tmp/ib-ibc/exited"
+
+# Resolve and validate the launch settings in the shell. Used when
+# init_container_settings has not written a launch plan, e.g. at image build.
+resolve_launch_from_environment() {
 	local home_dir
-	local ibc_version
-	local ibc_args=()
-	local ibc_pid
 
 	app_name="$(ib_product_executable)"
 	TRADING_MODE="$(ib_trading_mode)"
@@ -32,11 +39,53 @@ start_ibc() {
 	ensure_absolute_path TWS_SETTINGS_PATH
 	ensure_directory_path "$TWS_SETTINGS_PATH" "TWS settings path"
 	mkdir -p "$TWS_SETTINGS_PATH"
+}
+
+# Load the paths and arguments init_container_settings resolved after
+# validating the same layout at container start, without forking.
+load_launch_plan() {
+	local launch_plan="$1"
+
+	# shellcheck source=/dev/null
+	source "$launch_plan"
+	app_name="$IB_PROGRAM"
+	ibc_version="$IBC_VERSION"
+	ibc_args=("${IBC_ARGS[@]}")
+	log "Using launch plan ${launch_plan}"
+}
+
+start_ibc() {
+	local app_name
+	local ibc_version
+	local ibc_args=()
+	local ibc_pid
+	local x_server
+	local launch_plan="${HOME:-}/.ib-launch-plan.sh"
+
+	phase_begin ibc_launch_plan
+	if [ -n "${HOME:-}" ] && [ -f "$launch_plan" ]; then
+		load_launch_plan "$launch_plan"
+	else
+		resolve_launch_from_environment
+	fi
+	phase_end ibc_launch_plan
 
 	# Set up X11 environment for IBC
 	export XAUTHORITY="$HOME/.Xauthority"
+	phase_begin x_server_wait
 	wait_for_x_server
-	run_script_dir X_SCRIPTS "X"
+	phase_end x_server_wait
+	mkdir -p "${IBC_LOG_FILE%/*}"
+	# Xvfb outlives IBC under supervisord; only rerun the X hooks for a new X server.
+	x_server="$(x_server_pid)"
+	if x_hooks_current "$IBC_WARM_FILE" "$x_server"; then
+		log "Warm restart: X server ${x_server} is unchanged; skipping X hooks"
+	else
+		phase_begin x_scripts
+		run_script_dir X_SCRIPTS "X"
+		phase_end x_scripts
+		printf 'x_server=%s\n' "$x_server" >"$IBC_WARM_FILE"
+	fi
 
 	log ".> Starting IBC in ${TRADING_MODE} mode, with params:"
 	echo ".>		Version: ${IB_RELEASE}"
@@ -49,7 +98,13 @@ start_ibc() {
 	echo ".>		tws-settings-path: ${TWS_SETTINGS_PATH}"
 	echo ".>		on2fatimeout: ${TWOFA_TIMEOUT_ACTION}"
 
-	# start IBC with -g for gateway
+	# Keep a copy of the IBC output for ibc_events; supervisord still forwards
+	# everything to the container log.
+	exec > >(tee_bounded "$IBC_LOG_FILE" "$IBC_LOG_MAX_BYTES") 2>&1
+
+	# start IBC with -g for gateway; the ibc phase lasts until IBC exits
+	report_ibc_restart_latency "$IBC_EXIT_FILE"
+	phase_begin ibc
 	"${IBC_PATH}/scripts/ibcstart.sh" "${IB_RELEASE}" "${ibc_args[@]}" \
 		"--tws-path=${IB_BASE_DIR}" \
 		"--ibc-ini=${IBC_INI}" \
@@ -59,10 +114,14 @@ start_ibc() {
 	ibc_pid="$!"
 
 	trap 'kill "$ibc_pid" 2>/dev/null || true; wait "$ibc_pid" 2>/dev/null || true; exit 143' TERM INT
-	trap 'status=$?; kill "$ibc_pid" 2>/dev/null || true; wait "$ibc_pid" 2>/dev/null || true; exit "$status"' ERR
+	trap 'status=$?; kill "$ibc_pid" 2>/dev/null || true; wait "$ibc_pid" 2>/dev/null || true; mark_ibc_exit "$IBC_EXIT_FILE"; exit "$status"' ERR
 
+	phase_begin ibc_scripts
 	run_script_dir IBC_SCRIPTS "IBC"
+	phase_end ibc_scripts
 	wait "$ibc_pid"
+	phase_end ibc
+	mark_ibc_exit "$IBC_EXIT_FILE"
 }
 
 start_ibc
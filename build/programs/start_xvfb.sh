@@ -5,6 +5,14 @@ source /usr/local/lib/ib_utils
 
 start_xvfb() {
 	local xvfb_pattern
+	local ready_fifo
+	local displayfd_pipe
+	local displayfd
+	local ready_fd
+	local xvfb_pid
+	local waited=0
+
+	phase_begin xvfb_setup
 
 	# Ensure X11 dir exists with correct ownership and perms early
 	if [ ! -d /tmp/.X11-unix ]; then
@@ -64,9 +72,44 @@ start_xvfb() {
 	xauth add "localhost$DISPLAY" . "$(openssl rand -hex 16)" 2>/dev/null || true
 	xauth add "$(hostname)$DISPLAY" . "$(openssl rand -hex 16)" 2>/dev/null || true
 
-	# Start Xvfb with additional options for stability
+	# Start Xvfb with additional options for stability. Xvfb writes the display
+	# number to -displayfd once it accepts connections.
 	log "Executing Xvfb with display $DISPLAY"
-	exec /usr/bin/Xvfb "$DISPLAY" -ac -screen 0 "$VNC_SCREEN_DIMENSION" -noreset -nolisten tcp
+	phase_end xvfb_setup
+	phase_begin xvfb_ready
+	ready_fifo="$(x_ready_fifo "$DISPLAY")"
+	ensure_x_ready_fifo "$ready_fifo"
+	displayfd_pipe="$(mktemp -u /tmp/xvfb-displayfd.XXXXXX)"
+	mkfifo -m 600 "$displayfd_pipe"
+	exec {displayfd}<>"$displayfd_pipe"
+	rm -f "$displayfd_pipe"
+	/usr/bin/Xvfb "$DISPLAY" -ac -screen 0 "$VNC_SCREEN_DIMENSION" -noreset -nolisten tcp \
+		-displayfd "$displayfd" &
+	xvfb_pid="$!"
+	trap 'kill "$xvfb_pid" 2>/dev/null || true; wait "$xvfb_pid" 2>/dev/null || true; exit 143' TERM INT
+
+	# read returns as soon as Xvfb writes; the timeout only bounds the wait
+	# so an Xvfb that dies before becoming ready is noticed.
+	while ! read -r -t 1 -u "$displayfd" _; do
+		if ! kill -0 "$xvfb_pid" 2>/dev/null; then
+			log "ERROR: Xvfb exited before display $DISPLAY was ready"
+			wait "$xvfb_pid" || exit "$?"
+			exit 1
+		fi
+		waited=$((waited + 1))
+		if [ "$waited" -ge 60 ]; then
+			log "ERROR: Xvfb did not report display $DISPLAY ready within 60 seconds"
+			kill "$xvfb_pid" 2>/dev/null || true
+			exit 1
+		fi
+	done
+	exec {displayfd}>&-
+	# Holding the readiness FIFO open releases every blocked wait_for_x_server.
+	# The descriptor closes with this script, so a dead Xvfb stops readiness.
+	exec {ready_fd}<>"$ready_fifo"
+	phase_end xvfb_ready
+	log "X server is ready on display $DISPLAY"
+	wait "$xvfb_pid"
 }
 
 start_xvfb
@@ -1,18 +1,34 @@
 import argparse
+import fcntl
+import gzip
 import hashlib
+import importlib.util
+import io
 import json
 import logging
 import os
 import re
+import resource
+import shutil
+import statistics
+import sys
+import tarfile
+import time
+import timeit
 from collections import defaultdict
+from collections.abc import Iterable, Iterator
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from functools import cache, cached_property, partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from subprocess import CompletedProcess, run
-from threading import Lock
-from typing import Any, Literal
+from subprocess import PIPE, STDOUT, CompletedProcess, Popen, run
+from tempfile import TemporaryDirectory
+from threading import Lock, Thread, Timer
+from types import ModuleType
+from typing import IO, Any, Literal
 from urllib.request import urlopen, urlretrieve
 
 from github import Github
@@ -24,10 +40,24 @@ logging.basicConfig(
 logger = logging.getLogger("CI")
 
 downloads_dir = Path(__file__).parent / "downloads"
+artifact_cache_dir = downloads_dir / "cache"
+buildkit_cache_dir = downloads_dir / "buildkit-cache"
+init_settings_script = (
+    Path(__file__).parent / "build" / "programs" / "init_container_settings.py"
+)
+vmoptions_template_path = Path(__file__).parent / "build" / "config" / "vmoptions.j2"
+ib_health_script = Path(__file__).parent / "build" / "programs" / "ib_health.py"
+dockerfile_path = Path(__file__).parent / "build" / "Dockerfile"
+ARTIFACTS_CONTEXT_NAME = "ib-artifacts"
+DEFAULT_IBC_VERSION = "3.23.0"
+ZULU_JRE_NAME = "zulu17.52.17-ca-jre17.0.12-linux_aarch64"
 ReleaseChannel = Literal["latest", "stable", "beta"]
 ScheduledReleaseChannel = Literal["latest", "stable"]
 BUILD_VERSION_RE = re.compile(r"^[0-9]+[.][0-9]+[.][0-9]+[a-z]?$")
 RELEASE_TAG_RE = re.compile(r"^(latest|stable|beta)-([0-9]+[.][0-9]+[.][0-9]+[a-z]?)$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+CLASS_LOAD_JAR_RE = re.compile(r"source: (?:jar:)?file:(\S+?[.]jar)\b")
+STARTUP_READY_PATTERN = "Login has completed"
 RELEASE_ASSET_NAME_RE = re.compile(
     r"^(ibgateway|tws)-(latest|stable|beta)-[0-9]+[.][0-9]+[.][0-9]+[a-z]?"
     r"-standalone-linux-x64[.]sh$"
@@ -235,12 +265,16 @@ def write_sha256_file(file: Path) -> Path:
     require_existing_file(file, "Release asset path")
     hash_file = file.with_suffix(file.suffix + ".sha256")
     require_download_file(hash_file, "Checksum sidecar path")
-    with file.open("rb") as asset_file:
-        digest = hashlib.file_digest(asset_file, "sha256").hexdigest()
-    hash_file.write_text(f"{digest} {file.name}\n")
+    hash_file.write_text(f"{file_sha256(file)} {file.name}\n")
     return hash_file
 
 
+def file_sha256(file: Path) -> str:
+    """Return the hex sha256 digest of a file without reading it into memory."""
+    with file.open("rb") as asset_file:
+        return hashlib.file_digest(asset_file, "sha256").hexdigest()
+
+
 def parse_sha256_sidecar(content: str, source: str) -> tuple[str, str]:
     """Parse a sha256 sidecar line into digest and referenced filename."""
     lines = [line.strip() for line in content.splitlines() if line.strip()]
@@ -716,13 +750,186 @@ def create_github_releases() -> list[IBRelease]:
     return created_releases
 
 
-def build_image(params: tuple[str, str, str]) -> None:
+def release_asset_url(program: str, release: str, version: str) -> str:
+    """Return the GitHub release URL the Dockerfile uses for a packaged installer."""
+    file_name = release_asset_file_name(program, release, version)
+    return (
+        "https://github.com/djkelleher/ib-docker/releases/download/"
+        f"{release}-{version}/{file_name}"
+    )
+
+
+def ibc_release_url(ibc_version: str) -> str:
+    """Return the IBC Linux release archive URL used by the Dockerfile."""
+    return (
+        "https://github.com/IbcAlpha/IBC/releases/download/"
+        f"{ibc_version}/IBCLinux-{ibc_version}.zip"
+    )
+
+
+def zulu_jre_url(zulu_name: str) -> str:
+    """Return the Azul Zulu JRE archive URL used for arm64 builds."""
+    return f"https://cdn.azul.com/zulu/bin/{zulu_name}.tar.gz"
+
+
+@contextmanager
+def artifact_cache_lock(cache_dir: Path, key: str) -> Iterator[None]:
+    """Serialize cache updates for one URL across threads and processes."""
+    lock_dir = cache_dir / "locks"
+    require_creatable_directory_path(lock_dir, "Artifact cache lock path")
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    with (lock_dir / f"{key}.lock").open("w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def verified_cache_blob(cache_dir: Path, ref_path: Path) -> Path | None:
+    """Return the blob a cache ref points at when its content matches its digest."""
+    if not ref_path.is_file():
+        return None
+    digest = ref_path.read_text().strip()
+    if not SHA256_RE.fullmatch(digest):
+        logger.info("Ignoring malformed artifact cache ref: %s", ref_path)
+        return None
+    blob_path = cache_dir / "blobs" / "sha256" / digest
+    if not blob_path.is_file():
+        return None
+    if file_sha256(blob_path) != digest:
+        logger.info("Removing corrupted artifact cache blob: %s", blob_path)
+        blob_path.unlink()
+        return None
+    return blob_path
+
+
+def cached_artifact(
+    url: str,
+    cache_dir: Path | None = None,
+    expected_sha256: str | None = None,
+    offline: bool = False,
+) -> Path:
+    """Return a digest-verified cache blob for a URL, downloading it on a miss."""
+    cache_dir = cache_dir or artifact_cache_dir
+    key = hashlib.sha256(url.encode()).hexdigest()
+    ref_path = cache_dir / "refs" / key
+    with artifact_cache_lock(cache_dir, key):
+        blob_path = verified_cache_blob(cache_dir, ref_path)
+        if blob_path is not None and expected_sha256 in (None, blob_path.name):
+            logger.info("Using cached artifact %s: %s", blob_path.name[:12], url)
+            return blob_path
+        if offline:
+            raise RuntimeError(f"Artifact is not cached for offline build: {url}")
+
+        temporary_path = cache_dir / "tmp" / key
+        download(url, temporary_path, overwrite=True)
+        digest = file_sha256(temporary_path)
+        if expected_sha256 is not None and digest != expected_sha256:
+            temporary_path.unlink()
+            raise RuntimeError(
+                f"Artifact digest mismatch for {url}: "
+                f"expected {expected_sha256}, got {digest}"
+            )
+        blob_path = cache_dir / "blobs" / "sha256" / digest
+        require_creatable_directory_path(blob_path.parent, "Artifact cache blob path")
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path.replace(blob_path)
+        ref_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_ref_path = ref_path.with_suffix(".tmp")
+        temporary_ref_path.write_text(f"{digest}\n")
+        temporary_ref_path.replace(ref_path)
+        return blob_path
+
+
+def link_cached_artifact(blob_path: Path, target_path: Path) -> None:
+    """Expose a cache blob under its build filename without copying when possible."""
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = target_path.with_name(f".{target_path.name}.tmp")
+    temporary_path.unlink(missing_ok=True)
+    try:
+        os.link(blob_path, temporary_path)
+    except OSError:
+        shutil.copyfile(blob_path, temporary_path)
+    temporary_path.replace(target_path)
+
+
+def prepare_build_artifacts(
+    program: str,
+    release: str,
+    version: str,
+    platforms: str,
+    ibc_version: str = DEFAULT_IBC_VERSION,
+    offline: bool = False,
+    cache_dir: Path | None = None,
+) -> Path:
+    """Prefetch build downloads and return the named build context directory."""
+    cache_dir = cache_dir or artifact_cache_dir
+    file_name = release_asset_file_name(program, release, version)
+    installer_url = release_asset_url(program, release, version)
+    sidecar_url = f"{installer_url}.sha256"
+    sidecar_path = cached_artifact(sidecar_url, cache_dir, offline=offline)
+    digest, referenced_file_name = parse_sha256_sidecar(
+        sidecar_path.read_text(), sidecar_url
+    )
+    if referenced_file_name != file_name:
+        raise RuntimeError(
+            f"Checksum sidecar does not reference expected file {file_name}: "
+            f"{referenced_file_name}"
+        )
+    installer_path = cached_artifact(
+        installer_url, cache_dir, expected_sha256=digest, offline=offline
+    )
+    ibc_path = cached_artifact(ibc_release_url(ibc_version), cache_dir, offline=offline)
+    artifacts = {
+        Path("ib") / file_name: installer_path,
+        Path("ib") / f"{file_name}.sha256": sidecar_path,
+        Path("ibc") / f"IBCLinux-{ibc_version}.zip": ibc_path,
+    }
+    if "linux/arm64" in platforms.split(","):
+        artifacts[Path("zulu") / f"{ZULU_JRE_NAME}.tar.gz"] = cached_artifact(
+            zulu_jre_url(ZULU_JRE_NAME), cache_dir, offline=offline
+        )
+
+    context_dir = cache_dir / "contexts" / f"{program}-{release}-{version}"
+    with artifact_cache_lock(cache_dir, context_dir.name):
+        for relative_path, blob_path in artifacts.items():
+            link_cached_artifact(blob_path, context_dir / relative_path)
+    return context_dir
+
+
+@dataclass
+class BuildTiming:
+    image: str
+    seconds: float
+    cache: Literal["cold", "warm"]
+
+
+def build_cache_args(program: str, release: str) -> tuple[list[str], bool]:
+    """Return buildx layer cache flags and whether a previous build left a cache."""
+    cache_dir = (buildkit_cache_dir / f"{program}-{release}").resolve()
+    require_creatable_directory_path(cache_dir, "BuildKit cache")
+    warm = (cache_dir / "index.json").is_file()
+    args = ["--cache-to", f"type=local,dest={cache_dir},mode=max"]
+    if warm:
+        args = ["--cache-from", f"type=local,src={cache_dir}", *args]
+    return args, warm
+
+
+def build_image(params: tuple[str, str, str]) -> BuildTiming:
     program, release, version = params
     tags = docker_tags(release, version)
     image_repository = docker_image_repository(program)
     platforms = docker_platforms(program)
     dockerhub_username = require_env("DOCKERHUB_USERNAME")
     image_name = f"{dockerhub_username}/{image_repository}"
+    artifacts_dir = prepare_build_artifacts(
+        program,
+        release,
+        version,
+        platforms,
+        offline=bool(os.getenv("IB_DOCKER_OFFLINE_BUILD")),
+    )
 
     cmd = [
         "docker",
@@ -738,16 +945,28 @@ def build_image(params: tuple[str, str, str]) -> None:
         f"IB_VERSION={version}",
         "--build-arg",
         "IB_INSTALLER_ARCH=x64",
+        "--build-context",
+        f"{ARTIFACTS_CONTEXT_NAME}={artifacts_dir.resolve()}",
     ]
+    # mode=max exports intermediate stages too, so unchanged apt and install
+    # layers are reused; apt cache mounts stay warm in the persistent builder.
+    cache_args, warm_cache = build_cache_args(program, release)
+    cmd.extend(cache_args)
     for tag in tags:
         cmd.extend(["-t", f"{image_name}:{tag}"])
     cmd.extend(["--push", "."])
 
     logger.info("Building image: %s", " ".join(cmd))
     build_dir = Path(__file__).parent.joinpath("build").resolve()
+    started = time.monotonic()
     res: CompletedProcess[str] = run(
         cmd, capture_output=True, check=False, text=True, cwd=str(build_dir)
     )
+    timing = BuildTiming(
+        image=f"{image_name}:{tags[0]}",
+        seconds=time.monotonic() - started,
+        cache="warm" if warm_cache else "cold",
+    )
     if info := res.stdout.strip():
         logger.info(info)
     if err := res.stderr.strip():
@@ -755,6 +974,10 @@ def build_image(params: tuple[str, str, str]) -> None:
     if res.returncode != 0:
         raise RuntimeError(f"Docker image build failed with exit code {res.returncode}")
     logger.info("Finished running image build: %s", " ".join(cmd))
+    logger.info(
+        "Built %s in %.1fs (%s cache)", timing.image, timing.seconds, timing.cache
+    )
+    return timing
 
 
 def build_images(
@@ -775,22 +998,706 @@ def build_images(
         n_workers = min(os.cpu_count() or 1, len(params))
         logger.info(f"Building images with {n_workers} workers.")
         with ThreadPoolExecutor(max_workers=n_workers) as executor:
-            list(executor.map(build_image, params))
+            timings = list(executor.map(build_image, params))
     else:
-        for param in params:
-            build_image(param)
+        timings = [build_image(param) for param in params]
     logger.info("Finished building images.")
+    for timing in timings:
+        logger.info(
+            "Build time: %s %.1fs (%s cache)",
+            timing.image,
+            timing.seconds,
+            timing.cache,
+        )
 
 
-def build_release_images(tag: str | None) -> None:
-    """Build images for a release tag, or the most recent GitHub releases."""
+def release_images_for_tag(tag: str | None) -> list[IBRelease | GitHubRelease]:
+    """Return the release for a tag, or the most recent GitHub releases."""
     if tag:
         logger.info(f"Building images for provided release: {tag}")
         releases: list[IBRelease | GitHubRelease] = [parse_release_tag(tag)]
     else:
         logger.info("No release provided. Finding latest GitHub releases.")
         releases = find_latest_github_releases()
-    build_images(releases)
+    return releases
+
+
+def build_release_images(tag: str | None) -> None:
+    """Build images for a release tag, or the most recent GitHub releases."""
+    build_images(release_images_for_tag(tag))
+
+
+def prefetch_release_artifacts(tag: str | None) -> None:
+    """Warm the local artifact cache for every image a release build needs."""
+    for release in release_images_for_tag(tag):
+        for program in ("ibgateway", "tws"):
+            context_dir = prepare_build_artifacts(
+                program,
+                release.release,
+                release.build_version,
+                docker_platforms(program),
+            )
+            logger.info("Prefetched %s build artifacts: %s", program, context_dir)
+
+
+@dataclass
+class LayerStats:
+    digest: str
+    instruction: str
+    compressed_bytes: int
+    uncompressed_bytes: int
+
+
+@dataclass
+class InstructionStats:
+    instruction: str
+    size_bytes: int
+
+
+@dataclass
+class ImageAnalysis:
+    layers: list[LayerStats]
+    instructions: list[InstructionStats]
+    largest_files: dict[str, list[tuple[str, int]]]
+
+    @property
+    def compressed_bytes(self) -> int:
+        return sum(layer.compressed_bytes for layer in self.layers)
+
+    @property
+    def uncompressed_bytes(self) -> int:
+        return sum(layer.uncompressed_bytes for layer in self.layers)
+
+
+class ImageArchive:
+    """Read blobs from an OCI layout or `docker save` tarball, as a dir or tar."""
+
+    def __init__(self, path: Path) -> None:
+        if path.is_dir():
+            self.tar = None
+        elif path.is_file():
+            self.tar = tarfile.open(path)
+        else:
+            raise RuntimeError(f"Image archive does not exist: {path}")
+        self.path = path
+
+    def __enter__(self) -> "ImageArchive":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self.tar is not None:
+            self.tar.close()
+
+    def exists(self, name: str) -> bool:
+        if self.tar is None:
+            return (self.path / name).is_file()
+        try:
+            self.tar.getmember(name)
+        except KeyError:
+            return False
+        return True
+
+    def open(self, name: str) -> IO[bytes]:
+        if self.tar is None:
+            return (self.path / name).open("rb")
+        blob_file = self.tar.extractfile(name)
+        if blob_file is None:
+            raise RuntimeError(f"Image archive entry is not a file: {name}")
+        return blob_file
+
+    def size(self, name: str) -> int:
+        if self.tar is None:
+            return (self.path / name).stat().st_size
+        return self.tar.getmember(name).size
+
+    def read_json(self, name: str) -> Any:
+        if not self.exists(name):
+            raise RuntimeError(f"Image archive is missing {name}: {self.path}")
+        with self.open(name) as json_file:
+            return json.load(json_file)
+
+
+class CountingReader(io.RawIOBase):
+    """Count bytes read through a decompressed layer stream."""
+
+    def __init__(self, stream: IO[bytes]) -> None:
+        self.stream = stream
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def oci_blob_name(digest: str) -> str:
+    """Return the OCI layout blob path for a content digest."""
+    algorithm, _, encoded = digest.partition(":")
+    if not algorithm or not encoded:
+        raise RuntimeError(f"Invalid OCI digest: {digest}")
+    return f"blobs/{algorithm}/{encoded}"
+
+
+def oci_manifest(archive: ImageArchive, platform: str | None) -> dict[str, Any]:
+    """Resolve an OCI index to the image manifest for one platform."""
+    document = archive.read_json("index.json")
+    while "manifests" in document:
+        candidates = [
+            manifest
+            for manifest in document["manifests"]
+            if manifest.get("platform", {}).get("architecture") != "unknown"
+        ]
+        if platform is not None:
+            os_name, _, architecture = platform.partition("/")
+            candidates = [
+                manifest
+                for manifest in candidates
+                if manifest.get("platform", {}).get("os", os_name) == os_name
+                and manifest.get("platform", {}).get("architecture", architecture)
+                == architecture
+            ]
+        if len(candidates) != 1:
+            raise RuntimeError(
+                f"Expected one image manifest for platform {platform or 'any'}, "
+                f"found {len(candidates)}; pass --platform"
+            )
+        document = archive.read_json(oci_blob_name(candidates[0]["digest"]))
+    return document
+
+
+def image_layers(
+    archive: ImageArchive, platform: str | None
+) -> tuple[dict[str, Any], list[str]]:
+    """Return the image config and ordered layer blob names."""
+    if archive.exists("manifest.json"):
+        manifests = archive.read_json("manifest.json")
+        if len(manifests) != 1:
+            raise RuntimeError("docker save archives must contain exactly one image")
+        return archive.read_json(manifests[0]["Config"]), manifests[0]["Layers"]
+    manifest = oci_manifest(archive, platform)
+    config = archive.read_json(oci_blob_name(manifest["config"]["digest"]))
+    return config, [oci_blob_name(layer["digest"]) for layer in manifest["layers"]]
+
+
+@contextmanager
+def open_layer_stream(archive: ImageArchive, name: str) -> Iterator[IO[bytes]]:
+    """Open a layer blob as an uncompressed tar stream."""
+    with archive.open(name) as blob_file:
+        magic = blob_file.read(4)
+        blob_file.seek(0)
+        if magic == b"\x28\xb5\x2f\xfd":
+            raise RuntimeError(f"zstd-compressed layers are not supported: {name}")
+        if magic[:2] == b"\x1f\x8b":
+            with gzip.GzipFile(fileobj=blob_file) as gzip_file:
+                yield gzip_file
+        else:
+            yield blob_file
+
+
+def apply_layer_files(
+    files: dict[str, tuple[int, int]], layer_stream: IO[bytes], layer_index: int
+) -> int:
+    """Apply one layer's files and whiteouts; return its uncompressed size."""
+    reader = CountingReader(layer_stream)
+    with tarfile.open(fileobj=io.BufferedReader(reader), mode="r|") as layer_tar:
+        for member in layer_tar:
+            path = "/" + member.name.removeprefix("./").lstrip("/")
+            directory, _, base_name = path.rpartition("/")
+            if base_name == ".wh..wh..opq":
+                for file_path, (_, file_layer) in list(files.items()):
+                    if (
+                        file_path.startswith(f"{directory}/")
+                        and file_layer < layer_index
+                    ):
+                        del files[file_path]
+            elif base_name.startswith(".wh."):
+                removed_path = f"{directory}/{base_name.removeprefix('.wh.')}"
+                for file_path in list(files):
+                    if file_path == removed_path or file_path.startswith(
+                        f"{removed_path}/"
+                    ):
+                        del files[file_path]
+            elif member.isfile():
+                files[path] = (member.size, layer_index)
+            else:
+                files.pop(path, None)
+    while reader.read(1024 * 1024):
+        pass
+    return reader.bytes_read
+
+
+def history_instruction(entry: dict[str, Any]) -> str:
+    """Return a compact Dockerfile instruction from an image history entry."""
+    instruction = " ".join(entry.get("created_by", "").split())
+    if instruction.startswith("/bin/sh -c #(nop) "):
+        instruction = instruction.removeprefix("/bin/sh -c #(nop) ").strip()
+    elif instruction.startswith("/bin/sh -c "):
+        instruction = f"RUN {instruction.removeprefix('/bin/sh -c ')}"
+    instruction = instruction.replace("RUN /bin/sh -c ", "RUN ", 1)
+    if len(instruction) > 100:
+        instruction = f"{instruction[:97]}..."
+    return instruction or "<unknown>"
+
+
+def image_program(config: dict[str, Any]) -> str | None:
+    """Return the PROGRAM env value baked into an image config."""
+    for env in config.get("config", {}).get("Env") or []:
+        name, _, value = env.partition("=")
+        if name == "PROGRAM":
+            return value
+    return None
+
+
+def analysis_prefixes(program: str | None) -> list[str]:
+    """Return the install paths whose largest files are reported."""
+    programs = [program] if program else ["ibgateway", "tws"]
+    return [
+        *(f"/opt/{name}" for name in programs),
+        "/opt/i4j_jres",
+        "/usr/local/zulu17",
+    ]
+
+
+def analyze_image(
+    image_path: Path, platform: str | None = None, top_files: int = 15
+) -> ImageAnalysis:
+    """Return per-layer, per-instruction and largest-file stats for an image."""
+    files: dict[str, tuple[int, int]] = {}
+    layers = []
+    with ImageArchive(image_path) as archive:
+        config, layer_names = image_layers(archive, platform)
+        history = [
+            entry for entry in config.get("history", []) if not entry.get("empty_layer")
+        ]
+        for layer_index, name in enumerate(layer_names):
+            with open_layer_stream(archive, name) as layer_stream:
+                uncompressed_bytes = apply_layer_files(files, layer_stream, layer_index)
+            instruction = (
+                history_instruction(history[layer_index])
+                if layer_index < len(history)
+                else "<unknown>"
+            )
+            layers.append(
+                LayerStats(
+                    digest=(
+                        Path(name).parent.name
+                        if name.endswith("/layer.tar")
+                        else Path(name).name
+                    ),
+                    instruction=instruction,
+                    compressed_bytes=archive.size(name),
+                    uncompressed_bytes=uncompressed_bytes,
+                )
+            )
+
+    instruction_sizes: dict[str, int] = defaultdict(int)
+    for layer in layers:
+        instruction_sizes[layer.instruction] += layer.uncompressed_bytes
+    instructions = [
+        InstructionStats(instruction=instruction, size_bytes=size_bytes)
+        for instruction, size_bytes in sorted(
+            instruction_sizes.items(), key=lambda item: item[1], reverse=True
+        )
+    ]
+    largest_files = {}
+    for prefix in analysis_prefixes(image_program(config)):
+        prefix_files = [
+            (path, size)
+            for path, (size, _) in files.items()
+            if path.startswith(f"{prefix}/")
+        ]
+        prefix_files.sort(key=lambda item: item[1], reverse=True)
+        largest_files[prefix] = prefix_files[:top_files]
+    return ImageAnalysis(
+        layers=layers, instructions=instructions, largest_files=largest_files
+    )
+
+
+def format_bytes(size: int) -> str:
+    """Return a human-readable byte count."""
+    value = float(size)
+    for unit in ("B", "KiB", "MiB"):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}" if unit != "B" else f"{size}B"
+        value /= 1024
+    return f"{value:.1f}GiB"
+
+
+def log_image_analysis(analysis: ImageAnalysis) -> None:
+    """Log an image size report."""
+    logger.info(
+        "Image size: %s compressed, %s uncompressed, %d layers",
+        format_bytes(analysis.compressed_bytes),
+        format_bytes(analysis.uncompressed_bytes),
+        len(analysis.layers),
+    )
+    for layer in analysis.layers:
+        logger.info(
+            "Layer %10s %10s  %s",
+            format_bytes(layer.compressed_bytes),
+            format_bytes(layer.uncompressed_bytes),
+            layer.instruction,
+        )
+    for instruction in analysis.instructions:
+        logger.info(
+            "Instruction %10s  %s",
+            format_bytes(instruction.size_bytes),
+            instruction.instruction,
+        )
+    for prefix, prefix_files in analysis.largest_files.items():
+        for path, size in prefix_files:
+            logger.info("Largest under %s: %10s  %s", prefix, format_bytes(size), path)
+
+
+def image_size_baseline(analysis: ImageAnalysis) -> dict[str, int]:
+    """Return the size summary stored as a regression baseline."""
+    return {
+        "compressed_bytes": analysis.compressed_bytes,
+        "uncompressed_bytes": analysis.uncompressed_bytes,
+    }
+
+
+def check_image_size_regression(
+    analysis: ImageAnalysis, baseline: dict[str, Any], max_growth_percent: float
+) -> None:
+    """Fail when the uncompressed image size grew past the allowed threshold."""
+    try:
+        baseline_bytes = int(baseline["uncompressed_bytes"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise RuntimeError(
+            "Image size baseline must define uncompressed_bytes"
+        ) from exc
+    limit = baseline_bytes * (1 + max_growth_percent / 100)
+    growth = analysis.uncompressed_bytes - baseline_bytes
+    logger.info(
+        "Image size vs baseline: %s (%+.2f%%, limit %.2f%%)",
+        format_bytes(growth),
+        100 * growth / baseline_bytes if baseline_bytes else 0.0,
+        max_growth_percent,
+    )
+    if analysis.uncompressed_bytes > limit:
+        raise RuntimeError(
+            "Image size regression: "
+            f"{analysis.uncompressed_bytes} bytes exceeds baseline "
+            f"{baseline_bytes} bytes by more than {max_growth_percent}%"
+        )
+
+
+def run_image_analysis(
+    image_path: Path,
+    platform: str | None,
+    baseline_path: Path | None,
+    max_growth_percent: float,
+    update_baseline: bool,
+) -> ImageAnalysis:
+    """Analyze an image, then compare or update its size baseline."""
+    analysis = analyze_image(image_path, platform)
+    log_image_analysis(analysis)
+    if baseline_path is None:
+        return analysis
+    if update_baseline:
+        require_download_file(baseline_path, "Image size baseline path")
+        baseline_path.write_text(
+            json.dumps(image_size_baseline(analysis), indent=2) + "\n"
+        )
+        logger.info("Updated image size baseline: %s", baseline_path)
+        return analysis
+    require_existing_file(baseline_path, "Image size baseline path")
+    check_image_size_regression(
+        analysis, json.loads(baseline_path.read_text()), max_growth_percent
+    )
+    return analysis
+
+
+def loaded_jar_names(trace_content: str) -> set[str]:
+    """Return jar filenames that classes were loaded from in a class+load trace."""
+    return {
+        Path(match.group(1)).name for match in CLASS_LOAD_JAR_RE.finditer(trace_content)
+    }
+
+
+def unused_ib_jars(trace_content: str, jar_names: list[str]) -> list[str]:
+    """Return installed IB jars that a class-loading trace never loaded from."""
+    loaded_jars = loaded_jar_names(trace_content)
+    installed_jars = {name for name in jar_names if name.endswith(".jar")}
+    if not loaded_jars & installed_jars:
+        raise RuntimeError(
+            "Class-loading trace did not load any installed IB jar; record it with "
+            "-Xlog:class+load=info while IB is running"
+        )
+    return sorted(installed_jars - loaded_jars)
+
+
+def write_unused_jars_list(
+    trace_path: Path, jars_path: Path, output_path: Path | None
+) -> list[str]:
+    """Write the unused-jar list consumed by the Dockerfile pruned stage."""
+    require_existing_file(trace_path, "Class-loading trace path")
+    if jars_path.is_dir():
+        jar_names = [path.name for path in jars_path.iterdir()]
+    else:
+        require_existing_file(jars_path, "Jar listing path")
+        jar_names = [Path(line.strip()).name for line in jars_path.read_text().split()]
+    unused_jars = unused_ib_jars(trace_path.read_text(), jar_names)
+    content = "".join(
+        [
+            f"# Generated by `ci.py unused-jars` from {trace_path.name}.\n",
+            "# Jars listed here are deleted when building with PRUNE_RUNTIME=yes.\n",
+            *(f"{name}\n" for name in unused_jars),
+        ]
+    )
+    if output_path is None:
+        print(content, end="")
+    else:
+        require_creatable_directory_path(output_path.parent, "Unused jar list parent")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(content)
+        logger.info("Wrote %d unused jars to %s", len(unused_jars), output_path)
+    return unused_jars
+
+
+def wait_for_log_pattern(lines: Iterable[str], pattern: re.Pattern[str]) -> str | None:
+    """Return the first log line matching pattern, or None when the log ends."""
+    for line in lines:
+        if pattern.search(line):
+            return line.rstrip("\n")
+    return None
+
+
+def container_startup_seconds(
+    image: str,
+    env_file: Path,
+    use_cds: str,
+    ready_pattern: re.Pattern[str],
+    timeout: float,
+) -> float:
+    """Start a container and time how long it takes to log the ready pattern."""
+    cmd = [
+        "docker",
+        "run",
+        "-d",
+        "--env-file",
+        str(env_file),
+        "-e",
+        f"USE_CDS_ARCHIVE={use_cds}",
+        image,
+    ]
+    started = time.monotonic()
+    res: CompletedProcess[str] = run(cmd, capture_output=True, check=False, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"docker run failed: {res.stderr.strip()}")
+    container_id = res.stdout.strip()
+    try:
+        with Popen(
+            ["docker", "logs", "-f", container_id],
+            stdout=PIPE,
+            stderr=STDOUT,
+            text=True,
+        ) as logs:
+            timer = Timer(timeout, logs.kill)
+            timer.start()
+            try:
+                if logs.stdout is None:
+                    raise RuntimeError(f"docker logs has no output for {container_id}")
+                ready_line = wait_for_log_pattern(logs.stdout, ready_pattern)
+            finally:
+                timer.cancel()
+                logs.kill()
+        elapsed = time.monotonic() - started
+    finally:
+        run(["docker", "rm", "-f", container_id], capture_output=True, check=False)
+    if ready_line is None:
+        raise RuntimeError(
+            f"Container did not log /{ready_pattern.pattern}/ within {timeout}s "
+            f"(USE_CDS_ARCHIVE={use_cds})"
+        )
+    return elapsed
+
+
+def summarize_startup_samples(
+    samples: dict[str, list[float]],
+) -> dict[str, dict[str, float]]:
+    """Return min, median and max startup seconds per USE_CDS_ARCHIVE mode."""
+    return {
+        mode: {
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "max": max(seconds),
+        }
+        for mode, seconds in samples.items()
+        if seconds
+    }
+
+
+def run_startup_benchmark(
+    image: str,
+    env_file: Path,
+    runs: int,
+    ready_pattern: str,
+    timeout: float,
+) -> dict[str, dict[str, float]]:
+    """Compare container startup time with and without the AppCDS archive."""
+    if runs < 1:
+        raise ValueError(f"Benchmark runs must be at least 1: {runs}")
+    require_existing_file(env_file, "Benchmark env file")
+    pattern = re.compile(ready_pattern)
+    samples: dict[str, list[float]] = {"yes": [], "no": []}
+    for run_number in range(1, runs + 1):
+        # Alternate modes so host drift affects both equally.
+        for use_cds in samples:
+            seconds = container_startup_seconds(
+                image, env_file, use_cds, pattern, timeout
+            )
+            logger.info(
+                "Run %d/%d USE_CDS_ARCHIVE=%s: %.1fs",
+                run_number,
+                runs,
+                use_cds,
+                seconds,
+            )
+            samples[use_cds].append(seconds)
+    summary = summarize_startup_samples(samples)
+    for use_cds, stats in summary.items():
+        logger.info(
+            "USE_CDS_ARCHIVE=%s: median %.1fs (min %.1fs, max %.1fs)",
+            use_cds,
+            stats["median"],
+            stats["min"],
+            stats["max"],
+        )
+    saved = summary["no"]["median"] - summary["yes"]["median"]
+    logger.info("AppCDS saves %.1fs of median startup time", saved)
+    return summary
+
+
+def child_cpu_ms_per_run(
+    command: list[str], iterations: int, env: dict[str, str]
+) -> float:
+    """Return the user+system CPU milliseconds one run of command costs."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for _ in range(iterations):
+        run(command, check=True, capture_output=True, env=env)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = (after.ru_utime + after.ru_stime) - (
+        before.ru_utime + before.ru_stime
+    )
+    return cpu_seconds * 1000 / iterations
+
+
+def dockerfile_healthcheck_command(ready_path: Path) -> list[str]:
+    """Return the Dockerfile HEALTHCHECK command, reading ready_path instead."""
+    match = re.search(
+        r"^HEALTHCHECK .* CMD (\[.*\])$", dockerfile_path.read_text(), re.M
+    )
+    if match is None:
+        raise ValueError(f"No exec-form HEALTHCHECK in {dockerfile_path}")
+    return [
+        arg.replace("/tmp/ib-health/ready", str(ready_path))
+        for arg in json.loads(match.group(1))
+    ]
+
+
+def run_healthcheck_benchmark(iterations: int) -> dict[str, float]:
+    """Compare the CPU cost of one HEALTHCHECK probe before and after the status file."""
+    if iterations < 1:
+        raise ValueError(f"Benchmark iterations must be at least 1: {iterations}")
+
+    class ReadyHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = b'{"ready": true}\n'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            return
+
+    server = HTTPServer(("127.0.0.1", 0), ReadyHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with TemporaryDirectory() as status_dir:
+            ready_path = Path(status_dir) / "ready"
+            ready_path.write_text(f'{int(time.time()) + 60} {{"ready": true}}\n')
+            env = {**os.environ, "HEALTH_PORT": str(server.server_address[1])}
+            # The interpreter start dominates the old probe, as it did for the
+            # supervisorctl | awk && xset chain it replaced.
+            summary = {
+                "python_probe": child_cpu_ms_per_run(
+                    [sys.executable, str(ib_health_script), "--probe", "ready"],
+                    iterations,
+                    env,
+                ),
+                "status_file": child_cpu_ms_per_run(
+                    dockerfile_healthcheck_command(ready_path), iterations, env
+                ),
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+    for probe, cpu_ms in summary.items():
+        logger.info("Healthcheck %s: %.2fms CPU per probe", probe, cpu_ms)
+    return summary
+
+
+def load_init_settings_script() -> ModuleType:
+    """Import the runtime init_container_settings script for local tooling."""
+    spec = importlib.util.spec_from_file_location(
+        "init_container_settings", init_settings_script
+    )
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load {init_settings_script}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_template_benchmark(iterations: int) -> dict[str, float]:
+    """Time compiling and rendering the shipped vmoptions template, in microseconds."""
+    if iterations < 1:
+        raise ValueError(f"Benchmark iterations must be at least 1: {iterations}")
+    init_settings = load_init_settings_script()
+    source = vmoptions_template_path.read_text()
+    names = init_settings.VMOPTIONS_TEMPLATE_NAMES
+    template = init_settings.compile_template(source, names)
+    context = {
+        "max_heap": "2048",
+        "initial_heap": 512,
+        "tws_settings_path": Path("/home/ibuser/tws_settings"),
+        "gc_opts": ["-XX:+UseG1GC", "-XX:ParallelGCThreads=2"],
+        "cpu_opts": ["-XX:ActiveProcessorCount=2"],
+        "telemetry_opts": [],
+        "cds_opts": ["-XX:SharedArchiveFile=/opt/ibgateway/stable/cds/ibgateway.jsa"],
+        "custom_opts": ["-XX:+AlwaysPreTouch"],
+    }
+    timings = {
+        "compile": timeit.timeit(
+            partial(init_settings.compile_template, source, names), number=iterations
+        ),
+        "render": timeit.timeit(partial(template.render, context), number=iterations),
+        "render_vmoptions": timeit.timeit(
+            partial(
+                init_settings.render_vmoptions,
+                source,
+                "2048",
+                512,
+                Path("/home/ibuser/tws_settings"),
+                context["custom_opts"],
+                context["cds_opts"],
+                context["cpu_opts"],
+                context["gc_opts"],
+            ),
+            number=iterations,
+        ),
+    }
+    summary = {step: seconds * 1e6 / iterations for step, seconds in timings.items()}
+    for step, micros in summary.items():
+        logger.info("vmoptions %s: %.1fus per call", step, micros)
+    return summary
 
 
 def main() -> None:
@@ -805,12 +1712,130 @@ def main() -> None:
     parser_build.add_argument(
         "tag", nargs="?", help="Tag in format <release>-<build_version>"
     )
+    # Prefetch subcommand
+    parser_prefetch = subparsers.add_parser(
+        "prefetch", help="Download release build artifacts into the local cache."
+    )
+    parser_prefetch.add_argument(
+        "tag", nargs="?", help="Tag in format <release>-<build_version>"
+    )
+
+    # Analyze subcommand
+    parser_analyze = subparsers.add_parser(
+        "analyze",
+        help="Report image size by layer, instruction and largest install files.",
+    )
+    parser_analyze.add_argument(
+        "image", type=Path, help="OCI layout or `docker save` tarball (dir or .tar)"
+    )
+    parser_analyze.add_argument(
+        "--platform", help="Platform to analyze in multi-platform OCI layouts"
+    )
+    parser_analyze.add_argument(
+        "--baseline", type=Path, help="JSON size baseline to compare against"
+    )
+    parser_analyze.add_argument(
+        "--max-growth-percent",
+        type=float,
+        default=5.0,
+        help="Allowed uncompressed size growth over the baseline",
+    )
+    parser_analyze.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the current size to --baseline instead of comparing",
+    )
+
+    # Unused jars subcommand
+    parser_unused_jars = subparsers.add_parser(
+        "unused-jars",
+        help="List IB jars never loaded in a -Xlog:class+load trace.",
+    )
+    parser_unused_jars.add_argument(
+        "trace", type=Path, help="Log written with -Xlog:class+load=info:file=..."
+    )
+    parser_unused_jars.add_argument(
+        "jars", type=Path, help="IB jars directory or a file listing its jar names"
+    )
+    parser_unused_jars.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Write to a file such as build/config/prune/ibgateway-unused-jars.txt",
+    )
+
+    # Startup benchmark subcommand
+    parser_bench = subparsers.add_parser(
+        "bench-startup",
+        help="Compare container startup time with and without the AppCDS archive.",
+    )
+    parser_bench.add_argument("image", help="Image to benchmark")
+    parser_bench.add_argument(
+        "--env-file",
+        type=Path,
+        required=True,
+        help="docker --env-file with paper account credentials",
+    )
+    parser_bench.add_argument(
+        "--runs", type=int, default=3, help="Container starts per mode"
+    )
+    parser_bench.add_argument(
+        "--ready-pattern",
+        default=STARTUP_READY_PATTERN,
+        help="Regex marking the container as started in its logs",
+    )
+    parser_bench.add_argument(
+        "--timeout",
+        type=float,
+        default=300.0,
+        help="Seconds to wait for the ready pattern per start",
+    )
+
+    # Healthcheck benchmark subcommand
+    parser_bench_health = subparsers.add_parser(
+        "bench-healthcheck",
+        help="Compare the CPU cost of a Python healthcheck probe and the status file.",
+    )
+    parser_bench_health.add_argument(
+        "--iterations", type=int, default=50, help="Probes run per variant"
+    )
+
+    # Template benchmark subcommand
+    parser_bench_templates = subparsers.add_parser(
+        "bench-templates",
+        help="Time compiling and rendering the vmoptions template.",
+    )
+    parser_bench_templates.add_argument(
+        "--iterations", type=int, default=2000, help="Calls timed per step"
+    )
 
     args = parser.parse_args()
     if args.command == "release":
         create_github_releases()
     elif args.command == "build":
         build_release_images(args.tag)
+    elif args.command == "prefetch":
+        prefetch_release_artifacts(args.tag)
+    elif args.command == "analyze":
+        if args.update_baseline and args.baseline is None:
+            parser.error("--update-baseline requires --baseline")
+        run_image_analysis(
+            args.image,
+            args.platform,
+            args.baseline,
+            args.max_growth_percent,
+            args.update_baseline,
+        )
+    elif args.command == "unused-jars":
+        write_unused_jars_list(args.trace, args.jars, args.output)
+    elif args.command == "bench-startup":
+        run_startup_benchmark(
+            args.image, args.env_file, args.runs, args.ready_pattern, args.timeout
+        )
+    elif args.command == "bench-templates":
+        run_template_benchmark(args.iterations)
+    elif args.command == "bench-healthcheck":
+        run_healthcheck_benchmark(args.iterations)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,29 @@
 import ast
+import gzip
 import hashlib
 import importlib.util
+import io
+import json
 import os
+import random
 import re
+import shlex
+import signal
+import socket
+import socketserver
+import struct
 import subprocess
 import sys
+import tarfile
 import threading
+import time
 import types
+import urllib.error
+import urllib.request
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from types import ModuleType
+from xmlrpc.server import SimpleXMLRPCDispatcher, SimpleXMLRPCRequestHandler
 
 import pytest
 
@@ -21,6 +35,12 @@ ENTRYPOINT_PATH = REPO_ROOT / "build" / "programs" / "entrypoint.sh"
 START_VNC_PATH = REPO_ROOT / "build" / "programs" / "start_vnc.sh"
 START_XVFB_PATH = REPO_ROOT / "build" / "programs" / "start_xvfb.sh"
 START_IBC_PATH = REPO_ROOT / "build" / "programs" / "start_ibc.sh"
+BUILD_CDS_ARCHIVE_PATH = REPO_ROOT / "build" / "programs" / "build_cds_archive.sh"
+JVM_TELEMETRY_PATH = REPO_ROOT / "build" / "programs" / "jvm_telemetry.py"
+IB_HEALTH_PATH = REPO_ROOT / "build" / "programs" / "ib_health.py"
+IBC_EVENTS_PATH = REPO_ROOT / "build" / "programs" / "ibc_events.py"
+RESTART_POLICY_PATH = REPO_ROOT / "build" / "programs" / "restart_policy.py"
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
 DOCKERFILE_PATH = REPO_ROOT / "build" / "Dockerfile"
 BUILD_DOCKERIGNORE_PATH = REPO_ROOT / "build" / ".dockerignore"
 VMOPTIONS_TEMPLATE_PATH = REPO_ROOT / "build" / "config" / "vmoptions.j2"
@@ -35,8 +55,22 @@ ENV_VAR_PATTERN = re.compile(r"\$\{([A-Z0-9_]+)(?::-[^}]*)?\}")
 EXTRA_RUNTIME_ENV_NAMES = {
     "CUSTOM_JVM_OPTS",
     "IBC_SCRIPTS",
+    "JAVA_GC_PROFILE",
+    "JAVA_HEAP_POLICY",
     "JAVA_HEAP_SIZE",
+    "JAVA_WORKLOAD_PROFILE",
+    "JVM_TELEMETRY",
+    "JVM_TELEMETRY_PORT",
+    "METRICS",
+    "HEALTH_PORT",
+    "HOOK_TIMEOUT_SECONDS",
+    "IBC_WARM_RESTART",
+    "RESTART_BACKOFF_BASE_SECONDS",
+    "RESTART_BACKOFF_MAX_SECONDS",
+    "RESTART_WINDOW_MAX",
+    "RESTART_WINDOW_SECONDS",
     "START_SCRIPTS",
+    "USE_CDS_ARCHIVE",
     "X_SCRIPTS",
 }
 
@@ -53,6 +87,46 @@ def load_init_settings() -> ModuleType:
     return module
 
 
+def load_ib_health() -> ModuleType:
+    """Load ib_health.py from its runtime script location."""
+    spec = importlib.util.spec_from_file_location("ib_health", IB_HEALTH_PATH)
+    assert spec is not None
+    assert spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_ibc_events() -> ModuleType:
+    """Load ibc_events.py from its runtime script location."""
+    spec = importlib.util.spec_from_file_location("ibc_events", IBC_EVENTS_PATH)
+    assert spec is not None
+    assert spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_restart_policy() -> ModuleType:
+    """Load restart_policy.py from its runtime script location."""
+    spec = importlib.util.spec_from_file_location("restart_policy", RESTART_POLICY_PATH)
+    assert spec is not None
+    assert spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_jvm_telemetry() -> ModuleType:
+    """Load jvm_telemetry.py from its runtime script location."""
+    spec = importlib.util.spec_from_file_location("jvm_telemetry", JVM_TELEMETRY_PATH)
+    assert spec is not None
+    assert spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
 def load_ci_module(monkeypatch: pytest.MonkeyPatch) -> ModuleType:
     """Load ci.py with a lightweight PyGithub stub for local unit tests."""
     github_module = types.ModuleType("github")
@@ -177,6 +251,9 @@ def fixture_runtime_defaults(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) ->
     create_ibc_dir(default_ibc_path)
     monkeypatch.setenv("IBC_PATH", str(default_ibc_path))
     monkeypatch.setenv("IBC_VERSION", "3.23.0")
+    monkeypatch.setenv(
+        "STARTUP_PHASES_FILE", str(tmp_path / "startup" / "phases.jsonl")
+    )
 
 
 def test_env_substitution_uses_defaults_for_empty_values(
@@ -292,14 +369,16 @@ def test_python_tws_settings_path_rejects_existing_file(
         init_settings.tws_settings_path()
 
 
-def test_python_initializer_cli_reports_errors_without_traceback() -> None:
+def test_python_initializer_cli_reports_errors_without_traceback(
+    tmp_path: Path,
+) -> None:
     """The runtime config command should print actionable errors without tracebacks."""
     result = subprocess.run(
         [sys.executable, str(INIT_SETTINGS_PATH)],
         check=False,
         capture_output=True,
         text=True,
-        env={},
+        env={"STARTUP_PHASES_FILE": str(tmp_path / "phases.jsonl")},
     )
 
     assert result.returncode == 1
@@ -618,6 +697,101 @@ def test_wait_for_x_server_rejects_invalid_display_before_timeout() -> None:
     assert "failed to start within 60 seconds" not in result.stdout
 
 
+def test_wait_for_x_server_blocks_on_readiness_fifo(tmp_path: Path) -> None:
+    """X clients should start as soon as start_xvfb holds the readiness FIFO open."""
+    ready_dir = tmp_path / "x-ready"
+    script = f"""
+        source "{IB_UTILS_PATH}"
+        HOME={shlex.quote(str(tmp_path))}
+        DISPLAY=:57
+        X_READY_DIR={shlex.quote(str(ready_dir))}
+        """
+    not_ready = run_bash_unchecked(script + "wait_for_x_server 1\n")
+    started = time.monotonic()
+    ready = run_bash(
+        script
+        + """
+        ready_fifo="$(x_ready_fifo "$DISPLAY")"
+        (sleep 0.2; exec 3<>"$ready_fifo"; sleep 5) &
+        holder="$!"
+        wait_for_x_server 10
+        kill "$holder"
+        """
+    )
+    elapsed = time.monotonic() - started
+
+    assert not_ready.returncode == 1
+    assert "X server failed to start within 1 seconds on :57" in not_ready.stdout
+    assert (ready_dir / "X57").is_fifo()
+    assert "X server is ready on :57" in ready.stdout
+    assert elapsed < 3
+
+
+def test_build_cds_archive_display_releases_wait_for_x_server(tmp_path: Path) -> None:
+    """The AppCDS training display must signal the FIFO that start_ibc waits on."""
+    bin_dir = tmp_path / "bin"
+    home = tmp_path / "home"
+    bin_dir.mkdir()
+    home.mkdir()
+    fake_xvfb = bin_dir / "Xvfb"
+    fake_xvfb.write_text(
+        "#!/bin/bash\n"
+        'while [ "$#" -gt 0 ]; do\n'
+        '\tif [ "$1" = "-displayfd" ]; then fd="$2"; fi\n'
+        "\tshift\n"
+        "done\n"
+        "sleep 0.2\n"
+        'echo 98 >&"$fd"\n'
+        "exec sleep 30\n"
+    )
+    fake_xvfb.chmod(0o755)
+    start_xvfb = bin_dir / "start_xvfb"
+    start_xvfb.write_text(
+        START_XVFB_PATH.read_text()
+        .replace("source /usr/local/lib/ib_utils", f'source "{IB_UTILS_PATH}"')
+        .replace("/usr/bin/Xvfb", str(fake_xvfb))
+    )
+    start_xvfb.chmod(0o755)
+    training_script = BUILD_CDS_ARCHIVE_PATH.read_text()
+    training_functions = training_script[: training_script.rindex("build_cds_archive")]
+
+    # Run from a file: start_xvfb's pkill of stale Xvfb for :98 would match a
+    # bash -c command line that mentions both.
+    script_path = tmp_path / "training_display.sh"
+    script_path.write_text(
+        training_functions.replace(
+            "source /usr/local/lib/ib_utils", f'source "{IB_UTILS_PATH}"'
+        )
+        + f"""
+PATH={shlex.quote(str(bin_dir))}:$PATH
+HOME={shlex.quote(str(home))}
+DISPLAY=:98
+X_READY_DIR={shlex.quote(str(tmp_path / "x-ready"))}
+STARTUP_PHASES_FILE={shlex.quote(str(tmp_path / "phases.jsonl"))}
+export HOME DISPLAY X_READY_DIR STARTUP_PHASES_FILE
+start_training_display
+wait_for_x_server 10
+kill "$xvfb_pid"
+wait "$xvfb_pid" || true
+"""
+    )
+
+    started = time.monotonic()
+    result = subprocess.run(
+        ["bash", str(script_path)],
+        check=True,
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    elapsed = time.monotonic() - started
+
+    assert "X server is ready on :98" in result.stdout
+    assert elapsed < 8
+    assert "/usr/bin/Xvfb" not in training_script
+    assert training_script.index("start_training_display\n\tstart_ibc &") > 0
+
+
 def test_release_dir_default_requires_release_without_nounset() -> None:
     """Default release dir construction should fail clearly if IB_RELEASE is unset."""
     result = run_bash_unchecked(
@@ -2141,14 +2315,21 @@ def test_java_heap_size_rejects_invalid_values(init_settings: ModuleType) -> Non
         init_settings.parse_memory_mb("2gb")
 
 
-def test_auto_java_heap_size_has_safe_minimum(
-    init_settings: ModuleType, monkeypatch: pytest.MonkeyPatch
-) -> None:
+def test_auto_java_heap_size_has_safe_minimum(init_settings: ModuleType) -> None:
     """Tiny cgroup limits should not render zero or near-zero max heap values."""
-    monkeypatch.delenv("JAVA_HEAP_SIZE", raising=False)
-    monkeypatch.setattr(init_settings, "detect_memory_mb", lambda: 128)
+    for policy in init_settings.HEAP_POLICIES.values():
+        decision = policy(
+            init_settings.HeapInputs(
+                program="ibgateway",
+                memory_limit_mb=128,
+                memory_high_mb=None,
+                swap_limit_mb=None,
+                cpu_count=2,
+            )
+        )
 
-    assert init_settings.calculate_java_heap_size() == "256"
+        assert decision.max_heap_mb == 256
+        assert decision.initial_heap_mb <= decision.max_heap_mb
 
 
 def test_initial_heap_never_exceeds_max_heap(init_settings: ModuleType) -> None:
@@ -2174,28 +2355,38 @@ def test_supervisor_config_uses_condition_checks_instead_of_startup_padding() ->
     start_vnc_content = START_VNC_PATH.read_text()
     start_xvfb_content = START_XVFB_PATH.read_text()
 
-    assert supervisor_content.count("startsecs=1") == 2
-    assert supervisor_content.count("startsecs=0") == 1
+    assert supervisor_content.count("startsecs=1") == 4
+    assert supervisor_content.count("startsecs=0") == 2
     assert "startsecs=20" not in supervisor_content
     assert "startsecs=120" not in supervisor_content
     assert "startsecs=15" not in supervisor_content
     assert "wait_for_x_server" in start_ibc_content
     assert "wait_for_x_server" in start_vnc_content
-    assert "xset q" in (IB_UTILS_PATH.read_text())
+    assert "xset q" not in IB_UTILS_PATH.read_text()
+    assert '-displayfd "$displayfd"' in start_xvfb_content
     assert "/usr/bin/Xvfb" in start_xvfb_content
 
 
-def test_dockerfile_healthcheck_uses_supervisor_service_status() -> None:
-    """Healthcheck should fail when IBC is not running under supervisord."""
+def test_dockerfile_healthcheck_uses_health_agent_readiness() -> None:
+    """Healthcheck should fail until IB is logged in and its API port answers."""
     content = DOCKERFILE_PATH.read_text()
+    supervisor_content = SUPERVISORD_CONF_PATH.read_text()
 
     assert "--start-period=90s" in content
     assert "--start-period=180s" not in content
-    assert content.count("supervisorctl status xvfb ibc") == 1
-    assert "awk '/^xvfb[[:space:]]+RUNNING/{xvfb=1}" in content
-    assert " /^ibc[[:space:]]+RUNNING/{ibc=1}" in content
-    assert "END{exit !(xvfb && ibc)}'" in content
+    assert 'CMD ["bash", "-c", "read -r expires status </tmp/ib-health/ready' in content
+    assert "rm -f /tmp/ib-health/ready" in ENTRYPOINT_PATH.read_text()
+    assert load_ib_health().STATUS_DIR == Path("/tmp/ib-health")
+    assert (
+        "COPY --chown=root:root programs/ib_health.py /usr/local/bin/ib_health"
+        in content
+    )
+    assert "supervisorctl status" not in content
     assert "pgrep -f supervisord" not in content
+    assert "[program:ib_health]" in supervisor_content
+    assert 'IBC_LOG_FILE="/tmp/ib-ibc/ibc.log"' in START_IBC_PATH.read_text()
+    assert load_ibc_events().IBC_LOG_PATH == Path("/tmp/ib-ibc/ibc.log")
+    assert load_ib_health().IBC_EVENTS_PATH == load_ibc_events().IBC_EVENTS_PATH
 
 
 def test_dockerfile_keeps_runtime_ownership_scoped() -> None:
@@ -2215,11 +2406,99 @@ def test_dockerfile_copies_arm64_external_java_to_runtime() -> None:
     assert "mkdir -p /opt/i4j_jres /usr/local/zulu17" in content
     assert "app_java_home=/usr/local/zulu17 /ib.sh" in content
     assert (
-        "COPY --from=builder --chown=ibuser:ibuser /usr/local/zulu17 /usr/local/zulu17"
+        "COPY --from=payload --chown=ibuser:ibuser /usr/local/zulu17 /usr/local/zulu17"
         in content
     )
 
 
+def test_dockerfile_pruned_payload_is_optional_and_revalidated() -> None:
+    """Pruned builds should be opt-in and pass the runtime layout checks."""
+    content = DOCKERFILE_PATH.read_text()
+    runtime_stage = content[content.index(" AS runtime\n") :]
+
+    assert content.startswith(
+        "# Multi-stage, smaller image for IB Gateway/TWS + IBC\n"
+        "# no | yes: copy the pruned payload stage into the runtime image\n"
+        "ARG PRUNE_RUNTIME=no\n"
+    )
+    assert content.count("Unsupported PRUNE_RUNTIME") == 2
+    assert "FROM builder AS pruned" in content
+    assert "FROM builder AS payload-no" in content
+    assert "FROM pruned AS payload-yes" in content
+    assert "FROM payload-${PRUNE_RUNTIME} AS payload" in content
+    assert "COPY --from=builder" not in content
+    assert '/build-config/prune/${PROGRAM}-unused-jars.txt"' in content
+    assert '"$java_home/lib/src.zip"' in content
+    assert "RUN init_container_settings --check-layout" in runtime_stage
+    assert runtime_stage.index("COPY --from=payload") < runtime_stage.index(
+        "RUN init_container_settings --check-layout"
+    )
+
+
+def test_python_check_layout_cli_validates_image_without_credentials(
+    tmp_path: Path,
+) -> None:
+    """Build-time layout checks should reuse runtime validation without secrets."""
+    release_dir = tmp_path / "opt" / "ibgateway" / "stable"
+    ibc_dir = tmp_path / "opt" / "ibc"
+    create_ib_release_dir(release_dir, "ibgateway")
+    create_ibc_dir(ibc_dir)
+    env = {
+        "PROGRAM": "ibgateway",
+        "IB_RELEASE_DIR": str(release_dir),
+        "IBC_PATH": str(ibc_dir),
+        "IBC_VERSION": "3.23.0",
+    }
+
+    valid_result = subprocess.run(
+        [sys.executable, str(INIT_SETTINGS_PATH), "--check-layout"],
+        check=False,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    (release_dir / "ibgateway.vmoptions").unlink()
+    invalid_result = subprocess.run(
+        [sys.executable, str(INIT_SETTINGS_PATH), "--check-layout"],
+        check=False,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+
+    assert valid_result.returncode == 0
+    assert valid_result.stdout == "IB and IBC layout is valid\n"
+    assert invalid_result.returncode == 1
+    assert "expected vmoptions file" in invalid_result.stderr
+
+
+def test_ci_unused_jars_come_from_class_loading_trace(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Only installed jars that never supplied a class should be pruned."""
+    ci_module = load_ci_module(monkeypatch)
+    jars_dir = tmp_path / "jars"
+    jars_dir.mkdir()
+    for name in ("jts4launch.jar", "twslaunch.jar", "locales.jar", "unused.jar"):
+        (jars_dir / name).write_text("jar")
+    trace_path = tmp_path / "classload.log"
+    trace_path.write_text(
+        "[0.010s][info][class,load] java.lang.Object source: shared objects file\n"
+        "[0.500s][info][class,load] jclient.Main source: "
+        f"file:{jars_dir / 'jts4launch.jar'}\n"
+        "[0.600s][info][class,load] twslaunch.Launcher source: "
+        f"jar:file:{jars_dir / 'twslaunch.jar'}!/\n"
+    )
+    output_path = tmp_path / "prune" / "ibgateway-unused-jars.txt"
+
+    unused_jars = ci_module.write_unused_jars_list(trace_path, jars_dir, output_path)
+
+    assert unused_jars == ["locales.jar", "unused.jar"]
+    assert output_path.read_text().splitlines()[2:] == unused_jars
+    with pytest.raises(RuntimeError, match="did not load any installed IB jar"):
+        ci_module.unused_ib_jars("source: jrt:/java.base\n", ["unused.jar"])
+
+
 def test_dockerfile_verifies_ib_install4j_runtime_used_by_ibc() -> None:
     """Build validation should cover the classpath and Java files IBC reads."""
     content = DOCKERFILE_PATH.read_text()
@@ -3049,7 +3328,7 @@ def test_ci_build_image_rejects_bad_program_before_secret_lookup(
 
 
 def test_ci_build_image_uses_argv_and_expected_tags(
-    monkeypatch: pytest.MonkeyPatch,
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
 ) -> None:
     """Manual CI builds should pass exact buildx argv without shell splitting."""
     ci_module = load_ci_module(monkeypatch)
@@ -3069,10 +3348,22 @@ def test_ci_build_image_uses_argv_and_expected_tags(
         captured["cwd"] = cwd
         return ci_module.CompletedProcess(cmd, 0, stdout="", stderr="")
 
+    def fake_prepare_build_artifacts(
+        program: str, release: str, version: str, platforms: str, offline: bool
+    ) -> Path:
+        captured["artifacts"] = (program, release, version, platforms, offline)
+        return tmp_path / "artifacts"
+
     monkeypatch.setenv("DOCKERHUB_USERNAME", "demo")
+    monkeypatch.delenv("IB_DOCKER_OFFLINE_BUILD", raising=False)
     monkeypatch.setattr(ci_module, "run", fake_run)
+    monkeypatch.setattr(
+        ci_module, "prepare_build_artifacts", fake_prepare_build_artifacts
+    )
+    monkeypatch.setattr(ci_module, "buildkit_cache_dir", tmp_path / "buildkit")
+    cache_dir = tmp_path / "buildkit" / "ibgateway-latest"
 
-    ci_module.build_image(("ibgateway", "latest", "10.45.1e"))
+    timing = ci_module.build_image(("ibgateway", "latest", "10.45.1e"))
 
     assert captured["cmd"] == [
         "docker",
@@ -3088,6 +3379,10 @@ def test_ci_build_image_uses_argv_and_expected_tags(
         "IB_VERSION=10.45.1e",
         "--build-arg",
         "IB_INSTALLER_ARCH=x64",
+        "--build-context",
+        f"ib-artifacts={tmp_path / 'artifacts'}",
+        "--cache-to",
+        f"type=local,dest={cache_dir},mode=max",
         "-t",
         "demo/ib-gateway:latest",
         "-t",
@@ -3099,12 +3394,181 @@ def test_ci_build_image_uses_argv_and_expected_tags(
         "--push",
         ".",
     ]
+    assert captured["artifacts"] == (
+        "ibgateway",
+        "latest",
+        "10.45.1e",
+        "linux/amd64,linux/arm64",
+        False,
+    )
     assert captured["capture_output"] is True
+    assert timing.image == "demo/ib-gateway:latest"
+    assert timing.cache == "cold"
+
+    cache_dir.mkdir(parents=True)
+    (cache_dir / "index.json").write_text("{}")
+    warm_timing = ci_module.build_image(("ibgateway", "latest", "10.45.1e"))
+
+    assert warm_timing.cache == "warm"
+    assert captured["cmd"][15:19] == [
+        "--cache-from",
+        f"type=local,src={cache_dir}",
+        "--cache-to",
+        f"type=local,dest={cache_dir},mode=max",
+    ]
     assert captured["check"] is False
     assert captured["text"] is True
     assert captured["cwd"] == str(REPO_ROOT / "build")
 
 
+def fake_artifact_urlretrieve(
+    downloads: list[str], contents: dict[str, bytes]
+) -> object:
+    """Return a urlretrieve stand-in that records URLs and writes fixed content."""
+
+    def urlretrieve(url: str, filename: Path) -> None:
+        downloads.append(url)
+        Path(filename).write_bytes(contents[url])
+
+    return urlretrieve
+
+
+def test_ci_artifact_cache_reuses_verified_blobs(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Cached artifacts should be content-addressed and downloaded only once."""
+    ci_module = load_ci_module(monkeypatch)
+    url = "https://example.test/IBCLinux-3.23.0.zip"
+    downloads: list[str] = []
+    monkeypatch.setattr(
+        ci_module,
+        "urlretrieve",
+        fake_artifact_urlretrieve(downloads, {url: b"ibc"}),
+    )
+
+    first_path = ci_module.cached_artifact(url, tmp_path)
+    second_path = ci_module.cached_artifact(url, tmp_path)
+
+    assert downloads == [url]
+    assert first_path == second_path
+    assert first_path.name == hashlib.sha256(b"ibc").hexdigest()
+    assert first_path.parent == tmp_path / "blobs" / "sha256"
+
+
+def test_ci_artifact_cache_redownloads_corrupted_blobs(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """A blob whose content no longer matches its digest should not be reused."""
+    ci_module = load_ci_module(monkeypatch)
+    url = "https://example.test/IBCLinux-3.23.0.zip"
+    downloads: list[str] = []
+    monkeypatch.setattr(
+        ci_module,
+        "urlretrieve",
+        fake_artifact_urlretrieve(downloads, {url: b"ibc"}),
+    )
+    blob_path = ci_module.cached_artifact(url, tmp_path)
+    blob_path.write_bytes(b"truncated")
+
+    repaired_path = ci_module.cached_artifact(url, tmp_path)
+
+    assert downloads == [url, url]
+    assert repaired_path.read_bytes() == b"ibc"
+
+
+def test_ci_artifact_cache_rejects_digest_mismatch(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Downloads that do not match the expected digest should not enter the cache."""
+    ci_module = load_ci_module(monkeypatch)
+    url = "https://example.test/installer.sh"
+    monkeypatch.setattr(
+        ci_module, "urlretrieve", fake_artifact_urlretrieve([], {url: b"tampered"})
+    )
+
+    with pytest.raises(RuntimeError, match="Artifact digest mismatch"):
+        ci_module.cached_artifact(url, tmp_path, expected_sha256="0" * 64)
+
+    assert not list((tmp_path / "blobs").glob("**/*"))
+    assert not list((tmp_path / "refs").glob("*"))
+
+
+def test_ci_artifact_cache_offline_requires_warm_cache(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Offline builds should fail clearly instead of reaching the network."""
+    ci_module = load_ci_module(monkeypatch)
+
+    def fail_urlretrieve(url: str, filename: Path) -> None:
+        raise AssertionError(f"unexpected download: {url}")
+
+    monkeypatch.setattr(ci_module, "urlretrieve", fail_urlretrieve)
+
+    with pytest.raises(RuntimeError, match="not cached for offline build"):
+        ci_module.cached_artifact("https://example.test/a.zip", tmp_path, offline=True)
+
+
+def test_ci_prepare_build_artifacts_lays_out_named_context(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """The ib-artifacts context should use the filenames the Dockerfile expects."""
+    ci_module = load_ci_module(monkeypatch)
+    file_name = "ibgateway-stable-10.45.1e-standalone-linux-x64.sh"
+    installer_url = ci_module.release_asset_url("ibgateway", "stable", "10.45.1e")
+    contents = {
+        installer_url: b"installer",
+        f"{installer_url}.sha256": (
+            f"{hashlib.sha256(b'installer').hexdigest()} {file_name}\n".encode()
+        ),
+        ci_module.ibc_release_url("3.23.0"): b"ibc",
+        ci_module.zulu_jre_url(ci_module.ZULU_JRE_NAME): b"zulu",
+    }
+    downloads: list[str] = []
+    monkeypatch.setattr(
+        ci_module, "urlretrieve", fake_artifact_urlretrieve(downloads, contents)
+    )
+
+    context_dir = ci_module.prepare_build_artifacts(
+        "ibgateway",
+        "stable",
+        "10.45.1e",
+        "linux/amd64,linux/arm64",
+        cache_dir=tmp_path,
+    )
+    ci_module.prepare_build_artifacts(
+        "ibgateway",
+        "stable",
+        "10.45.1e",
+        "linux/amd64,linux/arm64",
+        offline=True,
+        cache_dir=tmp_path,
+    )
+
+    assert sorted(downloads) == sorted(contents)
+    assert (context_dir / "ib" / file_name).read_bytes() == b"installer"
+    assert (context_dir / "ib" / f"{file_name}.sha256").is_file()
+    assert (context_dir / "ibc" / "IBCLinux-3.23.0.zip").read_bytes() == b"ibc"
+    assert (
+        context_dir / "zulu" / f"{ci_module.ZULU_JRE_NAME}.tar.gz"
+    ).read_bytes() == b"zulu"
+
+
+def test_dockerfile_prefers_named_artifact_context_over_downloads(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Cached build inputs should use the same paths and versions as downloads."""
+    ci_module = load_ci_module(monkeypatch)
+    content = DOCKERFILE_PATH.read_text()
+
+    assert "FROM scratch AS ib-artifacts" in content
+    assert content.count("--mount=type=bind,from=ib-artifacts,target=/artifacts") == 2
+    assert 'if [ -f "/artifacts/ib/$FILE" ]' in content
+    assert 'if [ -f "/artifacts/ibc/IBCLinux-${IBC_VERSION}.zip" ]' in content
+    assert 'if [ -f "/artifacts/zulu/${ZULU_NAME}.tar.gz" ]' in content
+    assert f'ZULU_NAME="{ci_module.ZULU_JRE_NAME}"' in content
+    assert f"\nARG IBC_VERSION={ci_module.DEFAULT_IBC_VERSION}\n" in content
+
+
 def test_ci_docker_tags_do_not_give_beta_broad_aliases() -> None:
     """Manual CI builds should match workflow beta tag behavior."""
     content = CI_PATH.read_text()
@@ -4160,8 +4624,9 @@ def test_ci_build_images_expands_shared_releases_to_both_products(
     ci_module = load_ci_module(monkeypatch)
     built_params: list[tuple[str, str, str]] = []
 
-    def fake_build_image(params: tuple[str, str, str]) -> None:
+    def fake_build_image(params: tuple[str, str, str]) -> object:
         built_params.append(params)
+        return ci_module.BuildTiming(image=params[0], seconds=1.0, cache="cold")
 
     monkeypatch.setattr(ci_module, "build_image", fake_build_image)
 
@@ -4324,6 +4789,123 @@ def test_shell_run_script_dir_runs_executable_hooks_in_sorted_order(
     assert output_path.read_text() == "firstsecond"
 
 
+def test_shell_run_script_dir_runs_parallel_hooks_and_kills_overdue_ones(
+    tmp_path: Path,
+) -> None:
+    """Parallel hooks should overlap, barriers should wait, and timeouts should kill."""
+    hooks_dir = tmp_path / "hooks"
+    output_path = tmp_path / "output"
+    phases_file = tmp_path / "phases.jsonl"
+    hooks_dir.mkdir()
+    hooks = {
+        "10-a.parallel.sh": f"sleep 0.5; echo a >> {output_path}",
+        "10-b.parallel.timeout-5.sh": f"sleep 0.5; echo b >> {output_path}",
+        "20-barrier.sh": f"echo barrier >> {output_path}",
+    }
+    for name, body in hooks.items():
+        (hooks_dir / name).write_text(f"#!/bin/bash\n{body}\n")
+        (hooks_dir / name).chmod(0o755)
+
+    started = time.monotonic()
+    result = run_bash(
+        f"source {IB_UTILS_PATH}\n"
+        f"STARTUP_PHASES_FILE={shlex.quote(str(phases_file))}\n"
+        f"START_SCRIPTS={hooks_dir}\n"
+        'run_script_dir START_SCRIPTS "startup"\n'
+    )
+    elapsed = time.monotonic() - started
+    (hooks_dir / "30-slow.timeout-1.sh").write_text(
+        f"#!/bin/bash\nsleep 30\necho slow >> {output_path}\n"
+    )
+    (hooks_dir / "30-slow.timeout-1.sh").chmod(0o755)
+    (hooks_dir / "40-after.sh").write_text(
+        f"#!/bin/bash\necho after >> {output_path}\n"
+    )
+    (hooks_dir / "40-after.sh").chmod(0o755)
+    started = time.monotonic()
+    timed_out = run_bash_unchecked(
+        f"source {IB_UTILS_PATH}\n"
+        f"STARTUP_PHASES_FILE={shlex.quote(str(phases_file))}\n"
+        f"START_SCRIPTS={hooks_dir}\n"
+        'run_script_dir START_SCRIPTS "startup"\n'
+    )
+    timed_out_elapsed = time.monotonic() - started
+    bad_default = run_bash_unchecked(
+        f"source {IB_UTILS_PATH}\n"
+        f"START_SCRIPTS={hooks_dir}\n"
+        "HOOK_TIMEOUT_SECONDS=soon\n"
+        'run_script_dir START_SCRIPTS "startup"\n'
+    )
+    lines = output_path.read_text().splitlines()
+
+    assert sorted(lines[:2]) == sorted(lines[3:5]) == ["a", "b"]
+    assert (lines[2], lines[5:]) == ("barrier", ["barrier"])
+    assert elapsed < 0.95
+    assert re.search(
+        r"startup hook finished in [0-9]+\.[0-9]{2}s: .*20-barrier\.sh", result.stdout
+    )
+    assert timed_out.returncode == 1
+    assert timed_out_elapsed < 10
+    assert "startup hook timed out after 1s: " in timed_out.stdout
+    assert "HOOK_TIMEOUT_SECONDS must be a whole number" in bad_default.stdout
+    assert '"phase": "hook:20-barrier.sh"' in phases_file.read_text()
+
+
+def test_shell_run_script_dir_stops_hooks_on_term(tmp_path: Path) -> None:
+    """TERM should stop timed and parallel hooks, then run the caller's trap."""
+
+    def process_alive(pid: int) -> bool:
+        try:
+            state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except FileNotFoundError:
+            return False
+        return state[0] != "Z"
+
+    layouts = [
+        ["10-a.parallel.sh", "10-b.parallel.timeout-60.sh"],
+        ["10-slow.timeout-60.sh"],
+    ]
+    for index, names in enumerate(layouts):
+        hooks_dir = tmp_path / f"hooks-{index}"
+        hooks_dir.mkdir()
+        for name in names:
+            (hooks_dir / name).write_text(
+                f"#!/bin/bash\necho $$ > {hooks_dir}/{name}.pid\nexec sleep 30\n"
+            )
+            (hooks_dir / name).chmod(0o755)
+        process = subprocess.Popen(
+            [
+                "bash",
+                "-eu",
+                "-o",
+                "pipefail",
+                "-c",
+                f"source {IB_UTILS_PATH}\n"
+                "trap 'echo caller-trap; exit 143' TERM\n"
+                f"START_SCRIPTS={hooks_dir}\n"
+                'run_script_dir START_SCRIPTS "startup"\n'
+                "echo finished\n",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        pid_files = [hooks_dir / f"{name}.pid" for name in names]
+        deadline = time.monotonic() + 10
+        while not all(path.exists() and path.read_text() for path in pid_files):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        hook_pids = [int(path.read_text()) for path in pid_files]
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=10)
+
+        assert process.returncode == 143
+        assert "caller-trap" in output
+        assert "finished" not in output
+        assert not any(process_alive(pid) for pid in hook_pids)
+    assert "${HOOK_TIMEOUT_SECONDS:-0}" in IB_UTILS_PATH.read_text()
+
+
 def test_shell_run_script_dir_rejects_non_executable_hooks(tmp_path: Path) -> None:
     """Hook scripts should be explicitly executable."""
     hooks_dir = tmp_path / "hooks"
@@ -4394,3 +4976,1998 @@ def test_readme_gateway_access_ports_match_trading_modes() -> None:
     assert "`localhost:4002` for paper trading" in content
     assert "`localhost:4001` for live trading" in content
     assert "`localhost:4001` (paper:" not in content
+
+
+def layer_tar_bytes(files: dict[str, bytes]) -> bytes:
+    """Return an uncompressed image layer tar containing the given files."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as layer_tar:
+        for name, content in files.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            layer_tar.addfile(member, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def image_config(history: list[dict[str, object]]) -> dict[str, object]:
+    """Return a minimal image config for a Gateway image."""
+    return {
+        "config": {"Env": ["PATH=/usr/bin", "PROGRAM=ibgateway"]},
+        "history": history,
+    }
+
+
+IMAGE_HISTORY = [
+    {"created_by": "/bin/sh -c #(nop) ADD file:debian in /"},
+    {"created_by": 'LABEL org.opencontainers.image.title="IB"', "empty_layer": True},
+    {"created_by": "COPY /opt/ibgateway /opt/ibgateway # buildkit"},
+    {"created_by": "RUN /bin/sh -c rm /opt/ibgateway/stable/old.jar # buildkit"},
+]
+IMAGE_LAYERS = [
+    {"etc/os-release": b"debian"},
+    {
+        "opt/ibgateway/stable/jars/big.jar": b"x" * 4096,
+        "opt/ibgateway/stable/old.jar": b"y" * 8192,
+        "opt/i4j_jres/jre/lib/modules": b"z" * 2048,
+    },
+    {"opt/ibgateway/stable/.wh.old.jar": b""},
+]
+
+
+def write_docker_save_archive(path: Path) -> None:
+    """Write a minimal `docker save` tarball with three layers."""
+    with tarfile.open(path, mode="w") as archive:
+
+        def add(name: str, content: bytes) -> None:
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            archive.addfile(member, io.BytesIO(content))
+
+        layer_names = []
+        for index, files in enumerate(IMAGE_LAYERS):
+            layer_name = f"layer{index}/layer.tar"
+            add(layer_name, layer_tar_bytes(files))
+            layer_names.append(layer_name)
+        add("config.json", json.dumps(image_config(IMAGE_HISTORY)).encode())
+        add(
+            "manifest.json",
+            json.dumps([{"Config": "config.json", "Layers": layer_names}]).encode(),
+        )
+
+
+def write_oci_blob(layout_dir: Path, content: bytes) -> str:
+    """Store a blob in an OCI layout and return its digest."""
+    digest = hashlib.sha256(content).hexdigest()
+    blob_path = layout_dir / "blobs" / "sha256" / digest
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    blob_path.write_bytes(content)
+    return f"sha256:{digest}"
+
+
+def write_oci_layout(layout_dir: Path) -> None:
+    """Write a minimal multi-platform OCI layout with gzip-compressed layers."""
+    layers = [
+        {"digest": write_oci_blob(layout_dir, gzip.compress(layer_tar_bytes(files)))}
+        for files in IMAGE_LAYERS
+    ]
+    config_digest = write_oci_blob(
+        layout_dir, json.dumps(image_config(IMAGE_HISTORY)).encode()
+    )
+    manifest_digest = write_oci_blob(
+        layout_dir,
+        json.dumps({"config": {"digest": config_digest}, "layers": layers}).encode(),
+    )
+    other_manifest_digest = write_oci_blob(
+        layout_dir,
+        json.dumps({"config": {"digest": config_digest}, "layers": []}).encode(),
+    )
+    image_index_digest = write_oci_blob(
+        layout_dir,
+        json.dumps(
+            {
+                "manifests": [
+                    {
+                        "digest": manifest_digest,
+                        "platform": {"os": "linux", "architecture": "amd64"},
+                    },
+                    {
+                        "digest": other_manifest_digest,
+                        "platform": {"os": "linux", "architecture": "arm64"},
+                    },
+                ]
+            }
+        ).encode(),
+    )
+    (layout_dir / "index.json").write_text(
+        json.dumps({"manifests": [{"digest": image_index_digest}]})
+    )
+
+
+def test_ci_analyze_docker_save_reports_layers_and_largest_files(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Image analysis should attribute layers to instructions and apply whiteouts."""
+    ci_module = load_ci_module(monkeypatch)
+    archive_path = tmp_path / "image.tar"
+    write_docker_save_archive(archive_path)
+
+    analysis = ci_module.analyze_image(archive_path)
+
+    assert [layer.instruction for layer in analysis.layers] == [
+        "ADD file:debian in /",
+        "COPY /opt/ibgateway /opt/ibgateway # buildkit",
+        "RUN rm /opt/ibgateway/stable/old.jar # buildkit",
+    ]
+    assert [layer.digest for layer in analysis.layers] == [
+        "layer0",
+        "layer1",
+        "layer2",
+    ]
+    assert analysis.layers[1].uncompressed_bytes > 4096 + 8192 + 2048
+    assert analysis.compressed_bytes == analysis.uncompressed_bytes
+    assert analysis.instructions[0].instruction == analysis.layers[1].instruction
+    assert analysis.largest_files == {
+        "/opt/ibgateway": [("/opt/ibgateway/stable/jars/big.jar", 4096)],
+        "/opt/i4j_jres": [("/opt/i4j_jres/jre/lib/modules", 2048)],
+        "/usr/local/zulu17": [],
+    }
+
+
+def test_ci_analyze_oci_layout_selects_platform_and_decompresses_layers(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Multi-platform OCI layouts should report one platform's compressed layers."""
+    ci_module = load_ci_module(monkeypatch)
+    write_oci_layout(tmp_path)
+
+    with pytest.raises(RuntimeError, match="pass --platform"):
+        ci_module.analyze_image(tmp_path)
+    analysis = ci_module.analyze_image(tmp_path, platform="linux/amd64")
+    docker_save_path = tmp_path / "image.tar"
+    write_docker_save_archive(docker_save_path)
+
+    assert len(analysis.layers) == 3
+    assert analysis.compressed_bytes < analysis.uncompressed_bytes
+    assert (
+        analysis.uncompressed_bytes
+        == ci_module.analyze_image(docker_save_path).uncompressed_bytes
+    )
+    assert analysis.largest_files["/opt/ibgateway"] == [
+        ("/opt/ibgateway/stable/jars/big.jar", 4096)
+    ]
+
+
+def test_ci_analyze_fails_on_size_regression_past_baseline(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """Image analysis should enforce a stored size baseline."""
+    ci_module = load_ci_module(monkeypatch)
+    archive_path = tmp_path / "image.tar"
+    baseline_path = tmp_path / "baseline.json"
+    write_docker_save_archive(archive_path)
+
+    analysis = ci_module.run_image_analysis(
+        archive_path, None, baseline_path, 5.0, update_baseline=True
+    )
+    ci_module.run_image_analysis(archive_path, None, baseline_path, 5.0, False)
+    baseline_path.write_text(
+        json.dumps({"uncompressed_bytes": analysis.uncompressed_bytes // 2})
+    )
+
+    with pytest.raises(RuntimeError, match="Image size regression"):
+        ci_module.run_image_analysis(archive_path, None, baseline_path, 5.0, False)
+    ci_module.run_image_analysis(archive_path, None, baseline_path, 150.0, False)
+
+
+def configure_cds_runtime(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> tuple[Path, Path]:
+    """Create a gateway layout with a fake JVM release file for AppCDS checks."""
+    home = tmp_path / "home" / "ibuser"
+    release_dir = tmp_path / "opt" / "ibgateway" / "stable"
+    ibc_dir = tmp_path / "opt" / "ibc"
+    home.mkdir(parents=True)
+    create_ib_release_dir(release_dir, "ibgateway")
+    create_ibc_dir(ibc_dir)
+    (release_dir / "java" / "release").write_text(
+        'IMPLEMENTOR="Azul Systems, Inc."\nJAVA_RUNTIME_VERSION="17.0.12+7-LTS"\n'
+    )
+    (home / "vmoptions.j2").write_text(VMOPTIONS_TEMPLATE_PATH.read_text())
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("PROGRAM", "ibgateway")
+    monkeypatch.setenv("IB_RELEASE_DIR", str(release_dir))
+    monkeypatch.setenv("IBC_PATH", str(ibc_dir))
+    monkeypatch.setenv("IBC_VERSION", "3.23.0")
+    monkeypatch.setenv("TWS_SETTINGS_PATH", str(home / "tws_settings"))
+    monkeypatch.setenv("JAVA_HEAP_SIZE", "1024m")
+    monkeypatch.delenv("USE_CDS_ARCHIVE", raising=False)
+    return release_dir, release_dir / "cds" / "ibgateway.jsa"
+
+
+def test_cds_training_dumps_archive_then_runtime_maps_matching_jvm(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The trained archive should only be used with the JVM that dumped it."""
+    release_dir, archive_path = configure_cds_runtime(tmp_path, monkeypatch)
+    vmoptions_path = release_dir / "ibgateway.vmoptions"
+
+    assert init_settings.prepare_cds_training() == archive_path
+    training_content = vmoptions_path.read_text()
+    with pytest.raises(RuntimeError, match="did not dump"):
+        init_settings.record_cds_archive()
+    archive_path.write_bytes(b"archive")
+    init_settings.record_cds_archive()
+    init_settings.set_java_vmoptions()
+    matching_content = vmoptions_path.read_text()
+    monkeypatch.setenv("USE_CDS_ARCHIVE", "no")
+    init_settings.set_java_vmoptions()
+    disabled_content = vmoptions_path.read_text()
+    monkeypatch.delenv("USE_CDS_ARCHIVE")
+    (release_dir / "java" / "release").write_text('JAVA_VERSION="17.0.13"\n')
+    init_settings.set_java_vmoptions()
+    mismatched_content = vmoptions_path.read_text()
+    (release_dir / "java" / "release").unlink()
+    init_settings.set_java_vmoptions()
+    unverifiable_content = vmoptions_path.read_text()
+
+    assert f"-XX:ArchiveClassesAtExit={archive_path}" in training_content
+    assert "SharedArchiveFile" not in training_content
+    assert (
+        f"# Class data sharing\n-XX:SharedArchiveFile={archive_path}"
+        in matching_content
+    )
+    assert "ArchiveClassesAtExit" not in matching_content
+    assert "SharedArchiveFile" not in disabled_content
+    assert "SharedArchiveFile" not in mismatched_content
+    assert "SharedArchiveFile" not in unverifiable_content
+    assert archive_path.with_name("ibgateway.jsa.jvm").read_text() == (
+        f"{release_dir / 'java'} Azul Systems, Inc. 17.0.12+7-LTS\n"
+    )
+
+
+def test_cds_options_precede_custom_jvm_opts(init_settings: ModuleType) -> None:
+    """Custom JVM options should come last so they can override AppCDS."""
+    content = init_settings.render_vmoptions(
+        VMOPTIONS_TEMPLATE_PATH.read_text(),
+        "1024",
+        512,
+        Path("/home/ibuser/tws_settings"),
+        ["-Xshare:off"],
+        ["-XX:SharedArchiveFile=/opt/ibgateway/stable/cds/ibgateway.jsa"],
+    )
+
+    assert content.index("-XX:SharedArchiveFile=") < content.index("-Xshare:off")
+
+
+def test_dockerfile_trains_cds_archive_as_runtime_user() -> None:
+    """AppCDS training should run after layout checks, as the runtime user."""
+    content = DOCKERFILE_PATH.read_text()
+    script = BUILD_CDS_ARCHIVE_PATH.read_text()
+    runtime_stage = content[content.index(" AS runtime\n") :]
+
+    assert "ARG CDS_ARCHIVE=yes" in runtime_stage
+    assert "Unsupported CDS_ARCHIVE" in runtime_stage
+    assert (
+        "COPY --chown=root:root programs/build_cds_archive.sh "
+        "/usr/local/bin/build_cds_archive"
+    ) in runtime_stage
+    train_index = runtime_stage.index(
+        'RUN if [ "$CDS_ARCHIVE" = "yes" ]; then build_cds_archive; fi'
+    )
+    assert runtime_stage.index("RUN init_container_settings --check-layout") < (
+        train_index
+    )
+    assert runtime_stage.index("USER ibuser") < train_index
+    assert '"IbLoginId=" "IbPassword="' in script
+    assert "init_container_settings --cds-training" in script
+    assert "init_container_settings --cds-record" in script
+    assert script.index('cp -p "$vmoptions_file" "$vmoptions_backup"') < (
+        script.index("init_container_settings --cds-training")
+    )
+
+
+def test_ci_startup_benchmark_alternates_cds_modes(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """The benchmark should interleave modes and summarize each one."""
+    ci_module = load_ci_module(monkeypatch)
+    env_file = tmp_path / "paper.env"
+    env_file.write_text("IB_USER=paper\n")
+    timings = iter([20.0, 40.0, 22.0, 38.0, 24.0, 45.0])
+    calls: list[str] = []
+
+    def fake_startup_seconds(
+        image: str,
+        env_path: Path,
+        use_cds: str,
+        ready_pattern: re.Pattern[str],
+        timeout: float,
+    ) -> float:
+        calls.append(use_cds)
+        assert ready_pattern.pattern == ci_module.STARTUP_READY_PATTERN
+        return next(timings)
+
+    monkeypatch.setattr(ci_module, "container_startup_seconds", fake_startup_seconds)
+
+    summary = ci_module.run_startup_benchmark(
+        "danklabs/ib-gateway:stable",
+        env_file,
+        3,
+        ci_module.STARTUP_READY_PATTERN,
+        60.0,
+    )
+
+    assert calls == ["yes", "no", "yes", "no", "yes", "no"]
+    assert summary == {
+        "yes": {"min": 20.0, "median": 22.0, "max": 24.0},
+        "no": {"min": 38.0, "median": 40.0, "max": 45.0},
+    }
+    assert (
+        ci_module.wait_for_log_pattern(
+            ["starting\n", "IBC: Login has completed\n", "later\n"],
+            re.compile(ci_module.STARTUP_READY_PATTERN),
+        )
+        == "IBC: Login has completed"
+    )
+
+
+def test_dockerfile_apt_installs_use_cache_mounts_once_per_stage() -> None:
+    """Each stage should run one cached apt transaction, including TWS GUI libs."""
+    content = DOCKERFILE_PATH.read_text()
+    builder_stage = content[: content.index(" AS runtime\n")]
+    runtime_stage = content[content.index(" AS runtime\n") :]
+
+    for stage in (builder_stage, runtime_stage):
+        assert stage.count("apt-get update") == 1
+        assert stage.count("apt-get install") == 1
+        assert (
+            "--mount=type=cache,id=apt-cache-${TARGETARCH},"
+            "target=/var/cache/apt,sharing=locked"
+        ) in stage
+        assert (
+            "--mount=type=cache,id=apt-lists-${TARGETARCH},"
+            "target=/var/lib/apt/lists,sharing=locked"
+        ) in stage
+        assert "rm -f /etc/apt/apt.conf.d/docker-clean" in stage
+    assert "rm -rf /var/lib/apt/lists" not in content
+    assert 'if [ "$PROGRAM" = "tws" ]; then \\\n      tws_packages="libgtk-3-0' in (
+        runtime_stage
+    )
+    assert "      tini coreutils \\\n      $tws_packages\n" in runtime_stage
+
+
+MIB = 1024 * 1024
+
+
+def write_cgroup_fixture(
+    root: Path, proc_cgroup: str, mountinfo: list[str], files: dict[str, str]
+) -> Path:
+    """Create a fake filesystem root with /proc/self cgroup data and control files."""
+    (root / "proc" / "self").mkdir(parents=True)
+    (root / "proc" / "self" / "cgroup").write_text(proc_cgroup)
+    (root / "proc" / "self" / "mountinfo").write_text("\n".join(mountinfo) + "\n")
+    for name, value in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"{value}\n")
+    return root
+
+
+def write_cgroup_v2_fixture(root: Path, files: dict[str, str]) -> Path:
+    """Create a namespaced cgroup v2 container view."""
+    return write_cgroup_fixture(
+        root,
+        "0::/\n",
+        ["30 25 0:26 / /sys/fs/cgroup rw,nosuid - cgroup2 cgroup2 rw,nsdelegate"],
+        {
+            "sys/fs/cgroup/cgroup.controllers": "cpuset cpu io memory pids",
+            **{f"sys/fs/cgroup/{name}": value for name, value in files.items()},
+        },
+    )
+
+
+def write_cgroup_v1_fixture(root: Path, files: dict[str, str]) -> Path:
+    """Create a cgroup v1 Docker container view without a cgroup namespace."""
+    return write_cgroup_fixture(
+        root,
+        "12:memory:/docker/abc\n11:cpu,cpuacct:/docker/abc\n1:name=systemd:/docker/abc\n",
+        [
+            "35 30 0:31 /docker/abc /sys/fs/cgroup/memory rw,nosuid shared:15 "
+            "- cgroup cgroup rw,memory",
+            "36 30 0:32 /docker/abc /sys/fs/cgroup/cpu,cpuacct rw,nosuid shared:16 "
+            "- cgroup cgroup rw,cpu,cpuacct",
+        ],
+        {f"sys/fs/cgroup/{name}": value for name, value in files.items()},
+    )
+
+
+def test_adaptive_heap_policy_sizes_workload_within_memory_high(
+    init_settings: ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """memory.high should bound the heap, and the report should explain why."""
+    root = write_cgroup_v2_fixture(
+        tmp_path / "root",
+        {
+            "memory.max": str(4096 * MIB),
+            "memory.high": str(1536 * MIB),
+            "memory.swap.max": str(1024 * MIB),
+        },
+    )
+    profile_path = tmp_path / "workload.profile"
+    profile_path.write_text(
+        "# 400 streaming lines across four API clients\n"
+        "market_data_lines=400\n"
+        "api_clients=4\n"
+    )
+    monkeypatch.delenv("JAVA_HEAP_SIZE", raising=False)
+    monkeypatch.setenv("JAVA_HEAP_POLICY", "adaptive")
+    monkeypatch.setenv("JAVA_WORKLOAD_PROFILE", str(profile_path))
+    resources = init_settings.detect_container_resources(root, affinity_cpus=4)
+
+    decision = init_settings.decide_heap_size("ibgateway", resources)
+    report = capsys.readouterr().out
+
+    assert (decision.max_heap_mb, decision.initial_heap_mb) == (1024, 1024)
+    assert "Heap policy adaptive: max=1024MB initial=1024MB" in report
+    assert "workload demand 1560MB" in report
+    assert "memory budget 1536MB from memory.high" in report
+    assert "1024MB swap ignored" in report
+    assert "heap ceiling 1024MB after 512MB non-heap reserve (4 CPUs" in report
+    assert "workload wants 536MB more" in report
+
+
+def test_heap_policies_read_cgroup_v1_and_explicit_settings(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Policies should accept v1 trees, pinned heaps and default to the legacy tiers."""
+    root = write_cgroup_v1_fixture(
+        tmp_path / "root",
+        {
+            "memory/memory.limit_in_bytes": str(3072 * MIB),
+            "memory/memory.memsw.limit_in_bytes": str(4096 * MIB),
+        },
+    )
+    monkeypatch.delenv("JAVA_WORKLOAD_PROFILE", raising=False)
+    monkeypatch.delenv("JAVA_HEAP_SIZE", raising=False)
+    monkeypatch.delenv("JAVA_HEAP_POLICY", raising=False)
+    resources = init_settings.detect_container_resources(root, affinity_cpus=2)
+
+    inputs = init_settings.heap_inputs("tws", resources)
+    tiered = init_settings.decide_heap_size("tws", resources)
+    monkeypatch.setenv("JAVA_HEAP_POLICY", "adaptive")
+    adaptive = init_settings.decide_heap_size("tws", resources)
+    monkeypatch.delenv("JAVA_HEAP_POLICY")
+    monkeypatch.setenv("JAVA_HEAP_SIZE", "2g")
+    pinned = init_settings.decide_heap_size("tws", resources)
+
+    assert (inputs.memory_limit_mb, inputs.memory_high_mb) == (3072, None)
+    assert inputs.swap_limit_mb == 1024
+    assert (adaptive.max_heap_mb, adaptive.initial_heap_mb) == (1734, 1734)
+    assert (tiered.max_heap_mb, tiered.initial_heap_mb) == (1843, 512)
+    assert (pinned.max_heap_mb, pinned.initial_heap_mb) == (2048, 512)
+    assert pinned.reasons[0] == "max from JAVA_HEAP_SIZE (2048MB)"
+
+
+def test_calculate_java_heap_size_keeps_tiered_default_without_limit(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Existing deployments without a memory limit should keep the 2048MB heap."""
+    root = write_cgroup_v2_fixture(tmp_path / "root", {"memory.max": "max"})
+    detect = init_settings.detect_container_resources
+    monkeypatch.setattr(
+        init_settings,
+        "detect_container_resources",
+        lambda: detect(root, affinity_cpus=2),
+    )
+    monkeypatch.setenv("PROGRAM", "ibgateway")
+    monkeypatch.delenv("JAVA_HEAP_SIZE", raising=False)
+    monkeypatch.delenv("JAVA_HEAP_POLICY", raising=False)
+    monkeypatch.delenv("JAVA_WORKLOAD_PROFILE", raising=False)
+
+    default_heap = init_settings.calculate_java_heap_size()
+    monkeypatch.setenv("JAVA_HEAP_POLICY", "adaptive")
+    adaptive_heap = init_settings.calculate_java_heap_size()
+
+    assert default_heap == "2048"
+    assert adaptive_heap == "966"
+
+
+def test_workload_profile_rejects_unknown_keys(
+    init_settings: ModuleType, tmp_path: Path
+) -> None:
+    """Typos in the workload profile should fail init instead of being ignored."""
+    profile_path = tmp_path / "workload.profile"
+    profile_path.write_text("market_data_line=300\n")
+
+    with pytest.raises(ValueError, match="line 1 is invalid"):
+        init_settings.load_workload_profile(profile_path)
+
+
+def test_container_resources_resolve_nested_cgroup_v2_limits(
+    init_settings: ModuleType, tmp_path: Path
+) -> None:
+    """Without a cgroup namespace, limits on parent cgroups should still apply."""
+    container = "sys/fs/cgroup/kubepods/pod1/ctr"
+    root = write_cgroup_fixture(
+        tmp_path / "root",
+        "0::/kubepods/pod1/ctr\n",
+        ["30 25 0:26 / /sys/fs/cgroup rw,nosuid - cgroup2 cgroup2 rw"],
+        {
+            "sys/fs/cgroup/cgroup.controllers": "cpu memory",
+            "sys/fs/cgroup/kubepods/pod1/memory.max": str(2048 * MIB),
+            "sys/fs/cgroup/kubepods/pod1/cpu.max": "150000 100000",
+            f"{container}/memory.max": "max",
+            f"{container}/memory.high": str(1536 * MIB),
+            f"{container}/memory.swap.max": "0",
+            f"{container}/cpu.max": "max 100000",
+        },
+    )
+
+    resources = init_settings.detect_container_resources(root, affinity_cpus=8)
+
+    assert resources.cgroup_version == "v2"
+    assert resources.memory_cgroup == root / container
+    assert (resources.memory_limit_mb, resources.memory_high_mb) == (2048, 1536)
+    assert resources.swap_limit_mb == 0
+    assert (resources.cpu_quota, resources.cpu_count) == (1.5, 2)
+    assert init_settings.cpu_budget_opts(resources) == ["-XX:ActiveProcessorCount=2"]
+    assert init_settings.parallel_gc_threads(resources.cpu_count) == 2
+    assert resources.report() == (
+        "Detected cgroup v2 resources: memory.max=2048MB memory.high=1536MB "
+        "swap=0MB cpu quota=1.5 cpus=2"
+    )
+
+
+def test_container_resources_read_v1_and_hybrid_hierarchies(
+    init_settings: ModuleType, tmp_path: Path
+) -> None:
+    """v1 controllers should win on hybrid hosts where the v2 tree is empty."""
+    v1_root = write_cgroup_v1_fixture(
+        tmp_path / "v1",
+        {
+            "memory/memory.limit_in_bytes": str(1024 * MIB),
+            "cpu,cpuacct/cpu.cfs_quota_us": "300000",
+            "cpu,cpuacct/cpu.cfs_period_us": "100000",
+        },
+    )
+    hybrid_root = write_cgroup_fixture(
+        tmp_path / "hybrid",
+        "12:memory:/docker/abc\n11:cpu,cpuacct:/docker/abc\n0::/docker/abc\n",
+        [
+            "35 30 0:31 /docker/abc /sys/fs/cgroup/memory rw - cgroup cgroup rw,memory",
+            "36 30 0:32 /docker/abc /sys/fs/cgroup/cpu,cpuacct rw "
+            "- cgroup cgroup rw,cpu,cpuacct",
+            "37 30 0:33 / /sys/fs/cgroup/unified rw - cgroup2 cgroup2 rw",
+        ],
+        {
+            "sys/fs/cgroup/memory/memory.limit_in_bytes": str(9223372036854771712),
+            "sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us": "-1",
+            "sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us": "100000",
+            "sys/fs/cgroup/unified/cgroup.controllers": "",
+        },
+    )
+
+    v1 = init_settings.detect_container_resources(v1_root, affinity_cpus=16)
+    hybrid = init_settings.detect_container_resources(hybrid_root, affinity_cpus=16)
+    missing = init_settings.detect_container_resources(
+        tmp_path / "empty", affinity_cpus=12
+    )
+
+    assert v1.cgroup_version == "v1"
+    assert (v1.memory_limit_mb, v1.swap_limit_mb, v1.cpu_count) == (1024, None, 3)
+    assert hybrid.cgroup_version == "hybrid"
+    assert hybrid.memory_cgroup == hybrid_root / "sys/fs/cgroup/memory"
+    assert (hybrid.memory_limit_mb, hybrid.cpu_quota, hybrid.cpu_count) == (
+        None,
+        None,
+        16,
+    )
+    assert init_settings.parallel_gc_threads(hybrid.cpu_count) == 13
+    assert missing.cgroup_version == "none"
+    assert (missing.memory_limit_mb, missing.cpu_count) == (None, 12)
+
+
+def test_gc_profiles_derive_settings_from_cpu_and_heap_budget(
+    init_settings: ModuleType,
+) -> None:
+    """Each profile should size its collector from the detected budget."""
+    assert init_settings.gc_profile_opts("throughput", 1024, 4) == [
+        "-XX:+UseParallelGC",
+        "-XX:ParallelGCThreads=4",
+        "-XX:MaxGCPauseMillis=200",
+        "-XX:GCTimeRatio=4",
+        "-XX:AdaptiveSizePolicyWeight=90",
+    ]
+    assert init_settings.gc_profile_opts("low-latency-g1", 8192, 12) == [
+        "-XX:+UseG1GC",
+        "-XX:ParallelGCThreads=10",
+        "-XX:ConcGCThreads=3",
+        "-XX:G1HeapRegionSize=4m",
+        "-XX:MaxGCPauseMillis=50",
+        "-XX:+ParallelRefProcEnabled",
+    ]
+    assert init_settings.gc_profile_opts("low-latency-zgc", 2000, 2) == [
+        "-XX:+UseZGC",
+        "-XX:ParallelGCThreads=2",
+        "-XX:ConcGCThreads=1",
+        "-XX:SoftMaxHeapSize=1800m",
+    ]
+    assert init_settings.gc_profile_opts("footprint", 512, 1)[0] == ("-XX:+UseSerialGC")
+    with pytest.raises(ValueError, match="needs at least 2 CPUs"):
+        init_settings.gc_profile_opts("low-latency-g1", 2048, 1)
+    with pytest.raises(ValueError, match="heap of at least 1024MB"):
+        init_settings.gc_profile_opts("low-latency-zgc", 768, 4)
+    with pytest.raises(ValueError, match="use at most 2048MB"):
+        init_settings.gc_profile_opts("footprint", 4096, 4)
+
+
+def test_gc_profile_renders_into_vmoptions_and_rejects_custom_collectors(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The selected profile replaces the template GC block; collectors cannot clash."""
+    release_dir, _ = configure_cds_runtime(tmp_path, monkeypatch)
+    monkeypatch.setenv("JAVA_GC_PROFILE", "low-latency-g1")
+    monkeypatch.setattr(
+        init_settings,
+        "detect_container_resources",
+        lambda: init_settings.ContainerResources("v2", 4096, None, None, 2.0, 2),
+    )
+
+    init_settings.set_java_vmoptions()
+    content = (release_dir / "ibgateway.vmoptions").read_text()
+    monkeypatch.setenv("CUSTOM_JVM_OPTS", "-XX:+UseParallelGC")
+
+    assert "{{" not in content
+    assert "-XX:+UseG1GC\n-XX:ParallelGCThreads=2\n" in content
+    assert "UseParallelGC" not in content
+    with pytest.raises(ValueError, match="JAVA_GC_PROFILE=low-latency-g1 already"):
+        init_settings.validate_custom_gc_opts(
+            "low-latency-g1", init_settings.custom_jvm_opts()
+        )
+
+
+def test_vmoptions_model_resolves_duplicate_and_conflicting_flags(
+    init_settings: ModuleType,
+) -> None:
+    """Each setting should appear once, decided by source precedence."""
+    template = (
+        "-Xmx{{ max_heap }}m\n-Xms{{ initial_heap }}m\n"
+        "{% for opt in gc_opts %}\n{{ opt }}\n{% endfor %}\n"
+        "-XX:+UseSerialGC\n-XX:MaxRAMPercentage=75.0\n-XX:+UseTransparentHugePages\n"
+        "-XX:ParallelGCThreads=8\n"
+        "{% for opt in custom_opts %}\n{{ opt }}\n{% endfor %}\n"
+    )
+
+    model = init_settings.build_vmoptions_model(
+        template,
+        "2048",
+        512,
+        Path("/home/ibuser/tws_settings"),
+        ["-XX:-UseTransparentHugePages"],
+        gc_opts=["-XX:+UseG1GC", "-XX:ParallelGCThreads=2"],
+    )
+    content = model.render()
+
+    assert "UseSerialGC" not in content
+    assert "MaxRAMPercentage" not in content
+    assert "+UseTransparentHugePages" not in content
+    assert "ParallelGCThreads=8" not in content
+    assert content.count("-XX:ParallelGCThreads=2") == 1
+    assert content.endswith("\n-XX:-UseTransparentHugePages\n")
+    assert model.effective_settings() == [
+        "-Xmx2048m",
+        "-Xms512m",
+        "-XX:+UseG1GC",
+        "-XX:ParallelGCThreads=2",
+    ]
+    assert [(option.text, option.source) for option in model.options()] == [
+        ("-Xmx2048m", "template"),
+        ("-Xms512m", "template"),
+        ("-XX:+UseG1GC", "gc"),
+        ("-XX:ParallelGCThreads=2", "gc"),
+        ("-XX:-UseTransparentHugePages", "custom"),
+    ]
+    assert any("MaxRAMPercentage" in decision for decision in model.decisions)
+    assert any(
+        "overridden by -XX:-UseTransparentHugePages (custom)" in decision
+        for decision in model.decisions
+    )
+
+
+def test_vmoptions_model_rejects_custom_heap_sizing(
+    init_settings: ModuleType,
+) -> None:
+    """Heap size belongs to the heap policy, and the initial heap fits under it."""
+    template = VMOPTIONS_TEMPLATE_PATH.read_text()
+    settings_path = Path("/home/ibuser/tws_settings")
+
+    assert "MaxRAMPercentage" not in template
+    for opt in ("-Xmx4g", "-XX:MaxHeapSize=4g", "-XX:InitialRAMPercentage=50"):
+        with pytest.raises(ValueError, match="JAVA_HEAP_SIZE"):
+            init_settings.render_vmoptions(template, "1024", 512, settings_path, [opt])
+    with pytest.raises(ValueError, match="exceeds max heap"):
+        init_settings.render_vmoptions(template, "512", 1024, settings_path, [])
+    assert init_settings.jvm_option_key("-XX:InitialHeapSize=1g") == "Xms"
+    assert init_settings.jvm_size_mb("-XX:MaxHeapSize=2g") == 2048
+
+
+GC_LOG_SAMPLE = """\
+[0.012s][info][gc] Using G1
+[1.503s][info][gc,start    ] GC(0) Pause Young (Normal) (G1 Evacuation Pause)
+[1.507s][info][gc          ] GC(0) Pause Young (Normal) (G1 Evacuation Pause) 24M->4M(256M) 3.456ms
+[1.508s][info][safepoint   ] Safepoint "G1CollectForAllocation", Time since last: 1400000000 ns, Reaching safepoint: 200000 ns, Cleanup: 1000 ns, At safepoint: 3600000 ns, Total: 3801000 ns
+[9.100s][info][gc          ] GC(1) Pause Young (Normal) (G1 Evacuation Pause) 68M->12M(256M) 12.000ms
+[20.000s][info][gc          ] GC(2) Pause Full (System.gc()) 40M->20M(128M) 150.5ms
+"""
+
+
+class FakeApiListener:
+    """Accept TWS API handshakes on localhost and answer with a server version."""
+
+    def __init__(self) -> None:
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.greetings: list[bytes] = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                prefix = conn.recv(8)
+                (size,) = struct.unpack(">I", prefix[4:8])
+                self.greetings.append(prefix[:4] + conn.recv(size))
+                reply = b"176\x0020261019 09:30:00 UTC\x00"
+                conn.sendall(struct.pack(">I", len(reply)) + reply)
+
+    def close(self) -> None:
+        # shutdown wakes the blocked accept(); close alone leaves it listening.
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        self.thread.join()
+
+
+def test_ib_health_handshakes_with_fake_api_listener() -> None:
+    """The API probe should complete the TWS version handshake, not just connect."""
+    health = load_ib_health()
+    listener = FakeApiListener()
+    try:
+        server_version = health.api_handshake(listener.port)
+    finally:
+        listener.close()
+    closed_port = listener.port
+
+    assert server_version == 176
+    assert listener.greetings == [b"API\x00v100..176"]
+    with pytest.raises(OSError):
+        health.api_handshake(closed_port, timeout=0.5)
+
+
+class FakeXServer:
+    """Answer X11 connection setup and GetInputFocus requests on a unix socket."""
+
+    def __init__(self, socket_dir: Path, display_number: int) -> None:
+        socket_dir.mkdir(exist_ok=True)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(str(socket_dir / f"X{display_number}"))
+        self.server.listen()
+        self.connections = 0
+        self.requests = 0
+        self.conn: socket.socket | None = None
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self.conn = conn
+            with conn:
+                conn.recv(12)
+                conn.sendall(struct.pack("<BBHHH", 1, 0, 11, 0, 2) + bytes(8))
+                while len(conn.recv(4)) == 4:
+                    self.requests += 1
+                    conn.sendall(b"\x01" + bytes(31))
+
+    def close(self) -> None:
+        """Stop listening and drop the client, as a dying Xvfb would."""
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        if self.conn is not None:
+            self.conn.shutdown(socket.SHUT_RDWR)
+
+
+def test_ib_health_separates_liveness_from_readiness(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Live needs processes and X; ready also needs a finished login and the API."""
+    health = load_ib_health()
+    listener = FakeApiListener()
+    x_socket_dir = tmp_path / "x11"
+    x_server = FakeXServer(x_socket_dir, 1)
+    status_dir = tmp_path / "ib-health"
+    ibc_events = tmp_path / "events.jsonl"
+    ibc_events.write_text(
+        '{"event": "login_started"}\n{"event": "twofa_pending"}\nnot json\n'
+    )
+    states = {"xvfb": "RUNNING", "ibc": "RUNNING"}
+    probe = health.HealthProbe(
+        listener.port, ":1", ibc_events, lambda: dict(states), x_socket_dir
+    )
+    server = health.make_server(probe, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("HEALTH_PORT", str(server.server_address[1]))
+
+    def fetch(path: str) -> tuple[int, dict[str, object]]:
+        url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            return exc.code, json.loads(exc.read())
+
+    try:
+        health.write_status(probe.refresh(), status_dir)
+        twofa_live = fetch("/livez")
+        twofa_ready = fetch("/readyz")
+        twofa_ready_file = (status_dir / "ready").exists()
+        with ibc_events.open("a") as handle:
+            handle.write('{"event": "logged_in"}\n')
+        health.write_status(probe.refresh(), status_dir)
+        logged_in_ready = fetch("/readyz")
+        expires, ready_json = (status_dir / "ready").read_text().split(" ", 1)
+        ready_file = json.loads(ready_json)
+        probe_exit = health.run(["--probe", "ready"])
+        states["ibc"] = "BACKOFF"
+        health.write_status(probe.refresh(), status_dir)
+        crashed_live = fetch("/livez")
+    finally:
+        server.shutdown()
+        listener.close()
+        x_server.close()
+    logged_in_ready[1].pop("checked_at")
+
+    assert twofa_live[0] == 200
+    assert twofa_ready[0] == 503
+    assert twofa_ready[1]["checks"]["login"] == "twofa_pending"
+    assert str(twofa_ready[1]["checks"]["api"]).startswith("ok")
+    assert logged_in_ready == (
+        200,
+        {
+            "live": True,
+            "ready": True,
+            "checks": {
+                "xvfb": "RUNNING",
+                "ibc": "RUNNING",
+                "x_server": "ok",
+                "login": "logged_in",
+                "api": "ok: server version 176",
+            },
+        },
+    )
+    assert probe_exit == 0
+    assert crashed_live[0] == 503
+    assert crashed_live[1]["checks"]["ibc"] == "BACKOFF"
+    assert not twofa_ready_file
+    assert ready_file["ready"] is True
+    assert int(expires) == int(ready_file["checked_at"] + health.STATUS_TTL_SECONDS)
+    assert not (status_dir / "ready").exists()
+    assert json.loads((status_dir / "status.json").read_text())["live"] is False
+    assert (x_server.connections, x_server.requests) == (1, 3)
+
+
+def test_ib_health_ready_file_expires_when_agent_stops_refreshing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A stale ready file and a stale endpoint answer must both fail the probe."""
+    ci = load_ci_module(monkeypatch)
+    health = load_ib_health()
+    status_dir = tmp_path / "ib-health"
+    healthcheck = ci.dockerfile_healthcheck_command(status_dir / "ready")
+
+    def probe_exit() -> int:
+        return subprocess.run(healthcheck, capture_output=True).returncode
+
+    missing = probe_exit()
+    health.write_status(health.HealthStatus(True, True), status_dir)
+    fresh = probe_exit()
+    stale = health.HealthStatus(
+        True, True, checked_at=time.time() - health.STATUS_TTL_SECONDS - 1
+    )
+    health.write_status(stale, status_dir)
+    expired = probe_exit()
+
+    probe = health.HealthProbe(0, ":1", tmp_path / "events.jsonl", dict, tmp_path)
+    probe.status = stale
+    server = health.make_server(probe, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("HEALTH_PORT", str(server.server_address[1]))
+    try:
+        endpoint_ready = health.run(["--probe", "ready"])
+    finally:
+        server.shutdown()
+
+    assert (missing, fresh, expired) == (1, 0, 1)
+    assert endpoint_ready == 1
+
+
+def test_ib_health_removes_ready_file_on_sigterm(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Stopping the agent must not leave the container ready until the next restart."""
+    health = load_ib_health()
+    status_dir = tmp_path / "ib-health"
+    monkeypatch.setenv("PROGRAM", "ibgateway")
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        monkeypatch.setenv("HEALTH_PORT", str(unused.getsockname()[1]))
+    monkeypatch.setattr(
+        health.HealthProbe, "check", lambda self: health.HealthStatus(True, True)
+    )
+    ready_seen = []
+
+    def sleep(seconds: float) -> None:
+        ready_seen.append((status_dir / "ready").exists())
+        signal.raise_signal(signal.SIGTERM)
+
+    monkeypatch.setattr(health.time, "sleep", sleep)
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        with pytest.raises(SystemExit) as exited:
+            health.run(["--status-dir", str(status_dir)])
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    assert ready_seen == [True]
+    assert exited.value.code == 0
+    assert not (status_dir / "ready").exists()
+    assert (status_dir / "status.json").exists()
+
+
+def test_ib_health_reconnects_to_x_server_after_restart(tmp_path: Path) -> None:
+    """A restarted Xvfb should be picked up on the next ping, not only by a new agent."""
+    health = load_ib_health()
+    x_socket_dir = tmp_path / "x11"
+    connection = health.XConnection(":3", x_socket_dir)
+
+    missing = connection.ping()
+    first_server = FakeXServer(x_socket_dir, 3)
+    first = connection.ping()
+    first_server.close()
+    (x_socket_dir / "X3").unlink()
+    dead = connection.ping()
+    second_server = FakeXServer(x_socket_dir, 3)
+    second = [connection.ping(), connection.ping()]
+    second_server.close()
+
+    assert (missing, first, dead, second) == (False, True, False, [True, True])
+    assert second_server.connections == 1
+    assert health.XConnection("localhost:3").ping() is False
+
+
+def test_ib_health_reads_supervisor_states_over_unix_socket(tmp_path: Path) -> None:
+    """The agent should keep one XML-RPC connection to supervisord's unix socket."""
+    health = load_ib_health()
+    socket_path = tmp_path / "supervisor.sock"
+
+    class UnixXmlRpcHandler(SimpleXMLRPCRequestHandler):
+        disable_nagle_algorithm = False
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: object) -> None:
+            return
+
+    class UnixXmlRpcServer(socketserver.UnixStreamServer, SimpleXMLRPCDispatcher):
+        logRequests = False
+        connections = 0
+
+        def verify_request(self, request: object, client_address: object) -> bool:
+            self.connections += 1
+            return True
+
+        def __init__(self, path: str) -> None:
+            SimpleXMLRPCDispatcher.__init__(self, allow_none=True)
+            socketserver.UnixStreamServer.__init__(self, path, UnixXmlRpcHandler)
+
+    server = UnixXmlRpcServer(str(socket_path))
+    server.register_function(
+        lambda: [
+            {"name": "xvfb", "statename": "RUNNING"},
+            {"name": "ibc", "statename": "STARTING"},
+        ],
+        "supervisor.getAllProcessInfo",
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = health.SupervisorClient(socket_path)
+    try:
+        states = [client.states(), client.states()]
+    finally:
+        client.proxy("close")()
+        server.shutdown()
+        server.server_close()
+
+    assert states == [{"xvfb": "RUNNING", "ibc": "STARTING"}] * 2
+    assert server.connections == 1
+
+
+def test_ib_health_api_port_follows_program_and_trading_mode(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """The probed API port should match the documented port table and IBC override."""
+    health = load_ib_health()
+    monkeypatch.delenv("OVERRIDE_TWS_API_PORT", raising=False)
+    monkeypatch.setenv("PROGRAM", "ibgateway")
+    monkeypatch.setenv("TRADING_MODE", "live")
+    gateway_live = health.api_port()
+    monkeypatch.setenv("PROGRAM", "tws")
+    monkeypatch.delenv("TRADING_MODE")
+    tws_paper = health.api_port()
+    monkeypatch.setenv("OVERRIDE_TWS_API_PORT", "4999")
+
+    assert (gateway_live, tws_paper, health.api_port()) == (4001, 7497, 4999)
+    monkeypatch.setenv("HEALTH_PORT", "0")
+    with pytest.raises(ValueError, match="HEALTH_PORT"):
+        health.health_port()
+
+
+def ibc_event_names(records: list[dict[str, object]]) -> list[str]:
+    return [str(record["event"]) for record in records]
+
+
+def test_ibc_events_classifies_sample_login_sequences() -> None:
+    """Synthetic IBC output should become one typed event per login step."""
+    ibc_events = load_ibc_events()
+
+    with (FIXTURES_DIR / "ibc_gateway_2fa_login.log").open() as stream:
+        login = list(
+            ibc_events.classify_stream(stream, ibc_events.IbcEventClassifier())
+        )
+    classifier = ibc_events.IbcEventClassifier()
+    with (FIXTURES_DIR / "ibc_existing_session_restart.log").open() as stream:
+        restart = list(ibc_events.classify_stream(stream, classifier))
+
+    assert ibc_event_names(login) == [
+        "ibc_started",
+        "login_started",
+        "twofa_pending",
+        "logged_in",
+        "api_ready",
+    ]
+    assert login[0]["version"] == "3.20.0"
+    assert login[0]["log_time"] == "2024-05-13 09:30:00:412"
+    assert login[2]["message"] == (
+        "IBC: detected dialog entitled: Second Factor Authentication; event=Opened"
+    )
+    assert ibc_event_names(restart) == [
+        "ibc_started",
+        "login_started",
+        "existing_session",
+        "twofa_timeout",
+        "auto_restart",
+        "exit",
+        "exit",
+    ]
+    assert restart[-2]["reason"] == "Closing IBC"
+    assert restart[-1]["status"] == 1
+    assert "log_time" not in restart[-1]
+    assert classifier.counts["exit"] == 2
+
+
+def test_ibc_events_keeps_memory_bounded_and_follows_the_log(
+    tmp_path: Path,
+) -> None:
+    """Overlong lines are cut and the follower survives truncation and rotation."""
+    ibc_events = load_ibc_events()
+    reader = ibc_events.BoundedLineReader(max_line_length=16)
+    chunks = ["IBC: Login has ", "completed" + "x" * 100, "y" * 100, "\nnext\n"]
+    lines = [line for chunk in chunks for line in reader.feed(chunk)]
+    log_path = tmp_path / "ibc.log"
+    log_path.write_text("IBC: Login dialog WINDOW_OPENED\n" + "z" * 50_000 + "\n")
+    follower = ibc_events.LogFollower(log_path, chunk_size=1024)
+    first = list(follower.read_lines())
+    with log_path.open("a") as handle:
+        handle.write("IBC: Login has")
+    partial = list(follower.read_lines())
+    with log_path.open("a") as handle:
+        handle.write(" completed\n")
+    completed = list(follower.read_lines())
+    log_path.write_text("IBC: Closing IBC\n")
+    truncated = list(follower.read_lines())
+    log_path.rename(tmp_path / "ibc.log.1")
+    log_path.write_text("IBC: Starting IBC version 3.20.0\n")
+    rotated = list(follower.read_lines())
+
+    assert lines == ["IBC: Login has c", "next"]
+    assert len(reader.partial) == 0
+    assert [len(line) for line in first] == [31, ibc_events.MAX_LINE_LENGTH]
+    assert partial == []
+    assert completed == ["IBC: Login has completed"]
+    assert truncated == ["IBC: Closing IBC"]
+    assert rotated == ["IBC: Starting IBC version 3.20.0"]
+
+
+def test_ibc_events_follower_does_not_replay_log_after_restart(
+    tmp_path: Path,
+) -> None:
+    """A restarted follower resumes at the end; a log created later is read whole."""
+    ibc_events = load_ibc_events()
+    log_path = tmp_path / "ibc.log"
+    log_path.write_text("IBC: Login has completed\n")
+    restarted = ibc_events.LogFollower(log_path, from_end=True)
+    on_restart = list(restarted.read_lines())
+    with log_path.open("a") as handle:
+        handle.write("IBC: Closing IBC\n")
+    appended = list(restarted.read_lines())
+    later_path = tmp_path / "later.log"
+    fresh = ibc_events.LogFollower(later_path, from_end=True)
+    before_start = list(fresh.read_lines())
+    later_path.write_text("IBC: Starting IBC version 3.20.0\n")
+    created = list(fresh.read_lines())
+
+    assert on_restart == []
+    assert appended == ["IBC: Closing IBC"]
+    assert before_start == []
+    assert created == ["IBC: Starting IBC version 3.20.0"]
+    assert "/tmp/ib-ibc/events.jsonl" in ENTRYPOINT_PATH.read_text()
+
+
+def test_tee_bounded_rotates_the_ibc_log(tmp_path: Path) -> None:
+    """The IBC log copy should rotate instead of growing for the whole IBC run."""
+    log_path = tmp_path / "ibc.log"
+
+    result = run_bash(
+        f"""
+        source "{IB_UTILS_PATH}"
+        printf 'line %s\\n' 1 2 3 4 5 | tee_bounded "{log_path}" 14
+        """
+    )
+
+    assert result.stdout == "line 1\nline 2\nline 3\nline 4\nline 5\n"
+    assert (tmp_path / "ibc.log.1").read_text() == "line 3\nline 4\n"
+    assert log_path.read_text() == "line 5\n"
+    assert "tee_bounded" in START_IBC_PATH.read_text()
+    assert "tee -a" not in START_IBC_PATH.read_text()
+
+
+def test_ibc_events_writes_rotating_json_lines(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Events land in a bounded JSON-lines file, or stdout for a saved log."""
+    ibc_events = load_ibc_events()
+    log_path = tmp_path / "ibc.log"
+    events_path = tmp_path / "events" / "events.jsonl"
+    log_path.write_text((FIXTURES_DIR / "ibc_gateway_2fa_login.log").read_text())
+    writer = ibc_events.EventWriter(tmp_path / "small.jsonl", max_bytes=40)
+    for event in ("login_started", "logged_in", "exit"):
+        writer.write({"event": event})
+
+    exit_code = ibc_events.run(
+        ["--input", str(log_path), "--output", str(events_path), "--once"]
+    )
+    monkeypatch.setattr(
+        sys,
+        "stdin",
+        io.StringIO((FIXTURES_DIR / "ibc_existing_session_restart.log").read_text()),
+    )
+    stdin_exit_code = ibc_events.run(["--input", "-", "--output", "-"])
+    stdout_events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert exit_code == 0
+    assert ibc_event_names(
+        [json.loads(line) for line in events_path.read_text().splitlines()]
+    ) == ["ibc_started", "login_started", "twofa_pending", "logged_in", "api_ready"]
+    assert (tmp_path / "small.jsonl").read_text() == '{"event": "exit"}\n'
+    assert (tmp_path / "small.jsonl.1").read_text() == (
+        '{"event": "login_started"}\n{"event": "logged_in"}\n'
+    )
+    assert stdin_exit_code == 0
+    assert stdout_events[-1]["event"] == "exit"
+    assert "ibc_events" in SUPERVISORD_CONF_PATH.read_text()
+    assert (
+        "COPY --chown=root:root programs/ibc_events.py /usr/local/bin/ibc_events"
+        in DOCKERFILE_PATH.read_text()
+    )
+
+
+def test_jvm_telemetry_parses_gc_log_into_prometheus_metrics() -> None:
+    """GC pauses, heap occupancy, allocation and safepoints should be exported."""
+    telemetry_module = load_jvm_telemetry()
+    telemetry = telemetry_module.GcTelemetry()
+
+    used = [telemetry.record_line(line) for line in GC_LOG_SAMPLE.splitlines()]
+    metrics = telemetry.render()
+
+    assert used == [False, False, True, True, True, True]
+    assert 'jvm_gc_pause_seconds_bucket{kind="Young",le="0.005"} 1' in metrics
+    assert 'jvm_gc_pause_seconds_bucket{kind="Young",le="0.025"} 2' in metrics
+    assert 'jvm_gc_pause_seconds_count{kind="Full"} 1' in metrics
+    assert f"jvm_gc_heap_used_bytes {20 * MIB}" in metrics
+    assert f"jvm_gc_heap_committed_bytes {128 * MIB}" in metrics
+    assert f"jvm_gc_allocated_bytes_total {(64 + 28) * MIB}" in metrics
+    assert "jvm_safepoints_total 1" in metrics
+    assert "jvm_safepoint_max_seconds 0.0038" in metrics
+    assert "# TYPE jvm_gc_pause_seconds histogram" in metrics
+
+
+def test_jvm_telemetry_follows_rotated_gc_logs(tmp_path: Path) -> None:
+    """The sidecar should finish a rotated log before reading the new file."""
+    telemetry_module = load_jvm_telemetry()
+    gc_log = tmp_path / "gc.log"
+    follower = telemetry_module.GcLogFollower(gc_log)
+    lines = GC_LOG_SAMPLE.splitlines()
+
+    assert follower.read_lines() == []
+    gc_log.write_text(lines[0] + "\n" + lines[1][:10])
+    assert follower.read_lines() == [lines[0]]
+    with gc_log.open("a") as handle:
+        handle.write(lines[1][10:] + "\n" + lines[2] + "\n")
+    gc_log.rename(tmp_path / "gc.log.0")
+    gc_log.write_text(lines[4] + "\n")
+
+    assert follower.read_lines() == [lines[1], lines[2], lines[4]]
+
+
+def test_jvm_telemetry_is_opt_in_and_local(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Telemetry should add rotating GC logging and a localhost-only sidecar."""
+    telemetry_module = load_jvm_telemetry()
+    log_path = tmp_path / "telemetry" / "gc.log"
+    supervisor_content = SUPERVISORD_CONF_PATH.read_text()
+    telemetry_program = supervisor_content[
+        supervisor_content.index("[program:jvm_telemetry]") :
+    ]
+
+    assert init_settings.telemetry_opts(log_path) == []
+    monkeypatch.setenv("JVM_TELEMETRY", "yes")
+    opts = init_settings.telemetry_opts(log_path)
+    content = init_settings.render_vmoptions(
+        VMOPTIONS_TEMPLATE_PATH.read_text(),
+        "1024",
+        512,
+        Path("/home/ibuser/tws_settings"),
+        [],
+        jvm_telemetry_opts=opts,
+    )
+
+    assert log_path.parent.is_dir()
+    assert f"# JVM telemetry\n-Xlog:gc*,safepoint:file={log_path}:" in content
+    assert "filecount=5,filesize=10m" in content
+    assert init_settings.JVM_TELEMETRY_LOG_PATH == telemetry_module.GC_LOG_PATH
+    assert "127.0.0.1" in JVM_TELEMETRY_PATH.read_text()
+    assert "command=jvm_telemetry" in telemetry_program
+    assert "startsecs=0" in telemetry_program
+    assert (
+        "COPY --chown=root:root programs/jvm_telemetry.py /usr/local/bin/jvm_telemetry"
+        in DOCKERFILE_PATH.read_text()
+    )
+    monkeypatch.setenv("JVM_TELEMETRY_PORT", "70000")
+    with pytest.raises(ValueError, match="JVM_TELEMETRY_PORT"):
+        init_settings.validate_telemetry_port()
+    monkeypatch.setenv("JVM_TELEMETRY", "no")
+    assert telemetry_module.run([]) == 0
+
+
+def test_jvm_telemetry_exports_session_program_and_heap_metrics(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """One scrape should cover supervisord, login events and the heap decision."""
+    telemetry_module = load_jvm_telemetry()
+    events_path = tmp_path / "events.jsonl"
+    heap_path = tmp_path / "heap.json"
+    events_path.write_text(
+        "\n".join(
+            json.dumps({"time": moment, "event": event})
+            for moment, event in (
+                (100.0, "ibc_started"),
+                (103.0, "login_started"),
+                (110.0, "twofa_pending"),
+                (131.5, "logged_in"),
+                (132.25, "api_ready"),
+            )
+        )
+        + "\nnot json\n"
+    )
+    infos = [
+        {"name": "ibc", "statename": "RUNNING", "start": 1000, "now": 1090},
+        {"name": "xvfb", "statename": "RUNNING", "start": 990, "now": 1090},
+    ]
+    failing = False
+
+    def process_info() -> list[dict[str, object]]:
+        if failing:
+            raise ConnectionRefusedError("supervisord is gone")
+        return [dict(info) for info in infos]
+
+    monkeypatch.delenv("JVM_TELEMETRY", raising=False)
+    monkeypatch.setenv("METRICS", "yes")
+    jvm_opts = init_settings.telemetry_opts(tmp_path / "gc.log")
+    init_settings.record_heap_decision(
+        init_settings.HeapDecision("adaptive", 1536, 768, []), heap_path
+    )
+    telemetry = telemetry_module.ContainerTelemetry(
+        tmp_path / "gc.log", events_path, heap_path, process_info
+    )
+    first = telemetry.collect()
+    infos[0].update(start=1200, now=1260)
+    second = telemetry.collect()
+    failing = True
+    third = telemetry.collect()
+
+    assert jvm_opts == []
+    assert 'ib_ibc_events_total{event="twofa_pending"} 1' in first
+    assert 'ib_login_state{state="logged_in"} 1' in first
+    assert 'ib_login_transitions_total{state="logging_in"} 1' in first
+    assert 'ib_login_transitions_total{state="twofa_pending"} 1' in first
+    assert "ib_api_ready_seconds 32.25" in first
+    assert f'ib_heap_max_bytes{{policy="adaptive"}} {1536 * MIB}' in first
+    assert f'ib_heap_initial_bytes{{policy="adaptive"}} {768 * MIB}' in first
+    assert 'ib_program_uptime_seconds{program="ibc"} 90' in first
+    assert 'ib_program_restarts_total{program="ibc"} 0' in first
+    assert 'ib_program_restarts_total{program="ibc"} 1' in second
+    assert 'ib_program_uptime_seconds{program="ibc"} 60' in second
+    assert 'ib_program_restarts_total{program="xvfb"} 0' in second
+    assert "ib_supervisor_up 1" in second
+    assert "ib_supervisor_up 0" in third
+    assert "ib_program_up" not in third
+    assert init_settings.JVM_TELEMETRY_HEAP_PATH == telemetry_module.HEAP_DECISION_PATH
+    assert load_ibc_events().IBC_EVENTS_PATH == telemetry_module.IBC_EVENTS_PATH
+    assert (
+        telemetry_module.LOGIN_STATE_BY_EVENT == load_ib_health().LOGIN_STATE_BY_EVENT
+    )
+
+
+LEGACY_VMOPTIONS_SKELETON = """\
+-Xmx{{ max_heap }}m
+-Xms{{ initial_heap }}m
+{{ gc_opts }}
+-DjtsConfigDir={{ tws_settings_path }}
+{% if custom_opts %}
+# Custom options
+{% for opt in custom_opts %}
+{{ opt }}
+{% endfor %}
+{% endif %}"""
+VMOPTIONS_SKELETON = """\
+-Xmx{{ max_heap }}m
+-Xms{{ initial_heap }}m
+{% for opt in gc_opts %}
+{{ opt }}
+{% endfor %}
+-DjtsConfigDir={{ tws_settings_path }}
+{% if custom_opts %}
+# Custom options
+{% for opt in custom_opts %}
+{{ opt }}
+{% endfor %}
+{% endif %}"""
+
+
+def legacy_render_vmoptions(context: dict[str, object]) -> str:
+    """Render the skeleton with the str.replace approach the engine replaced."""
+    content = LEGACY_VMOPTIONS_SKELETON
+    for name in ("max_heap", "initial_heap", "tws_settings_path"):
+        content = content.replace(f"{{{{ {name} }}}}", str(context[name]))
+    content = content.replace("{{ gc_opts }}", "\n".join(context["gc_opts"]))
+    block = LEGACY_VMOPTIONS_SKELETON[
+        LEGACY_VMOPTIONS_SKELETON.index("{% if custom_opts %}") :
+    ]
+    custom = "\n".join(context["custom_opts"])
+    return content.replace(block, f"# Custom options\n{custom}" if custom else "")
+
+
+def test_template_engine_matches_legacy_rendering_for_random_inputs(
+    init_settings: ModuleType,
+) -> None:
+    """The compiled engine should reproduce the string-replace output."""
+    rng = random.Random(36)
+    names = frozenset({"max_heap", "initial_heap", "tws_settings_path"}) | {
+        "gc_opts",
+        "custom_opts",
+    }
+    template = init_settings.compile_template(VMOPTIONS_SKELETON, names)
+    shipped = init_settings.compile_template(
+        VMOPTIONS_TEMPLATE_PATH.read_text(), init_settings.VMOPTIONS_TEMPLATE_NAMES
+    )
+    option_pool = [f"-XX:Flag{index}={index}" for index in range(20)]
+
+    for _ in range(200):
+        context = {
+            "max_heap": str(rng.randint(256, 65536)),
+            "initial_heap": rng.randint(64, 256),
+            "tws_settings_path": Path("/home", f"user{rng.randint(0, 9)}", "tws"),
+            "gc_opts": rng.sample(option_pool, rng.randint(1, 4)),
+            "custom_opts": rng.sample(option_pool, rng.randint(0, 3)),
+        }
+        shipped_context = {
+            **context,
+            "cpu_opts": rng.sample(option_pool, rng.randint(0, 2)),
+            "telemetry_opts": [],
+            "cds_opts": rng.sample(option_pool, rng.randint(0, 1)),
+        }
+        rendered = shipped.render(shipped_context)
+
+        # Only trailing newlines differ: block tags drop their own line break.
+        assert template.render(context).rstrip("\n") == (
+            legacy_render_vmoptions(context).rstrip("\n")
+        )
+        assert "{{" not in rendered and "{%" not in rendered
+        for opt in {*shipped_context["gc_opts"], *shipped_context["custom_opts"]}:
+            assert f"\n{opt}\n" in rendered
+
+
+def test_template_engine_rejects_unknown_and_malformed_tags(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Template mistakes should fail at compile time with a line number."""
+    names = frozenset({"max_heap", "custom_opts"})
+    cases = {
+        "-Xmx{{ max_heap }}m\n-Xms{{ initial_heap }}m": "line 2: unknown placeholder",
+        "-Xmx{{ max-heap }}m": "line 1: malformed tag",
+        "{% if custom_opts %}\n-Xss1m\n": "unclosed {% if %}",
+        "{% for opt in custom_opts %}\n{% endif %}": "unsupported tag {% endif %}",
+        "{% if custom_opts and max_heap %}{% endif %}": "unsupported tag",
+        "{{ opt }}": "unknown placeholder opt",
+    }
+
+    for source, message in cases.items():
+        with pytest.raises(ValueError, match=re.escape(message)):
+            init_settings.compile_template(source, names)
+    template = init_settings.compile_template("{{ max_heap }}", names)
+    with pytest.raises(ValueError, match="missing: custom_opts"):
+        template.render({"max_heap": "1"})
+
+    configure_cds_runtime(tmp_path, monkeypatch)
+    monkeypatch.setenv("IB_USER", "user")
+    monkeypatch.setenv("IB_PASSWORD", "password")
+    monkeypatch.setenv("IBC_INI", str(tmp_path / "opt" / "ibc" / "config.ini"))
+    (tmp_path / "home" / "ibuser" / "vmoptions.j2").write_text("{% if custom_opts %}")
+    with pytest.raises(ValueError, match="vmoptions template: unclosed"):
+        init_settings.validate_runtime_environment()
+
+
+def test_healthcheck_benchmark_compares_probe_cpu_cost(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """The status file probe should cost far less CPU than starting Python."""
+    ci = load_ci_module(monkeypatch)
+
+    summary = ci.run_healthcheck_benchmark(3)
+
+    assert set(summary) == {"python_probe", "status_file"}
+    assert summary["status_file"] < summary["python_probe"]
+    with pytest.raises(ValueError, match="at least 1"):
+        ci.run_healthcheck_benchmark(0)
+
+
+def test_template_benchmark_reports_per_call_timings(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """The CI benchmark should time the shipped template end to end."""
+    ci = load_ci_module(monkeypatch)
+
+    summary = ci.run_template_benchmark(3)
+
+    assert set(summary) == {"compile", "render", "render_vmoptions"}
+    assert all(micros > 0 for micros in summary.values())
+    with pytest.raises(ValueError, match="at least 1"):
+        ci.run_template_benchmark(0)
+
+
+def test_env_template_reports_defaults_and_unresolved_variables(
+    init_settings: ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Rendering should record where each value came from without leaking secrets."""
+    template = init_settings.compile_env_template(
+        "IbLoginId=${IB_USER}\nIbPassword=${IB_PASSWORD}\n"
+        "TradingMode=${TRADING_MODE:-paper}\nIbDir=${IB_DIR:-}\n"
+    )
+
+    result = template.render({"IB_USER": "paper-user", "IB_PASSWORD": "hunter2"})
+    report = result.report("ibc.ini")
+
+    assert result.content == (
+        "IbLoginId=paper-user\nIbPassword=hunter2\nTradingMode=paper\nIbDir=\n"
+    )
+    assert result.sources == {
+        "IB_USER": "env",
+        "IB_PASSWORD": "env",
+        "TRADING_MODE": "default",
+        "IB_DIR": "unset",
+    }
+    assert report == (
+        "ibc.ini settings: 4 variables; from env: IB_USER, IB_PASSWORD; "
+        "defaults: TRADING_MODE=paper; unset: IB_DIR"
+    )
+    assert "hunter2" not in report
+    monkeypatch.setenv("TRADING_MODE", "live")
+    assert init_settings.sub_env_vars("${TRADING_MODE:-paper}") == "live"
+
+
+def test_env_template_cache_is_keyed_by_template_content(
+    init_settings: ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """The compiled cache should be reused until the template text changes."""
+    config_path = tmp_path / "ibc.ini"
+    template_path = config_path.with_suffix(".ini.template")
+    cache_path = init_settings.env_template_cache_path(template_path)
+    template_path.write_text("IbLoginId=${IB_USER}\n")
+    monkeypatch.setenv("IB_USER", "paper-user")
+
+    init_settings.render_config_template(template_path, config_path, "ibc.ini")
+    cached = json.loads(cache_path.read_text())
+    compile_env_template = init_settings.compile_env_template
+    monkeypatch.setattr(
+        init_settings,
+        "compile_env_template",
+        lambda content: pytest.fail("cached template was recompiled"),
+    )
+    init_settings.render_config_template(template_path, config_path, "ibc.ini")
+    monkeypatch.setattr(init_settings, "compile_env_template", compile_env_template)
+    template_path.write_text(
+        "IbLoginId=${IB_USER}\nTradingMode=${TRADING_MODE:-paper}\n"
+    )
+    init_settings.render_config_template(template_path, config_path, "ibc.ini")
+
+    assert cache_path.name == ".ibc.ini.template.compiled.json"
+    assert cached["variables"] == [["IB_USER", ""]]
+    assert json.loads(cache_path.read_text())["sha256"] != cached["sha256"]
+    assert config_path.read_text() == "IbLoginId=paper-user\nTradingMode=paper\n"
+    assert "defaults: TRADING_MODE=paper" in capsys.readouterr().out
+
+
+def test_repeated_main_runs_skip_unchanged_config_writes(
+    init_settings: ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """A restart with the same inputs should leave every rendered file untouched."""
+    home = tmp_path / "home" / "ibuser"
+    settings_dir = home / "tws_settings"
+    ibc_ini = tmp_path / "ibc" / "ibc.ini"
+    release_dir = tmp_path / "opt" / "tws" / "stable"
+    settings_dir.mkdir(parents=True)
+    ibc_ini.parent.mkdir()
+    create_ib_release_dir(release_dir, "tws")
+    ibc_ini.with_suffix(".ini.template").write_text("IbLoginId=${IB_USER}\n")
+    (settings_dir / "jts.ini.template").write_text("TimeZone=${TIME_ZONE:-UTC}\n")
+    (home / "vmoptions.j2").write_text(VMOPTIONS_TEMPLATE_PATH.read_text())
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("PROGRAM", "tws")
+    monkeypatch.setenv("IB_RELEASE_DIR", str(release_dir))
+    monkeypatch.setenv("IBC_INI", str(ibc_ini))
+    monkeypatch.setenv("TWS_SETTINGS_PATH", str(settings_dir))
+    monkeypatch.setenv("JAVA_HEAP_SIZE", "1024m")
+    monkeypatch.setenv("IB_USER", "paper-user")
+    monkeypatch.setenv("IB_PASSWORD", "paper-password")
+    monkeypatch.setattr(
+        init_settings,
+        "detect_container_resources",
+        lambda: init_settings.ContainerResources("v2", 4096, None, None, 2.0, 2),
+    )
+    manifest_path = home / init_settings.RENDER_MANIFEST_NAME
+    outputs = [ibc_ini, settings_dir / "jts.ini", release_dir / "tws.vmoptions"]
+
+    def file_stats() -> list[tuple[int, int]]:
+        return [
+            (path.stat().st_ino, path.stat().st_mtime_ns)
+            for path in [*outputs, manifest_path]
+        ]
+
+    init_settings.main()
+    first_stats = file_stats()
+    capsys.readouterr()
+    init_settings.main()
+    second_output = capsys.readouterr().out
+    unchanged_stats = file_stats()
+    monkeypatch.setenv("IB_USER", "live-user")
+    init_settings.main()
+    changed_stats = file_stats()
+    manifest = json.loads(manifest_path.read_text())
+
+    assert unchanged_stats == first_stats
+    assert f"ibc.ini is unchanged: {ibc_ini}" in second_output
+    assert "Updated render manifest" not in second_output
+    assert re.search(r"Validated IB and IBC layout in [0-9.]+ms", second_output)
+    assert re.search(r"Container init completed in [0-9]+ms", second_output)
+    assert changed_stats[0] != first_stats[0]
+    assert changed_stats[1:3] == first_stats[1:3]
+    assert changed_stats[3] != first_stats[3]
+    assert set(manifest) == {str(path) for path in outputs}
+    assert manifest[str(ibc_ini)]["output_sha256"] == (
+        hashlib.sha256(b"IbLoginId=live-user\n").hexdigest()
+    )
+    assert not list(ibc_ini.parent.glob(".*.tmp"))
+
+
+def test_main_writes_launch_plan_that_start_ibc_sources(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """start_ibc should reuse the paths init validated instead of re-resolving them."""
+    home = tmp_path / "home dir" / "ibuser"
+    settings_dir = home / "tws settings"
+    ibc_ini = tmp_path / "ibc" / "ibc.ini"
+    release_dir = tmp_path / "opt" / "ibgateway" / "stable"
+    settings_dir.mkdir(parents=True)
+    ibc_ini.parent.mkdir()
+    create_ib_release_dir(release_dir, "ibgateway")
+    ibc_ini.with_suffix(".ini.template").write_text("IbLoginId=${IB_USER}\n")
+    (settings_dir / "jts.ini.template").write_text("TimeZone=UTC\n")
+    (home / "vmoptions.j2").write_text(VMOPTIONS_TEMPLATE_PATH.read_text())
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("PROGRAM", "ibgateway")
+    monkeypatch.setenv("IB_RELEASE_DIR", str(release_dir))
+    monkeypatch.setenv("IBC_INI", str(ibc_ini))
+    monkeypatch.setenv("TWS_SETTINGS_PATH", str(settings_dir))
+    monkeypatch.setenv("JAVA_HEAP_SIZE", "1024m")
+    monkeypatch.setenv("TRADING_MODE", "live")
+    monkeypatch.setenv("IB_USER", "live-user")
+    monkeypatch.setenv("IB_PASSWORD", "live-password")
+
+    init_settings.main()
+    plan_path = home / init_settings.LAUNCH_PLAN_NAME
+    plan_mtime = plan_path.stat().st_mtime_ns
+    init_settings.main()
+    result = run_bash(
+        f"""
+        source {shlex.quote(str(plan_path))}
+        printf '%s\\n' "$IB_BASE_DIR" "$IB_RELEASE" "$TWS_SETTINGS_PATH" \\
+            "$TRADING_MODE" "$TWOFA_TIMEOUT_ACTION" "${{#IBC_ARGS[@]}}" "${{IBC_ARGS[0]}}"
+        """
+    )
+    start_ibc = START_IBC_PATH.read_text()
+
+    assert plan_path.stat().st_mtime_ns == plan_mtime
+    assert result.stdout.splitlines() == [
+        str(tmp_path / "opt"),
+        "stable",
+        str(settings_dir),
+        "live",
+        "exit",
+        "1",
+        "-g",
+    ]
+    assert 'local launch_plan="${HOME:-}/.ib-launch-plan.sh"' in start_ibc
+    assert start_ibc.index('load_launch_plan "$launch_plan"') < start_ibc.index(
+        "resolve_launch_from_environment\n"
+    )
+
+
+def test_startup_phases_from_shell_and_init_share_one_timeline(
+    init_settings: ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Shell and Python phase events should pair up into one waterfall."""
+    phases_file = tmp_path / "startup" / "phases.jsonl"
+    run_bash(
+        f"""
+        source "{IB_UTILS_PATH}"
+        STARTUP_PHASES_FILE={shlex.quote(str(phases_file))}
+        phase_begin entrypoint
+        phase_begin start_scripts
+        phase_end start_scripts
+        """
+    )
+    init_settings.record_phase("begin", "init.validate")
+    init_settings.record_phase("end", "init.validate")
+    with phases_file.open("a") as handle:
+        handle.write("not json\n")
+    run_bash(
+        f"""
+        source "{IB_UTILS_PATH}"
+        STARTUP_PHASES_FILE={shlex.quote(str(phases_file))}
+        phase_end entrypoint
+        phase_begin ibc
+        """
+    )
+
+    phases = init_settings.load_startup_phases(phases_file)
+    assert init_settings.run(["--startup-report"]) == 0
+    report = capsys.readouterr().out
+    metrics = init_settings.render_startup_metrics(phases)
+
+    assert [phase.name for phase in phases] == [
+        "entrypoint",
+        "start_scripts",
+        "init.validate",
+        "ibc",
+    ]
+    assert all(phase.duration is not None for phase in phases[:3])
+    assert phases[0].start <= phases[2].start <= phases[0].end
+    assert phases[3].end is None
+    assert report.splitlines()[0].split() == ["phase", "start", "duration"]
+    assert re.search(r"^ibc\s+[0-9.]+s\s+running", report, re.MULTILINE)
+    assert 'ib_startup_phase_seconds{phase="init.validate"}' in metrics
+    assert 'phase="ibc"' not in metrics
+
+
+def test_runtime_scripts_record_startup_phases() -> None:
+    """Every startup stage should write to the shared phase timeline."""
+    entrypoint = ENTRYPOINT_PATH.read_text()
+    start_ibc = START_IBC_PATH.read_text()
+    start_xvfb = START_XVFB_PATH.read_text()
+
+    assert entrypoint.index(': >"$STARTUP_PHASES_FILE"') < entrypoint.index(
+        "phase_begin entrypoint"
+    )
+    for phase in ["cleanup_x_server", "start_scripts", "init_container_settings"]:
+        assert f"phase_begin {phase}" in entrypoint
+        assert f"phase_end {phase}" in entrypoint
+    assert entrypoint.index("phase_end entrypoint") < entrypoint.index('exec "$@"')
+    for phase in [
+        "ibc_launch_plan",
+        "x_server_wait",
+        "x_scripts",
+        "ibc_scripts",
+        "ibc",
+    ]:
+        assert f"phase_begin {phase}\n" in start_ibc
+        assert f"phase_end {phase}\n" in start_ibc
+    assert start_xvfb.index("phase_end xvfb_setup") < start_xvfb.index("/usr/bin/Xvfb")
+    assert start_xvfb.index('read -r -t 1 -u "$displayfd"') < start_xvfb.index(
+        "phase_end xvfb_ready"
+    )
+
+
+def test_ibc_warm_restart_skips_x_hooks_and_records_latency(tmp_path: Path) -> None:
+    """An IBC-only restart on the same Xvfb should skip X hooks and time the gap."""
+    warm_file = tmp_path / "warm"
+    exit_file = tmp_path / "exited"
+    phases_file = tmp_path / "phases.jsonl"
+    lock_file = Path("/tmp/.X97-lock")
+    lock_file.write_text("      4242\n")
+    try:
+        result = run_bash(
+            f"""
+            source "{IB_UTILS_PATH}"
+            STARTUP_PHASES_FILE={shlex.quote(str(phases_file))}
+            x_server="$(x_server_pid :97)"
+            echo "pid=$x_server"
+            x_hooks_current {shlex.quote(str(warm_file))} "$x_server" || echo cold
+            printf 'x_server=%s\\n' "$x_server" >{shlex.quote(str(warm_file))}
+            x_hooks_current {shlex.quote(str(warm_file))} "$x_server" && echo warm
+            x_hooks_current {shlex.quote(str(warm_file))} 5151 || echo new-x
+            IBC_WARM_RESTART=no
+            x_hooks_current {shlex.quote(str(warm_file))} "$x_server" || echo disabled
+            report_ibc_restart_latency {shlex.quote(str(exit_file))}
+            mark_ibc_exit {shlex.quote(str(exit_file))}
+            report_ibc_restart_latency {shlex.quote(str(exit_file))}
+            """
+        )
+    finally:
+        lock_file.unlink()
+    start_ibc = START_IBC_PATH.read_text()
+    entrypoint = ENTRYPOINT_PATH.read_text()
+    supervisor_content = SUPERVISORD_CONF_PATH.read_text()
+    ibc_program = supervisor_content[supervisor_content.index("[program:ibc]") :]
+    phases = [
+        json.loads(line)["event"] for line in phases_file.read_text().splitlines()
+    ]
+
+    assert result.stdout.splitlines()[:5] == [
+        "pid=4242",
+        "cold",
+        "warm",
+        "new-x",
+        "disabled",
+    ]
+    assert re.search(r"IBC restarted [0-9]+\.[0-9]{2}s after it exited", result.stdout)
+    assert result.stdout.count("IBC restarted") == 1
+    assert not exit_file.exists()
+    assert phases == ["begin", "end"]
+    assert start_ibc.index("x_hooks_current") < start_ibc.index(
+        'run_script_dir X_SCRIPTS "X"'
+    )
+    assert start_ibc.index("report_ibc_restart_latency") < start_ibc.index(
+        '"${IBC_PATH}/scripts/ibcstart.sh" "${IB_RELEASE}"'
+    )
+    assert start_ibc.count('mark_ibc_exit "$IBC_EXIT_FILE"') == 2
+    assert "rm -f /tmp/ib-ibc/warm /tmp/ib-ibc/exited" in entrypoint
+    assert "startretries=10" in ibc_program.split("\n\n")[0]
+
+
+def test_restart_policy_backs_off_with_jitter_and_caps_the_window() -> None:
+    """Quick restarts should back off exponentially and respect the window cap."""
+    restart_policy = load_restart_policy()
+    policy = restart_policy.RestartPolicy(
+        base_seconds=2, max_seconds=60, window_seconds=600, window_max=4
+    )
+    rng = random.Random(7)
+    history: list[object] = []
+    now = 1000.0
+    plans = []
+    for _ in range(4):
+        attempt, delay, reason = restart_policy.plan_start(policy, history, now, rng)
+        plans.append((attempt, delay, reason))
+        history.append(
+            restart_policy.RestartRecord(
+                "ibc", now, now + delay, attempt, delay, reason
+            )
+        )
+        now += delay + 5
+    capped = restart_policy.plan_start(policy, history, now, rng)
+    stable = restart_policy.plan_start(
+        policy, history[-1:], history[-1].started + 90, rng
+    )
+
+    assert plans[0] == (0, 0.0, "first start")
+    assert [attempt for attempt, _, _ in plans] == [0, 1, 2, 3]
+    for attempt, delay, reason in plans[1:]:
+        backoff = 2 * 2 ** (attempt - 1)
+        assert backoff / 2 <= delay <= backoff
+        assert reason == f"restart {attempt} after a 5s run"
+    assert capped[0] == 4
+    assert capped[1] == pytest.approx(history[0].started + 600 - now)
+    assert capped[2] == "4 starts in the last 600s"
+    assert stable == (0, 0.0, "previous run lasted 90s")
+
+
+def test_restart_policy_reads_env_and_records_history(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, init_settings: ModuleType
+) -> None:
+    """The wrapper should validate its settings, exec the command and log the start."""
+    restart_policy = load_restart_policy()
+    history_dir = tmp_path / "restarts"
+    env = {**os.environ, "RESTART_BACKOFF_BASE_SECONDS": "1"}
+    started = subprocess.run(
+        [
+            sys.executable,
+            str(RESTART_POLICY_PATH),
+            "--history-dir",
+            str(history_dir),
+            "ibc",
+            "sh",
+            "-c",
+            "echo started",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    history = restart_policy.load_history(history_dir / "ibc.jsonl")
+    report = restart_policy.render_history(history_dir)
+    for index in range(restart_policy.HISTORY_LIMIT + 5):
+        restart_policy.record_start(
+            tmp_path / "long.jsonl",
+            restart_policy.RestartRecord("xvfb", index, index, 0, 0.0, "first start"),
+        )
+    supervisor_content = SUPERVISORD_CONF_PATH.read_text()
+
+    assert started.stdout == "started\n"
+    assert [(record.program, record.attempt) for record in history] == [("ibc", 0)]
+    assert report.splitlines()[1].endswith("ibc              0     0.0s  first start")
+    assert len(restart_policy.load_history(tmp_path / "long.jsonl")) == (
+        restart_policy.HISTORY_LIMIT
+    )
+    assert restart_policy.RestartPolicy.from_env() == restart_policy.RestartPolicy()
+    monkeypatch.setenv("RESTART_BACKOFF_BASE_SECONDS", "600")
+    with pytest.raises(ValueError, match="must not exceed"):
+        restart_policy.RestartPolicy.from_env()
+    monkeypatch.setenv("RESTART_WINDOW_MAX", "0")
+    with pytest.raises(ValueError, match="RESTART_WINDOW_MAX"):
+        restart_policy.RestartPolicy.from_env()
+    with pytest.raises(ValueError, match="RESTART_WINDOW_MAX"):
+        init_settings.validate_restart_policy()
+    assert set(init_settings.RESTART_POLICY_ENV_NAMES) == {
+        name for name, _ in restart_policy.POLICY_ENV.values()
+    }
+    for program, command in [
+        ("xvfb", "start_xvfb"),
+        ("ibc", "start_ibc"),
+        ("x11vnc", "start_vnc"),
+    ]:
+        assert f"command=restart_policy {program} {command} " in supervisor_content
+    assert "before FATAL" not in supervisor_content
+    assert "no longer ends in supervisord's FATAL state" in README_PATH.read_text()
+    assert "rm -rf /tmp/ib-restarts" in ENTRYPOINT_PATH.read_text()
+    assert (
+        "COPY --chown=root:root programs/restart_policy.py /usr/local/bin/restart_policy"
+        in DOCKERFILE_PATH.read_text()
+    )
+
+
+def test_atomic_write_keeps_original_when_interrupted(
+    init_settings: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A failed write should leave the live config and no temp file behind."""
+    config_path = tmp_path / "ibc" / "ibc.ini"
+    config_path.parent.mkdir()
+    config_path.write_text("IbLoginId=paper-user\n")
+    config_path.chmod(0o600)
+    replace = os.replace
+
+    def interrupted_replace(source: Path, target: Path) -> None:
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(init_settings.os, "replace", interrupted_replace)
+    with pytest.raises(KeyboardInterrupt):
+        init_settings.atomic_write_text(config_path, "IbLogin")
+    assert config_path.read_text() == "IbLoginId=paper-user\n"
+    monkeypatch.setattr(init_settings.os, "replace", replace)
+    init_settings.atomic_write_text(config_path, "IbLoginId=live-user\n")
+
+    assert config_path.read_text() == "IbLoginId=live-user\n"
+    assert config_path.stat().st_mode & 0o777 == 0o600
+    assert [path.name for path in config_path.parent.iterdir()] == ["ibc.ini"]
+
+
+def test_startup_recovery_repairs_partial_config_writes(
+    init_settings: ModuleType, tmp_path: Path
+) -> None:
+    """Truncated outputs and stale temp files from a killed write should be repaired."""
+    ibc_ini = tmp_path / "ibc" / "ibc.ini"
+    template_path = ibc_ini.with_suffix(".ini.template")
+    fallback_path = tmp_path / "defaults" / "ibc.ini.template"
+    fallback_path.parent.mkdir()
+    fallback_path.write_text("IbLoginId=${IB_USER:-paper-user}\n")
+    manifest = init_settings.RenderManifest(tmp_path / "manifest.json")
+    init_settings.render_config_template(
+        template_path, ibc_ini, "ibc.ini", fallback_path, manifest
+    )
+    manifest.save()
+    stale_path = ibc_ini.with_name(".ibc.ini.4242.tmp")
+    stale_path.write_text("IbLog")
+    ibc_ini.write_text("IbLog")
+    template_path.unlink()
+
+    manifest = init_settings.load_render_manifest(tmp_path / "manifest.json")
+    damaged = init_settings.recover_partial_writes(manifest)
+    init_settings.render_config_template(
+        template_path, ibc_ini, "ibc.ini", fallback_path, manifest
+    )
+
+    assert damaged == {ibc_ini}
+    assert not stale_path.exists()
+    assert ibc_ini.read_text() == "IbLoginId=paper-user\n"
+    assert template_path.read_text() == fallback_path.read_text()
+
+
+def test_startup_recovery_keeps_runtime_edits_to_jts_ini(
+    init_settings: ModuleType, tmp_path: Path
+) -> None:
+    """IB rewrites jts.ini while it runs; only an unparseable output is damaged."""
+    jts_ini = tmp_path / "tws_settings" / "jts.ini"
+    template_path = jts_ini.with_suffix(".ini.template")
+    fallback_path = tmp_path / "defaults" / "jts.ini"
+    fallback_path.parent.mkdir()
+    fallback_path.write_text("[Logon]\nTimeZone=${TIME_ZONE:-UTC}\n")
+    ibc_ini = tmp_path / "ibc" / "ibc.ini"
+    ibc_ini.parent.mkdir()
+    ibc_ini.write_text("IbLoginId=paper-user\n")
+    manifest = init_settings.RenderManifest(tmp_path / "manifest.json")
+    init_settings.render_config_template(
+        template_path, jts_ini, "jts.ini", fallback_path, manifest
+    )
+    manifest.record(ibc_ini, ibc_ini, "", ibc_ini.read_text())
+    manifest.save()
+    ib_edited = "[Logon]\nTimeZone=UTC\n\n[IBGateway]\nApiOnly=true\n"
+    jts_ini.write_text(ib_edited)
+    template_path.unlink()
+    ibc_ini.write_text("IbLoginId=paper-user\nIbPass")
+
+    manifest = init_settings.load_render_manifest(tmp_path / "manifest.json")
+    damaged = init_settings.recover_partial_writes(manifest)
+    init_settings.render_config_template(
+        template_path, jts_ini, "jts.ini", fallback_path, manifest
+    )
+
+    assert damaged == {ibc_ini}
+    assert jts_ini.read_text() == ib_edited